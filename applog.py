@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+
+import settings
+from utils import rotate_file
+
+# アプリケーションのログ（標準の logging を使い、ファイルへは専用スレッドがまとめて書き込む）
+# 使い方: log = applog.get_logger('auth'); log.debug("cookie path=%s", path)
+#   - メッセージは % 形式の引数で渡す（出力しないレベルでは文字列を組み立てない）
+#   - 引数の計算自体に手間がかかる場合は `if log.isEnabledFor(logging.DEBUG):` で囲む
+#   - 任意の値は extra={'site_id': 1} のように渡すとそのまま項目として出力される
+# 1行1件の JSON で、リクエスト中であればリクエスト ID・ルート・ユーザー ID・経過時間を付ける。
+# LOG_LEVEL が 'OFF' の場合はハンドラーを設定せず、すべて捨てる。
+
+ROOT_NAME = 'maintainview'
+REQUEST_ID_KEY = 'maintainview.request_id'
+REQUEST_START_KEY = 'maintainview.request_start'
+
+# LogRecord が標準で持つ属性（これ以外は extra で渡された項目として出力する）
+_RECORD_ATTRS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+# 書き込みスレッドへの終了の合図
+_STOP = object()
+
+def get_logger(name=None):
+    return logging.getLogger(f'{ROOT_NAME}.{name}' if name else ROOT_NAME)
+
+def enabled(level=logging.DEBUG):
+    return get_logger().isEnabledFor(level)
+
+def begin_request(environ):
+    # 経過時間の起点（index.py の before_request で、ログが有効な場合のみ設定する）
+    environ[REQUEST_START_KEY] = time.perf_counter()
+
+class RequestContextFilter(logging.Filter):
+    # 出力するレコードにだけ、リクエストの情報を付ける（呼び出し元のスレッドで実行される）
+    def __init__(self, root=None):
+        super().__init__()
+        # ルート名にマウント先の接頭辞を付けるための Bottle アプリ（接頭辞は最初の出力時に調べる）
+        self.root = root
+        self.prefixes = None
+
+    def route_rule(self, route):
+        if self.prefixes is None:
+            from profiling import mount_prefixes
+            self.prefixes = mount_prefixes(self.root) if self.root is not None else {}
+        return self.prefixes.get(id(route.app), '') + route.rule
+
+    def filter(self, record):
+        from bottle import request
+        try:
+            environ = request.environ
+        except (RuntimeError, AttributeError):
+            # リクエスト外（コマンドラインのツールなど）
+            return True
+        if REQUEST_ID_KEY not in environ:
+            environ[REQUEST_ID_KEY] = uuid.uuid4().hex[:12]
+        record.request_id = environ[REQUEST_ID_KEY]
+        route = environ.get('bottle.route')
+        record.route = f"{environ.get('REQUEST_METHOD', '')} {self.route_rule(route)}" if route is not None else None
+        record.path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        # ユーザーはリクエスト内で既に読み込まれている場合のみ（ログのために SQL を実行しない）
+        user = environ.get('maintainview.user')
+        record.user_id = user.id if user else None
+        start = environ.get(REQUEST_START_KEY)
+        record.elapsed_ms = round((time.perf_counter() - start) * 1000, 2) if start else None
+        return True
+
+class BatchFileHandler(logging.Handler):
+    # emit はメッセージを確定してキューに積むだけで、ファイルへの書き込みは専用スレッドが
+    # batch_size 件または flush_seconds 秒毎にまとめて行う（リクエストの処理を待たせない）
+    def __init__(self, path, batch_size=200, flush_seconds=1.0, max_bytes=0, backups=0):
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def emit(self, record):
+        try:
+            entry = {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+                'level': record.levelname,
+                'logger': record.name,
+                # 引数は呼び出し時点の値で確定させる（後から変更されるオブジェクトもあるため）
+                'message': record.getMessage()
+            }
+            for key, value in record.__dict__.items():
+                if key not in _RECORD_ATTRS and value is not None:
+                    entry[key] = value
+            if record.exc_info:
+                entry['exception'] = logging.Formatter().formatException(record.exc_info)
+        except Exception:
+            self.handleError(record)
+            return
+        self._ensure_thread()
+        self.queue.put(entry)
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='applog-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch, waiters, stop = [], [], False
+            item = self.queue.get()
+            deadline = time.monotonic() + self.flush_seconds
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    # flush() の呼び出し元（ここまでの分を書いたら知らせる）
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or waiters or len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def _write(self, batch):
+        data = ''.join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in batch).encode('utf-8')
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if self.max_bytes:
+                try:
+                    if os.path.getsize(self.path) + len(data) > self.max_bytes:
+                        rotate_file(self.path, self.backups)
+                except OSError:
+                    pass
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError:
+            # 書き込めない場合は標準エラーへ（CGI ではサーバーのエラーログに残る）
+            sys.stderr.write(data.decode('utf-8'))
+
+    def flush(self, timeout=5):
+        # キューに積まれた分を書き終えるまで待つ
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join(5)
+        self._thread = None
+        super().close()
+
+def configure(level=None, path=None, root=None):
+    # settings.LOG_LEVEL / LOG_PATH に従ってハンドラーを設定し直す（index.py の読み込み時に呼ぶ）
+    logger = get_logger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.propagate = False
+    level = (level or settings.LOG_LEVEL or 'OFF').upper()
+    if level == 'OFF':
+        # すべてのレベルが無効（isEnabledFor のみで捨てられる）
+        logger.setLevel(logging.CRITICAL + 1)
+        return logger
+    logger.setLevel(level)
+    handler = BatchFileHandler(path or settings.LOG_PATH, batch_size=settings.LOG_BATCH_SIZE,
+                               flush_seconds=settings.LOG_FLUSH_SECONDS,
+                               max_bytes=settings.LOG_MAX_BYTES, backups=settings.LOG_BACKUPS)
+    handler.addFilter(RequestContextFilter(root))
+    logger.addHandler(handler)
+    return logger
+
+def flush():
+    for handler in get_logger().handlers:
+        handler.flush()
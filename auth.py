@@ -1,12 +1,16 @@
 import hashlib
+import logging
 import os
 import secrets
 from itsdangerous import URLSafeSerializer, BadSignature
-from bottle import request, response, redirect
-from models import User
+from bottle import request, response, redirect, abort
+from peewee import JOIN
+from models import User, Site, Request, SharedFile
 from settings import SECRET_KEY, READ_ONLY_MODE
+import applog
 
 serializer = URLSafeSerializer(SECRET_KEY)
+log = applog.get_logger('auth')
 
 def hash_password(password, salt=None):
     if salt is None:
@@ -25,11 +29,11 @@ def verify_password(password, stored_password):
 def get_session():
     import settings
     session_data = request.get_cookie("session", secret=settings.SECRET_KEY)
-    
-    if getattr(settings, 'IS_CGI', False):
-        import sys
-        print(f"DEBUG: get_session - cookie: {'present' if request.get_cookie('session') else 'absent'}, decoded: {'success' if session_data else 'failed'}", file=sys.stderr)
-        
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("get_session: cookie %s, decoded %s",
+                  'present' if request.get_cookie('session') else 'absent', 'success' if session_data else 'failed')
+
     if session_data:
         return session_data
     return {}
@@ -57,10 +61,7 @@ def set_session(data):
     if cookie_path.endswith('/') and len(cookie_path) > 1:
         cookie_path = cookie_path[:-1]
 
-    # デバッグ用にパスを出力
-    if getattr(settings, 'IS_CGI', False):
-        import sys
-        print(f"DEBUG: set_cookie path={cookie_path}, SCRIPT_NAME={script_name}, data_keys={list(data.keys())}", file=sys.stderr)
+    log.debug("set_session: cookie path=%s, SCRIPT_NAME=%s, keys=%s", cookie_path, script_name, data.keys())
 
     # 確実に同一のSECRET_KEYを使用するため、グローバルな SECRET_KEY ではなく settings.SECRET_KEY を参照
     # （インポートタイミングによる不一致を防ぐ）
@@ -69,15 +70,28 @@ def set_session(data):
     if cookie_path != '/':
         response.set_cookie("session", data, secret=settings.SECRET_KEY, path='/', httponly=True)
 
+    # セッションが変わったのでリクエスト内の CSRF トークンのキャッシュを破棄
+    # （ユーザーは CSRF トークンの発行などで変わらない場合はそのまま使う。ログ・アクセスの記録もこれを参照する）
+    cached = request.environ.get('maintainview.user')
+    if cached is None or cached.id != data.get('user_id'):
+        request.environ.pop('maintainview.user', None)
+    request.environ.pop('maintainview.csrf_token', None)
+
 def get_current_user():
+    # login_required とルート本体の両方から呼ばれるため、リクエスト単位でキャッシュする
+    if 'maintainview.user' in request.environ:
+        return request.environ['maintainview.user']
+
+    user = None
     session = get_session()
     user_id = session.get('user_id')
     if user_id:
         try:
-            return User.get_by_id(user_id)
+            user = User.get_by_id(user_id)
         except User.DoesNotExist:
-            return None
-    return None
+            user = None
+    request.environ['maintainview.user'] = user
+    return user
 
 def login_required(role=None):
     def decorator(func):
@@ -91,30 +105,97 @@ def login_required(role=None):
         return wrapper
     return decorator
 
+def check_client_access(site_id=None, client_id=None, request_id=None):
+    # クライアントの所有権チェック（外部キーを辿らず client_id を直接比較する）
+    user = get_current_user()
+    if not user or user.role != 'client':
+        abort(403)
+    if client_id and user.client_id != client_id:
+        abort(403)
+    if site_id:
+        site = Site.get_or_none(Site.id == site_id)
+        if site is None:
+            abort(404)
+        if site.client_id != user.client_id:
+            abort(403)
+        return site
+    if request_id:
+        req = Request.get_or_none(Request.id == request_id)
+        if req is None:
+            abort(404)
+        if req.client_id != user.client_id:
+            abort(403)
+        return req
+    return None
+
+def check_file_access(file_id):
+    # ファイルの所属クライアントをサイト・依頼の両経路から1クエリで取得して判定する
+    user = get_current_user()
+    f = (SharedFile
+         .select(SharedFile,
+                 Site.client.alias('site_client_id'),
+                 Request.client.alias('request_client_id'))
+         .join(Site, JOIN.LEFT_OUTER, on=(SharedFile.site == Site.id))
+         .switch(SharedFile)
+         .join(Request, JOIN.LEFT_OUTER, on=(SharedFile.request == Request.id))
+         .where(SharedFile.id == file_id)
+         .objects()
+         .first())
+    if f is None:
+        abort(404, "File not found")
+    if f.is_deleted:
+        abort(404, "File is deleted")
+
+    # 管理者は全アクセス可（ただし削除済みは上記で弾いている）
+    if user.role == 'admin':
+        return f
+
+    if not f.client_visible:
+        abort(403, "Access denied")
+    # サイト所属チェック
+    if f.site_id and f.site_client_id != user.client_id:
+        abort(403, "Access denied")
+    # 依頼所属チェック
+    if f.request_id and f.request_client_id != user.client_id:
+        abort(403, "Access denied")
+    return f
+
 def generate_csrf_token():
+    # 新規発行したトークンは Cookie が返ってくるまでセッションから読めないため、
+    # 同じリクエスト内で複数回呼ばれても同じ値を返すようにキャッシュする
+    if 'maintainview.csrf_token' in request.environ:
+        return request.environ['maintainview.csrf_token']
     session = get_session()
     if 'csrf_token' not in session:
         session['csrf_token'] = secrets.token_hex(32)
         set_session(session)
+    request.environ['maintainview.csrf_token'] = session['csrf_token']
     return session['csrf_token']
 
+def peek_csrf_token():
+    # 発行済みのトークンを返す（未発行でも新たには発行しない）
+    if 'maintainview.csrf_token' in request.environ:
+        return request.environ['maintainview.csrf_token']
+    return get_session().get('csrf_token')
+
 def check_csrf_token():
     import settings
     
-    token = request.forms.decode().get('csrf_token')
+    # フォーム送信以外（分割アップロードの PUT など）はヘッダーでトークンを受け付ける
+    # 本文をフォームとして解析するのはフォーム送信のときだけ（分割データなどを読み込まずに拒否する）
+    token = request.get_header('X-CSRF-Token')
+    if not token:
+        content_type = (request.content_type or '').split(';', 1)[0].strip().lower()
+        if content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+            token = request.forms.decode().get('csrf_token')
     session = get_session()
-    
-    if getattr(settings, 'IS_CGI', False):
-        import sys
-        print(f"DEBUG: check_csrf_token - form_token: {token}, session_token: {session.get('csrf_token')}", file=sys.stderr)
 
     if not token or token != session.get('csrf_token'):
         from bottle import abort
-        # デバッグ情報をエラーメッセージに含める（開発・トラブルシューティング時のみ。本番では隠すべきだが現状解決優先）
-        msg = "CSRF token missing or invalid."
-        if getattr(settings, 'IS_CGI', False):
-            msg += f" (form: {token[:8] if token else 'None'}..., session: {session.get('csrf_token')[:8] if session.get('csrf_token') else 'None'}...)"
-        abort(403, msg)
+        # トークンの値は記録しない（有無と一致したかのみ）
+        log.warning("CSRF token rejected: form token %s, session token %s",
+                    'present' if token else 'missing', 'present' if session.get('csrf_token') else 'missing')
+        abort(403, "CSRF token missing or invalid.")
 
     # 読み取り専用モードのチェック（CSRFチェックの後に実行）
     # ログイン画面自体は許可する
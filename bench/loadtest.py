@@ -0,0 +1,352 @@
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+from work_settings import use_work_dir
+
+# 同時アクセスの負荷試験
+#   python bench/loadtest.py --clients 50 --admins 5 --duration 60
+#   python bench/loadtest.py --db data/bench.db --duration 120   # seed_scale.py で作成済みのデータ（コピーして使用）
+# ローカルにサーバー（wsgiref のスレッド版。1つの SQLite ファイルを共有）を起動し、
+# クライアント・管理者の仮想ユーザーが重み付きのセッション（ログイン・ダッシュボード・レポート・添付付き返信など）を
+# 繰り返す。操作毎の応答時間（p50/p95/p99）、エラー率、SQLite のロック（database is locked）の発生率、
+# 一定間隔毎のスループットを出力する。
+# 本番の CGI（リクエスト毎にプロセス起動）とはプロセスモデルが異なるため、絶対値ではなく変更前後の比較に使うこと。
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+PASSWORDS = {'admin': 'admin', 'client': 'client'}
+ATTACHMENT_BYTES = 20 * 1024
+
+# (セッション名, 重み)
+CLIENT_SESSIONS = [('browse', 50), ('report', 30), ('reply', 20)]
+ADMIN_SESSIONS = [('triage', 60), ('review', 40)]
+
+def serve(db_path, work_dir, port):
+    # 子プロセス: ベンチマーク用の設定でアプリを起動する（記録・計測の出力先は作業用ディレクトリ）
+    settings = use_work_dir(work_dir, db_path)
+    settings.IS_CGI = False
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    import bottle
+    # エラー画面に例外の内容を出し、ロックによる失敗を判別できるようにする
+    bottle.debug(True)
+    import index
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+        request_queue_size = 256
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    httpd = make_server('127.0.0.1', port, index.application, ThreadingWSGIServer, QuietHandler)
+    httpd.serve_forever()
+
+def prepare_db(work_dir, db_path, clients, admins):
+    # 計測用のデータベースを用意し、(管理者, クライアント) のユーザー情報を返す
+    from peewee import SqliteDatabase
+    from models import set_db, db, User, Request, Site, Client
+    target = os.path.join(work_dir, 'loadtest.db')
+    if db_path:
+        shutil.copyfile(db_path, target)
+    else:
+        import seed_scale
+        seed_scale.generate(target, clients=max(clients, 1), sites=3, logs=150, requests=20, messages=3, files=5)
+    set_db(SqliteDatabase(target))
+    admin = User.get(User.email == 'admin@example.com')
+    # 管理者が足りなければ同じパスワードで追加する
+    with db.atomic():
+        for i in range(2, admins + 1):
+            email = f'admin{i}@example.com'
+            if not User.select().where(User.email == email).exists():
+                User.insert(email=email, password_hash=admin.password_hash, role='admin').execute()
+    admin_users = [{'email': 'admin@example.com', 'requests': []}] + \
+        [{'email': f'admin{i}@example.com', 'requests': []} for i in range(2, admins + 1)]
+    all_requests = [r for r, in Request.select(Request.id).order_by(Request.id).tuples()]
+    for user in admin_users:
+        user['requests'] = all_requests
+        user['sites'] = [s for s, in Site.select(Site.id).order_by(Site.id).limit(200).tuples()]
+        user['clients'] = [c for c, in Client.select(Client.id).order_by(Client.id).limit(200).tuples()]
+    client_users = []
+    for user in User.select().where(User.role == 'client').order_by(User.id).limit(clients):
+        client_users.append({
+            'email': user.email,
+            'requests': [r for r, in Request.select(Request.id).where(Request.client == user.client_id).tuples()],
+            'sites': [s for s, in Site.select(Site.id).where(Site.client == user.client_id).tuples()]
+        })
+    db.close()
+    if len(client_users) < clients:
+        print(f"warning: only {len(client_users)} client users in the database", file=sys.stderr)
+    return target, admin_users, client_users
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _wait_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/api/version', timeout=1).read()
+            return
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    for name, (filename, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+class Recorder(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (開始からの秒数, 操作名, 応答時間(秒), 結果 'ok' / 'error' / 'locked')
+        self.samples = []
+        self.started = time.perf_counter()
+
+    def add(self, name, elapsed, outcome):
+        with self.lock:
+            self.samples.append((time.perf_counter() - self.started, name, elapsed, outcome))
+
+class VirtualUser(object):
+    def __init__(self, base_url, role, user, recorder, rng, think):
+        self.base_url = base_url
+        self.role = role
+        self.user = user
+        self.recorder = recorder
+        self.rng = rng
+        self.think = think
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.csrf_token = None
+
+    def request(self, name, path, data=None, content_type=None, expect=None):
+        # リダイレクト（POST 後の表示など）は1つの操作として計測する
+        # expect を指定した場合、応答にその文字列がなければ失敗として扱う（保存されずに表示だけ成功した場合など）
+        headers = {}
+        if content_type:
+            headers['Content-Type'] = content_type
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        start = time.perf_counter()
+        outcome = 'ok'
+        body = ''
+        try:
+            with self.opener.open(req, timeout=60) as res:
+                body = res.read().decode('utf-8', 'replace')
+            if expect is not None and expect not in body:
+                outcome = 'error'
+        except urllib.error.HTTPError as e:
+            body = e.read().decode('utf-8', 'replace')
+            outcome = 'locked' if 'database is locked' in body else 'error'
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            outcome = 'error'
+        self.recorder.add(name, time.perf_counter() - start, outcome)
+        match = re.search(r'name="csrf_token" value="([^"]+)"', body)
+        if match:
+            self.csrf_token = match.group(1)
+        if self.think:
+            time.sleep(self.rng.uniform(0, self.think))
+        return outcome == 'ok'
+
+    def post(self, name, path, fields, files=None, expect=None):
+        fields = dict(fields, csrf_token=self.csrf_token or '')
+        if files:
+            data, content_type = _multipart(fields, files)
+        else:
+            data = urllib.parse.urlencode(fields).encode('utf-8')
+            content_type = 'application/x-www-form-urlencoded'
+        return self.request(name, path, data, content_type, expect)
+
+    def login(self):
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.request('login_page', '/login')
+        return self.post('login', '/login', {'email': self.user['email'], 'password': PASSWORDS[self.role]})
+
+    def reply(self, prefix, path, extra=None):
+        if not self.request(f'{prefix}_request_detail', path):
+            return
+        # ALLOWED_EXTENSIONS の拡張子（それ以外は添付が保存されず、返信だけが作成される）
+        filename = f'attachment-{self.rng.randrange(10 ** 6)}.txt'
+        attachment = (filename, os.urandom(ATTACHMENT_BYTES))
+        fields = dict(extra or {}, body='負荷試験からの返信です。')
+        # 返信後の詳細画面に添付のファイル名が表示されなければ失敗
+        self.post(f'{prefix}_reply', path, fields, {'file': attachment}, expect=filename)
+
+    def run_session(self):
+        choices = CLIENT_SESSIONS if self.role == 'client' else ADMIN_SESSIONS
+        session = self.rng.choices([c[0] for c in choices], [c[1] for c in choices])[0]
+        if not self.login():
+            return
+        requests = self.user['requests']
+        sites = self.user['sites']
+        if self.role == 'client':
+            self.request('client_dashboard', '/client/')
+            if session == 'browse':
+                self.request('client_logs', '/client/logs')
+                if sites:
+                    self.request('client_site_detail', f'/client/sites/{self.rng.choice(sites)}')
+            elif session == 'report':
+                self.request('client_report_monthly', '/client/reports/monthly')
+                self.request('client_report_print', '/client/reports/monthly/print')
+            elif session == 'reply' and requests:
+                self.request('client_requests', '/client/requests')
+                self.reply('client', f'/client/requests/{self.rng.choice(requests)}')
+        else:
+            self.request('admin_dashboard', '/admin/')
+            if session == 'triage':
+                self.request('admin_requests', '/admin/requests?status=new')
+                if requests:
+                    self.reply('admin', f'/admin/requests/{self.rng.choice(requests)}', {'action': 'add_message'})
+            elif session == 'review' and sites:
+                self.request('admin_site_logs', f'/admin/sites/{self.rng.choice(sites)}/logs')
+                self.request('admin_report_monthly', f"/admin/reports/monthly/{self.rng.choice(self.user['clients'])}")
+        self.request('logout', '/logout')
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(samples, duration, interval):
+    routes = {}
+    for _, name, elapsed, outcome in samples:
+        routes.setdefault(name, []).append((elapsed, outcome))
+    per_route = {}
+    for name, rows in sorted(routes.items()):
+        times = sorted(e * 1000 for e, _ in rows)
+        per_route[name] = {
+            'count': len(rows),
+            'p50_ms': round(_percentile(times, 50), 1),
+            'p95_ms': round(_percentile(times, 95), 1),
+            'p99_ms': round(_percentile(times, 99), 1),
+            'max_ms': round(times[-1], 1),
+            'errors': sum(1 for _, o in rows if o == 'error'),
+            'locked': sum(1 for _, o in rows if o == 'locked')
+        }
+    timeline = []
+    buckets = int(duration // interval) + 1
+    for i in range(buckets):
+        rows = [s for s in samples if i * interval <= s[0] < (i + 1) * interval]
+        if not rows and i == buckets - 1:
+            continue
+        timeline.append({
+            'start_s': i * interval,
+            'requests': len(rows),
+            'rps': round(len(rows) / interval, 1),
+            'errors': sum(1 for s in rows if s[3] == 'error'),
+            'locked': sum(1 for s in rows if s[3] == 'locked')
+        })
+    total = len(samples)
+    return {
+        'total_requests': total,
+        'duration_s': round(duration, 1),
+        'throughput_rps': round(total / duration, 1) if duration else 0,
+        'error_rate': round(sum(1 for s in samples if s[3] == 'error') / total, 4) if total else 0,
+        'lock_rate': round(sum(1 for s in samples if s[3] == 'locked') / total, 4) if total else 0,
+        'routes': per_route,
+        'timeline': timeline
+    }
+
+def print_report(report):
+    print(f"{'operation':<26}{'count':>7}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'errors':>8}{'locked':>8}")
+    for name, row in report['routes'].items():
+        print(f"{name:<26}{row['count']:>7}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+              f"{row['max_ms']:>10}{row['errors']:>8}{row['locked']:>8}")
+    print()
+    print(f"{'t(s)':>6}{'req/s':>8}{'errors':>8}{'locked':>8}")
+    for row in report['timeline']:
+        print(f"{row['start_s']:>6}{row['rps']:>8}{row['errors']:>8}{row['locked']:>8}")
+    print()
+    print(f"total: {report['total_requests']} requests in {report['duration_s']}s "
+          f"({report['throughput_rps']} req/s), error rate {report['error_rate']:.2%}, lock rate {report['lock_rate']:.2%}")
+
+def main():
+    parser = argparse.ArgumentParser(description='同時アクセスの負荷試験')
+    parser.add_argument('--db', help='使用するデータベース（コピーして使う。省略時は一時データを生成）')
+    parser.add_argument('--clients', type=int, default=50, help='クライアントの同時ユーザー数')
+    parser.add_argument('--admins', type=int, default=5, help='管理者の同時ユーザー数')
+    parser.add_argument('--duration', type=float, default=60, help='実行時間（秒）')
+    parser.add_argument('--ramp-up', type=float, default=5, help='全ユーザーが動き出すまでの秒数')
+    parser.add_argument('--think', type=float, default=0.5, help='操作間の待ち時間の上限（秒）')
+    parser.add_argument('--interval', type=float, default=5, help='スループットを集計する間隔（秒）')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='結果を JSON で保存するファイル')
+    parser.add_argument('--serve', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve[0], args.serve[1], int(args.serve[2]))
+        return 0
+
+    work_dir = tempfile.mkdtemp(prefix='mv-loadtest-')
+    server = None
+    try:
+        db_path, admin_users, client_users = prepare_db(work_dir, args.db, args.clients, args.admins)
+        port = _free_port()
+        # サーバー側の DeprecationWarning 等で出力が埋もれないようにする
+        env = dict(os.environ, PYTHONWARNINGS='ignore')
+        server = subprocess.Popen([sys.executable, __file__, '--serve', db_path, work_dir, str(port)], cwd=ROOT, env=env)
+        base_url = f'http://127.0.0.1:{port}'
+        _wait_ready(base_url)
+
+        recorder = Recorder()
+        deadline = time.perf_counter() + args.duration
+        users = [('client', u) for u in client_users] + [('admin', u) for u in admin_users]
+        threads = []
+
+        def worker(index, role, user):
+            rng = random.Random(args.seed * 100003 + index)
+            time.sleep(args.ramp_up * index / max(1, len(users)))
+            vu = VirtualUser(base_url, role, user, recorder, rng, args.think)
+            while time.perf_counter() < deadline:
+                vu.run_session()
+
+        recorder.started = time.perf_counter()
+        for index, (role, user) in enumerate(users):
+            thread = threading.Thread(target=worker, args=(index, role, user), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - recorder.started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = summarize(recorder.samples, duration, args.interval)
+    report['users'] = {'clients': len(client_users), 'admins': len(admin_users)}
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
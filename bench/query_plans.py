@@ -0,0 +1,508 @@
+import argparse
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from routes import prepare
+
+# 全画面の SQL の実行計画の確認（インデックスの不足を見つける）
+#   python bench/query_plans.py                          # 一時データ（bench/routes.py と同じ規模）で確認
+#   python bench/query_plans.py --db data/bench.db       # seed_scale.py で作成済みのデータ（コピーして使用）
+#   python bench/query_plans.py --fail-above 100000      # 推定コストがこれを超える不足インデックスがあれば終了コード 1
+# 全ての GET のルートを管理者・クライアントとして表示し、実行された SQL を重複を除いて集め、
+# それぞれ EXPLAIN QUERY PLAN で以下を検出する:
+#   - 全件の走査（SCAN t。インデックスを使わない）
+#   - ORDER BY / GROUP BY / DISTINCT のための一時 B-tree（並べ替え）
+#   - 相関サブクエリ、外側の行で絞り込まれない IN / NOT IN のサブクエリ
+# コストは「読む行数の推定値（ANALYZE の統計による上限）× 実行回数」で、不足しているインデックス毎に合計して並べる。
+# 生成データにない行（テンプレート・注意事項・プロファイル・分割アップロード）はコピー側に作成し、URL の引数を埋める。
+# 更新系（POST）のルートは入力を組み立てられないため対象外。
+
+# 走査: SCAN t1 / SCAN t1 USING INDEX x / SEARCH t1 USING INDEX x (a=? AND b>?)
+_LOOP = re.compile(r'^(SCAN|SEARCH) (?:TABLE )?(\S+)(?: AS (\S+))?(.*)$')
+_CONSTRAINTS = re.compile(r'\(([^()]*)\)')
+_USING_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\S+)')
+_ALIAS = re.compile(r'"(\w+)" AS "(\w+)"')
+# "t1"."site_id" = ? / "t1"."site_id" = "t2"."id" / "t1"."status" IN (...)
+_COMPARISON = re.compile(r'"(\w+)"\."(\w+)"\s*(=|!=|<>|<=|>=|<|>|NOT IN|IN|IS NOT|IS|LIKE|GLOB)\s*(?:"(\w+)"\."(\w+)")?')
+_ORDER_BY = re.compile(r'ORDER BY (.*?)(?: LIMIT | OFFSET |$)')
+_ORDER_COLUMN = re.compile(r'"(\w+)"\."(\w+)"( DESC)?')
+_IN_LIST = re.compile(r'IN \((?:\?, )*\?\)')
+
+EQUALITY_OPS = {'=', 'IN'}
+RANGE_OPS = {'<', '>', '<=', '>='}
+
+def all_get_routes(app):
+    # [(URL のパターン, 対象ユーザー)]（マウントしたアプリのルートも含む）
+    from profiling import mount_prefixes
+    prefixes = mount_prefixes(app)
+    apps = [(app, '')]
+    for route in app.routes:
+        target = route.config.get('mountpoint.target')
+        # マウントは /admin と /admin/<:re:.*> の2つのルートになる
+        if target is not None and all(target is not a for a, _ in apps):
+            apps.append((target, prefixes.get(id(target), '')))
+    rules = []
+    for sub_app, prefix in apps:
+        for route in sub_app.routes:
+            if route.config.get('mountpoint.target') is not None or route.method != 'GET':
+                continue
+            rule = prefix + route.rule
+            if rule.startswith('/admin'):
+                roles = ['admin']
+            elif rule.startswith('/client'):
+                roles = ['client']
+            else:
+                roles = ['admin', 'client']
+            rules.append((rule, roles))
+    return rules
+
+def create_samples(client, site):
+    # 生成データにない行を作る（全ルートを表示するため。コピーした一時データベースなので元のデータは変わらない）
+    import cProfile
+    import profile_capture
+    from models import User, Notice, LogTemplate
+    from chunked_upload import create_upload
+    if not Notice.select().where(Notice.site == site).exists():
+        Notice.create(site=site, title='実行計画の確認', body='query_plans.py が作成した注意事項',
+                      is_visible_to_client=True)
+    if not LogTemplate.select().exists():
+        LogTemplate.create(name='実行計画の確認', category='Update', summary='query_plans.py が作成したテンプレート')
+    profiler = cProfile.Profile()
+    profiler.enable()
+    profiler.disable()
+    profile = profile_capture.save(profiler, 'GET /admin/', 'GET', '/admin/', 200, 0.0)
+    admin = User.select().where(User.role == 'admin').order_by(User.id).first()
+    upload, _ = create_upload(admin, 'query_plans.txt', 1, site_id=site.id, client_id=client.id)
+    return {'name': profile, 'upload_id': upload['upload_id'] if upload else None}
+
+def sample_ids():
+    # URL の引数に使う ID（クライアントの画面でも表示できるよう、同じクライアントのデータから選ぶ）
+    from models import Client, User, Site, Request, MaintenanceLog, Notice, LogTemplate, SharedFile
+    from utils import generate_file_token
+    client = Client.select().join(User).where(User.role == 'client').order_by(Client.id).first()
+    site = Site.select().where(Site.client == client).order_by(Site.id).first()
+    samples = create_samples(client, site)
+
+    def first_id(query):
+        row = query.first()
+        return row.id if row is not None else None
+
+    shared = first_id(SharedFile.select().where((SharedFile.site == site) & (SharedFile.is_deleted == False)
+                                                & (SharedFile.client_visible == True)).order_by(SharedFile.id))
+    if shared:
+        # 生成データのファイルは行のみなので、ダウンロード用に実ファイルを用意する
+        import settings
+        path = os.path.join(settings.UPLOAD_DIR, SharedFile.get_by_id(shared).stored_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'query_plans')
+    ids = {
+        'clients': client.id, 'client_id': client.id,
+        'sites': site.id, 'site_id': site.id,
+        'requests': first_id(Request.select().where(Request.client == client).order_by(Request.id)),
+        'logs': first_id(MaintenanceLog.select().where(MaintenanceLog.site == site).order_by(MaintenanceLog.id)),
+        'notices': first_id(Notice.select().where(Notice.site == site).order_by(Notice.id)),
+        'log_templates': first_id(LogTemplate.select().order_by(LogTemplate.id)),
+        'files': shared,
+        'token': generate_file_token(shared) if shared else None
+    }
+    ids.update(samples)
+    ids['log_id'] = ids['logs']
+    ids['notice_id'] = ids['notices']
+    ids['file_id'] = ids['files']
+    client_email = User.select(User.email).where(User.client == client).scalar()
+    return ids, client_email
+
+_RULE_ARG = re.compile(r'<([a-zA-Z_][a-zA-Z_0-9]*)(?::[^>]*)?>')
+
+def build_url(rule, ids):
+    # 引数を埋めた URL（埋められない引数がある場合は None）
+    missing = []
+
+    def _arg(match):
+        name = match.group(1)
+        # <id:int> は直前のパス（/sites/<id:int> なら sites）で判断する
+        key = rule[:match.start()].rstrip('/').rsplit('/', 1)[-1] if name == 'id' else name
+        value = ids.get(key)
+        if value is None:
+            missing.append(name)
+            return ''
+        return str(value)
+
+    url = _RULE_ARG.sub(_arg, rule)
+    return None if missing else url
+
+def query_variants(ids):
+    # 絞り込み・検索の分岐で実行される SQL も集めるためのクエリ（URL のパターン: [クエリ]）
+    return {
+        '/admin/clients': [{'q': 'a'}],
+        '/admin/sites': [{'q': 'a'}, {'client_id': ids['client_id']}],
+        '/admin/sites/<id:int>/logs': [{'q': 'a'}],
+        '/admin/sites/<id:int>/files': [{'show_deleted': '1'}],
+        '/admin/requests': [{'status': 'new'}, {'client_id': ids['client_id']}],
+    }
+
+def exercise(app, ids, client_email):
+    # 全ルートを表示し、{正規化した SQL: 記録} と各ルートの結果を返す
+    import perf
+    from urllib.parse import urlencode
+    from webtest import TestApp
+    from routes import _login
+    # /metrics はローカルホストからのみ表示できる
+    local = {'REMOTE_ADDR': '127.0.0.1'}
+    clients = {'admin': TestApp(app, extra_environ=local), 'client': TestApp(app, extra_environ=local)}
+    _login(clients['admin'], 'admin@example.com', 'admin')
+    _login(clients['client'], client_email, 'client')
+    variants = query_variants(ids)
+    statements = {}
+    visited = []
+    skipped = []
+    # ログアウトはログイン状態が変わるため最後に表示する
+    routes = sorted(all_get_routes(app), key=lambda r: r[0] == '/logout')
+    for rule, roles in routes:
+        url = build_url(rule, ids)
+        if url is None:
+            skipped.append((rule, 'no sample data for URL arguments'))
+            continue
+        urls = [url] + [f"{url}?{urlencode(query)}" for query in variants.get(rule, [])]
+        for role in roles:
+            for target in urls:
+                name = f"{role} GET {target}"
+                with perf.count_queries(capture_stack=True) as log:
+                    res = clients[role].get(target, expect_errors=True)
+                visited.append({'route': name, 'rule': rule, 'status': res.status_int, 'queries': log.count})
+                for sql, params, elapsed, sites in log.statements:
+                    key = normalize(sql)
+                    row = statements.get(key)
+                    if row is None:
+                        row = statements[key] = {'sql': sql, 'params': list(params or []), 'executions': 0,
+                                                 'time_ms': 0.0, 'routes': [], 'call_site': (sites or [None])[-1]}
+                    row['executions'] += 1
+                    row['time_ms'] += elapsed * 1000
+                    if rule not in row['routes']:
+                        row['routes'].append(rule)
+    return statements, visited, skipped
+
+def normalize(sql):
+    # 値の個数だけが違う IN (?, ?, ...) は同じ SQL として扱う
+    return _IN_LIST.sub('IN (?...)', sql)
+
+class Schema(object):
+    # 行数・統計（sqlite_stat1）・既存のインデックス
+    def __init__(self, database):
+        self.database = database
+        self._counts = {}
+        self.stats = {}
+        try:
+            for table, index, stat in database.execute_sql('SELECT tbl, idx, stat FROM sqlite_stat1'):
+                self.stats[index or table] = [int(n) for n in stat.split()[:8] if n.isdigit()]
+        except Exception:
+            pass
+
+    def count(self, table):
+        if table not in self._counts:
+            try:
+                self._counts[table] = database_scalar(self.database, f'SELECT COUNT(*) FROM "{table}"')
+            except Exception:
+                self._counts[table] = 0
+        return self._counts[table]
+
+    def columns(self, table):
+        return [row[1] for row in self.database.execute_sql(f'PRAGMA table_info("{table}")').fetchall()]
+
+    def indexes(self, table):
+        # [インデックスの列]（主キーの rowid は ['id']）
+        result = [['id']]
+        for row in self.database.execute_sql(f'PRAGMA index_list("{table}")').fetchall():
+            columns = [r[2] for r in self.database.execute_sql(f'PRAGMA index_info("{row[1]}")').fetchall()]
+            result.append(columns)
+        return result
+
+    def rows_per_search(self, table, index, equalities, has_range):
+        # インデックスで絞り込んだ1回あたりの行数の推定
+        total = self.count(table)
+        if equalities and index is None:
+            # INTEGER PRIMARY KEY
+            return 1
+        stat = self.stats.get(index) if index else None
+        if stat and equalities:
+            rows = stat[min(equalities, len(stat) - 1)]
+        elif equalities:
+            rows = max(1, total // 10)
+        else:
+            rows = total
+        # 範囲の条件（a>?）は SQLite と同じく 1/4 と見なす
+        return max(1, rows // 4) if has_range else max(1, rows)
+
+def database_scalar(database, sql):
+    return database.execute_sql(sql).fetchone()[0]
+
+def explain(database, sql, params):
+    # [(id, parent, detail)]
+    rows = database.execute_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    return [(row[0], row[1], row[3]) for row in rows]
+
+def predicates(sql):
+    # {別名: [(列, 'eq' / 'range' / 'join' / 'other')]}（WHERE / ON の条件から）
+    # 列同士の比較（結合の条件）は 'join'。インデックスの候補は値との比較（'eq' / 'range'）から作る
+    result = {}
+
+    def add(alias, column, kind):
+        columns = result.setdefault(alias, [])
+        if (column, kind) not in columns:
+            columns.append((column, kind))
+
+    for alias, column, op, other_alias, other_column in _COMPARISON.findall(sql):
+        if other_alias:
+            add(alias, column, 'join')
+            add(other_alias, other_column, 'join')
+            continue
+        add(alias, column, 'eq' if op in EQUALITY_OPS else 'range' if op in RANGE_OPS else 'other')
+    return result
+
+def order_columns(sql):
+    # ORDER BY の [(別名, 列)]
+    match = _ORDER_BY.search(sql)
+    if not match:
+        return []
+    return [(alias, column) for alias, column, _ in _ORDER_COLUMN.findall(match.group(1))]
+
+def suggest_columns(alias, preds, orders=()):
+    # 等価条件の列 → 範囲条件の列（1つ）または並べ替えの列 の順のインデックス
+    columns = [c for c, kind in preds.get(alias, []) if kind == 'eq' and c != 'id']
+    ranges = [c for c, kind in preds.get(alias, []) if kind == 'range' and c not in columns]
+    tail = [c for a, c in orders if a == alias] if orders else ranges[:1]
+    for column in tail:
+        if column not in columns:
+            columns.append(column)
+    return columns
+
+def analyze_plan(plan, sql, schema):
+    # 実行計画から問題点と1回あたりの推定コスト（読む行数）を求める
+    aliases = {alias: table for table, alias in _ALIAS.findall(sql)}
+    preds = predicates(sql)
+    children = {}
+    for node_id, parent, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+    findings = []
+
+    def walk(parent, outer_rows):
+        # 1つの SELECT の中のループを順に辿る（戻り値: 読む行数, 出力行数）
+        rows = outer_rows
+        visited = 0
+        first_alias = None
+        for node_id, detail in children.get(parent, []):
+            loop = _LOOP.match(detail)
+            if loop and loop.group(2) not in ('CONSTANT', 'SUBQUERY') and not loop.group(2).startswith('('):
+                kind, name, _, rest = loop.groups()
+                table = aliases.get(name, name)
+                first_alias = first_alias or name
+                index = _USING_INDEX.search(rest)
+                constraints = _CONSTRAINTS.search(rest)
+                if kind == 'SCAN':
+                    per_loop = schema.count(table)
+                    if index is None:
+                        findings.append({'kind': 'full_scan', 'table': table, 'detail': detail,
+                                         'cost': rows * per_loop,
+                                         'columns': suggest_columns(name, preds)})
+                else:
+                    parts = constraints.group(1).split(' AND ') if constraints else []
+                    equalities = sum(1 for p in parts if p.endswith('=?') and not p.endswith(('<=?', '>=?')))
+                    has_range = any(('>' in p or '<' in p) for p in parts)
+                    if 'PRIMARY KEY' in rest:
+                        per_loop = 1 if equalities else schema.count(table) // 4
+                    else:
+                        per_loop = schema.rows_per_search(table, index.group(1) if index else None, equalities, has_range)
+                visited += rows * per_loop
+                rows *= max(1, per_loop)
+            elif detail.startswith('USE TEMP B-TREE'):
+                alias_orders = order_columns(sql)
+                target = alias_orders[0][0] if alias_orders and len({a for a, _ in alias_orders}) == 1 else first_alias
+                findings.append({'kind': 'temp_btree', 'table': aliases.get(target, target), 'detail': detail,
+                                 'cost': int(rows * math.log2(rows + 1)),
+                                 'columns': suggest_columns(target, preds, alias_orders) if 'ORDER BY' in detail else []})
+                visited += rows
+            elif 'SUBQUERY' in detail:
+                inner_visited, _ = walk(node_id, 1)
+                correlated = detail.startswith('CORRELATED')
+                cost = inner_visited * (rows if correlated else 1)
+                sub_alias = _first_alias(node_id, children)
+                table = aliases.get(sub_alias, sub_alias)
+                if correlated:
+                    # 外側の1行毎に実行される（結合の列で引けるインデックスが必要）
+                    columns = [c for c, kind in preds.get(sub_alias, []) if kind in ('join', 'eq') and c != 'id']
+                    findings.append({'kind': 'correlated_subquery', 'table': table, 'detail': detail,
+                                     'cost': cost, 'columns': columns})
+                elif sub_alias and _reads_whole_table(node_id, children):
+                    # 外側の条件（request_id = ? など）で絞り込まれずに表全体（範囲）を読む IN / NOT IN。
+                    # 同じ列で絞り込むように書き換えた場合のインデックスを候補にする
+                    own = schema.columns(table)
+                    columns = [c for c, kind in preds.get(first_alias, []) if kind == 'eq' and c in own and c != 'id']
+                    columns += [c for c, kind in preds.get(sub_alias, []) if c not in columns and c != 'id']
+                    findings.append({'kind': 'unscoped_subquery', 'table': table, 'detail': detail, 'cost': cost,
+                                     'columns': columns, 'rewrite': bool(columns)})
+                visited += cost
+            else:
+                # MATERIALIZE / CO-ROUTINE / COMPOUND など
+                inner_visited, _ = walk(node_id, rows)
+                visited += inner_visited
+        return visited, rows
+
+    total, _ = walk(0, 1)
+    return findings, total
+
+def _first_loop(node_id, children):
+    for child_id, detail in children.get(node_id, []):
+        loop = _LOOP.match(detail)
+        if loop:
+            return loop
+        found = _first_loop(child_id, children)
+        if found:
+            return found
+    return None
+
+def _first_alias(node_id, children):
+    loop = _first_loop(node_id, children)
+    return loop.group(2) if loop else None
+
+def _reads_whole_table(node_id, children):
+    # サブクエリの最初のループが全件の走査、または等価条件なしの範囲検索
+    loop = _first_loop(node_id, children)
+    if loop is None:
+        return False
+    rest = loop.group(4)
+    return loop.group(1) == 'SCAN' or '=?' not in rest.replace('<=?', '').replace('>=?', '')
+
+def audit(statements, schema, database):
+    # (SQL 毎の結果, 不足しているインデックス毎の合計) をコストの降順で返す
+    results = []
+    indexes = {}
+    for key, row in statements.items():
+        sql = row['sql']
+        if not re.match(r'\s*(SELECT|WITH|UPDATE|DELETE)\b', sql, re.I):
+            continue
+        try:
+            plan = explain(database, sql, row['params'])
+        except Exception as e:
+            results.append(dict(row, plan=[], findings=[], cost=0, error=str(e)))
+            continue
+        findings, per_execution = analyze_plan(plan, sql, schema)
+        for finding in findings:
+            finding['cost'] *= row['executions']
+        result = dict(row, plan=[detail for _, _, detail in plan], findings=findings,
+                      cost=sum(f['cost'] for f in findings), rows_per_execution=per_execution)
+        result['time_ms'] = round(result['time_ms'], 2)
+        results.append(result)
+        for finding in findings:
+            if not finding['columns']:
+                continue
+            index_key = (finding['table'], tuple(finding['columns']))
+            entry = indexes.get(index_key)
+            if entry is None:
+                existing = [cols for cols in schema.indexes(finding['table'])
+                            if cols[:len(finding['columns'])] == finding['columns']]
+                entry = indexes[index_key] = {
+                    'table': finding['table'],
+                    'columns': finding['columns'],
+                    'cost': 0,
+                    'kinds': [],
+                    'statements': 0,
+                    'routes': [],
+                    # 同じ列のインデックスがあるのに使われていない（サブクエリの書き方・型の不一致など）
+                    'exists': bool(existing),
+                    # SQL も書き換える必要がある（サブクエリを外側と同じ列で絞り込む）
+                    'rewrite': False,
+                    'create': (f'CREATE INDEX "{finding["table"]}_{"_".join(finding["columns"])}" '
+                               f'ON "{finding["table"]}" ({", ".join(chr(34) + c + chr(34) for c in finding["columns"])});')
+                }
+            entry['cost'] += finding['cost']
+            entry['rewrite'] = entry['rewrite'] or finding.get('rewrite', False)
+            entry['statements'] += 1
+            if finding['kind'] not in entry['kinds']:
+                entry['kinds'].append(finding['kind'])
+            for route in row['routes']:
+                if route not in entry['routes']:
+                    entry['routes'].append(route)
+    results.sort(key=lambda r: r['cost'], reverse=True)
+    ranked = sorted(indexes.values(), key=lambda i: i['cost'], reverse=True)
+    return results, ranked
+
+def print_report(results, ranked, visited, skipped, limit):
+    print("index candidates (estimated rows read x executions):")
+    print(f"{'cost':>12}  {'status':<8}{'kinds':<36}index")
+    for entry in ranked:
+        status = 'unused' if entry['exists'] else 'rewrite' if entry['rewrite'] else 'missing'
+        print(f"{entry['cost']:>12}  {status:<8}{','.join(entry['kinds']):<36}{entry['table']} ({', '.join(entry['columns'])})")
+        print(f"{'':>14}{'':<8}{'':<36}routes: {', '.join(entry['routes'][:4])}{' ...' if len(entry['routes']) > 4 else ''}")
+    if not ranked:
+        print("  (none)")
+    print()
+    flagged = [r for r in results if r['findings'] or r.get('error')]
+    print(f"statements with full scans / temp b-trees / subqueries ({len(flagged)} of {len(results)} distinct):")
+    for row in flagged[:limit]:
+        kinds = ', '.join(f"{f['kind']} {f['table']}" for f in row['findings']) or row.get('error')
+        print(f"{row['cost']:>12}  x{row['executions']:<4} {row['time_ms']:>8} ms  {kinds}")
+        print(f"{'':>14}{row['sql'][:200]}{'...' if len(row['sql']) > 200 else ''}")
+        if row['call_site']:
+            print(f"{'':>14}at {row['call_site']}")
+        for detail in row['plan']:
+            print(f"{'':>16}{detail}")
+    if len(flagged) > limit:
+        print(f"  ... {len(flagged) - limit} more (use --limit)")
+    print()
+    errors = [v for v in visited if v['status'] >= 500]
+    print(f"routes: {len(visited)} requests, {sum(v['queries'] for v in visited)} statements"
+          f"{f', {len(errors)} server errors' if errors else ''}")
+    for rule, reason in skipped:
+        print(f"  skipped {rule}: {reason}")
+
+def main():
+    parser = argparse.ArgumentParser(description='全画面の SQL の実行計画の確認')
+    parser.add_argument('--db', help='使用するデータベース（コピーして使う。省略時は一時データを生成）')
+    parser.add_argument('--limit', type=int, default=20, help='表示する SQL の件数')
+    parser.add_argument('--json', help='結果を JSON で保存するファイル')
+    parser.add_argument('--fail-above', type=int, help='推定コストがこれを超える不足インデックスがあれば終了コード 1')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='mv-query-plans-')
+    try:
+        db_path = None
+        if args.db:
+            db_path = os.path.join(work_dir, 'query_plans.db')
+            shutil.copyfile(args.db, db_path)
+        import settings
+        # 集計用の共有ファイルは作らない（プロセス内のみ）。サンプルのプロファイル・分割アップロードは一時ディレクトリに作る
+        settings.METRICS_DB = None
+        settings.PROFILE_DIR = os.path.join(work_dir, 'profiles')
+        settings.UPLOAD_STAGING_DIR = os.path.join(work_dir, 'upload_staging')
+        app = prepare(work_dir, db_path)
+        from models import db
+        # 統計を作り、実際の件数に基づいた実行計画にする
+        db.execute_sql('ANALYZE')
+        ids, client_email = sample_ids()
+        statements, visited, skipped = exercise(app, ids, client_email)
+        schema = Schema(db)
+        results, ranked = audit(statements, schema, db)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(results, ranked, visited, skipped, args.limit)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'indexes': ranked, 'statements': results, 'routes': visited,
+                       'skipped': [{'rule': r, 'reason': reason} for r, reason in skipped]},
+                      f, ensure_ascii=False, indent=2, default=str)
+    if args.fail_above is not None:
+        over = [i for i in ranked if not i['exists'] and i['cost'] > args.fail_above]
+        if over:
+            print(f"missing indexes above {args.fail_above}: " + ', '.join(f"{i['table']} ({', '.join(i['columns'])})" for i in over))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
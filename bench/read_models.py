@@ -0,0 +1,100 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# 一覧画面の行オブジェクトの比較（Model インスタンス vs read_models の読み取り専用の行）
+#   python bench/read_models.py --rows 5000
+# 一時 SQLite に保守ログを作成し、ログ一覧と同じ条件で全件を読み出したときの
+# CPU 時間とピークメモリ（tracemalloc）を計測する。サイト名の参照も含める。
+#   model      : MaintenanceLog.select().join(Site)（log.site.name で行毎に追加クエリ）
+#   model_join : MaintenanceLog.select(MaintenanceLog, Site).join(Site)
+#   rows       : read_models.log_rows()
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+def setup_db(path, rows):
+    from peewee import SqliteDatabase
+    from models import set_db, init_db, Client, Site, MaintenanceLog
+    set_db(SqliteDatabase(path))
+    init_db()
+    client = Client.create(name='bench', display_name='Bench')
+    sites = [Site.create(client=client, name=f'site-{i}') for i in range(10)]
+    start = datetime.date(2026, 1, 1)
+    data = [{
+        'site': sites[i % len(sites)].id,
+        'performed_at': start + datetime.timedelta(days=i % 365),
+        'category': ('更新', '調査', '障害対応')[i % 3],
+        'summary': f'作業 {i}',
+        'details': '詳細' * 20,
+        'is_important': i % 7 == 0,
+        'is_visible_to_client': True
+    } for i in range(rows)]
+    from models import db
+    with db.atomic():
+        for offset in range(0, len(data), 500):
+            MaintenanceLog.insert_many(data[offset:offset + 500]).execute()
+    return client
+
+def _consume(logs):
+    # テンプレートが参照する属性を一通り読む
+    total = 0
+    for log in logs:
+        total += len(log.summary) + len(log.site.name) + (1 if log.is_important else 0)
+        log.performed_at, log.category, log.details
+    return total
+
+def _query(mode, client):
+    from models import Site, MaintenanceLog
+    from read_models import log_rows
+    condition = (Site.client == client) & (MaintenanceLog.is_visible_to_client == True)
+    order = MaintenanceLog.performed_at.desc()
+    if mode == 'model':
+        return list(MaintenanceLog.select().join(Site).where(condition).order_by(order))
+    if mode == 'model_join':
+        return list(MaintenanceLog.select(MaintenanceLog, Site).join(Site).where(condition).order_by(order))
+    return list(log_rows(condition, order_by=order))
+
+def measure(mode, client):
+    gc.collect()
+    tracemalloc.start()
+    start = time.process_time()
+    logs = _query(mode, client)
+    _consume(logs)
+    cpu = time.process_time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del logs
+    return {'cpu_ms': round(cpu * 1000, 1), 'peak_kb': round(peak / 1024, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description='一覧画面の行オブジェクトの CPU 時間・メモリ比較')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--modes', default='model,model_join,rows')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='mv-readmodels-')
+    client = setup_db(os.path.join(work_dir, 'bench.db'), args.rows)
+    results = {}
+    for mode in args.modes.split(','):
+        # 1回目はページキャッシュの暖機として捨てる
+        measure(mode, client)
+        results[mode] = measure(mode, client)
+
+    print(f"{'mode':<12}{'cpu(ms)':>12}{'peak(KB)':>14}")
+    for mode, row in results.items():
+        print(f"{mode:<12}{row['cpu_ms']:>12}{row['peak_kb']:>14}")
+    from models import db
+    db.close()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps({'rows': args.rows, 'results': results}))
+
+if __name__ == '__main__':
+    main()
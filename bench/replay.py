@@ -0,0 +1,325 @@
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from work_settings import use_work_dir
+
+# 記録した実際のアクセス（WORKLOAD_CAPTURE_ENABLED / workload.py）の再現
+#   python bench/replay.py data/workload.jsonl --db maintenance.db --speed 10 --json after.json
+#   python bench/replay.py data/workload.jsonl --db maintenance.db --root ../before --json before.json
+#   python bench/replay.py data/workload.jsonl --db maintenance.db --compare before.json   # 比較（悪化があれば終了コード 1）
+# データベースのコピー（全ユーザーのパスワードを置き換える）を使ってローカルにサーバーを起動し、
+# 記録した間隔を --speed 倍に縮めて同じ順序でリクエストを送る。各ユーザーは記録された ID のユーザーでログインする。
+# --root で別のチェックアウトを指定すると、そのコードでサーバーを起動する（変更前後の比較用）。
+# 参照系（GET / HEAD）のみ再現する。更新系は入力値を記録していないため送らず、件数のみ出力する。
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+REPLAY_PASSWORD = 'replay-password'
+# ログイン状態を変えるため再現しないルート
+SKIP_ROUTES = {'/login', '/logout'}
+
+def serve(root, db_path, work_dir, port):
+    # 子プロセス: 指定したチェックアウトのコードでアプリを起動する（記録・計測の出力先は作業用ディレクトリ）
+    sys.path.insert(0, root)
+    os.chdir(root)
+    settings = use_work_dir(work_dir, db_path)
+    settings.IS_CGI = False
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    import index
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+        request_queue_size = 256
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    httpd = make_server('127.0.0.1', port, index.application, ThreadingWSGIServer, QuietHandler)
+    httpd.serve_forever()
+
+def prepare_db(work_dir, db_path):
+    # コピーしたデータベースのパスワードを置き換え、{ユーザー ID: メールアドレス} を返す
+    from auth import hash_password
+    target = os.path.join(work_dir, 'replay.db')
+    shutil.copyfile(db_path, target)
+    conn = sqlite3.connect(target)
+    try:
+        with conn:
+            conn.execute('UPDATE "user" SET password_hash = ?', (hash_password(REPLAY_PASSWORD),))
+        emails = dict(conn.execute('SELECT id, email FROM "user" WHERE is_active = 1'))
+    finally:
+        conn.close()
+    return target, emails
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _wait_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/api/version', timeout=1).read()
+            return
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+class Session(object):
+    # 記録されたユーザー毎のログイン状態（最初のリクエストの前にログインする）
+    def __init__(self, base_url, email):
+        self.base_url = base_url
+        self.email = email
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.lock = threading.Lock()
+        self.ready = email is None
+
+    def ensure_login(self):
+        with self.lock:
+            if self.ready:
+                return
+            body = self.opener.open(self.base_url + '/login', timeout=60).read().decode('utf-8', 'replace')
+            token = re.search(r'name="csrf_token" value="([^"]+)"', body).group(1)
+            data = urllib.parse.urlencode({'email': self.email, 'password': REPLAY_PASSWORD, 'csrf_token': token})
+            self.opener.open(self.base_url + '/login', data.encode('utf-8'), timeout=60).read()
+            self.ready = True
+
+    def get(self, url, method):
+        req = urllib.request.Request(self.base_url + url, method=method)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=60) as res:
+                res.read()
+                status = res.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            status = None
+        return time.perf_counter() - start, status
+
+def plan(entries, emails):
+    # (再現するリクエスト [(記録からの秒数, 記録, URL)], 再現しない件数 {理由: 件数})
+    import workload
+    planned = []
+    skipped = {}
+    t0 = entries[0]['t'] if entries else 0
+    for entry in entries:
+        reason = None
+        url = workload.replay_url(entry)
+        if entry['method'] not in ('GET', 'HEAD'):
+            reason = 'write'
+        elif entry.get('route') in SKIP_ROUTES:
+            reason = 'session'
+        elif url is None:
+            reason = 'unreplayable_args'
+        elif entry.get('user_id') is not None and entry['user_id'] not in emails:
+            reason = 'unknown_user'
+        if reason:
+            skipped[reason] = skipped.get(reason, 0) + 1
+            continue
+        planned.append((entry['t'] - t0, entry, url))
+    return planned, skipped
+
+def run(base_url, planned, emails, speed, concurrency):
+    # 記録した間隔を speed 倍に縮めて送る。
+    # サンプルは (ルート名, 応答時間(秒), ステータス, 記録時のステータス, 送信の遅れ(秒))
+    sessions = {}
+    samples = []
+    lock = threading.Lock()
+
+    def issue(scheduled, entry, url):
+        user_id = entry.get('user_id')
+        session = sessions[user_id]
+        try:
+            session.ensure_login()
+        except (urllib.error.URLError, ConnectionError, socket.timeout, AttributeError):
+            pass
+        lag = time.perf_counter() - scheduled
+        elapsed, status = session.get(url, entry['method'])
+        with lock:
+            samples.append((f"{entry['method']} {entry['route']}", elapsed, status, entry.get('status'), lag))
+
+    for _, entry, _ in planned:
+        user_id = entry.get('user_id')
+        if user_id not in sessions:
+            sessions[user_id] = Session(base_url, emails.get(user_id) if user_id is not None else None)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, entry, url in planned:
+            scheduled = start + offset / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(issue, scheduled, entry, url)
+    return samples, time.perf_counter() - start
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1)]
+
+def _distribution(times_ms):
+    times_ms = sorted(times_ms)
+    return {
+        'count': len(times_ms),
+        'mean_ms': round(sum(times_ms) / len(times_ms), 1) if times_ms else 0.0,
+        'p50_ms': round(_percentile(times_ms, 50), 1),
+        'p90_ms': round(_percentile(times_ms, 90), 1),
+        'p95_ms': round(_percentile(times_ms, 95), 1),
+        'p99_ms': round(_percentile(times_ms, 99), 1),
+        'max_ms': round(times_ms[-1], 1) if times_ms else 0.0
+    }
+
+def summarize(samples, duration):
+    routes = {}
+    for name, elapsed, status, recorded, _ in samples:
+        routes.setdefault(name, []).append((elapsed, status, recorded))
+    per_route = {}
+    for name, rows in sorted(routes.items()):
+        row = _distribution([e * 1000 for e, _, _ in rows])
+        row['errors'] = sum(1 for _, s, _ in rows if s is None or s >= 500)
+        # データベースのコピーが記録時と異なる場合など（404 / 403 になったものは比較から外すこと）
+        row['status_mismatch'] = sum(1 for _, s, r in rows if r is not None and s != r)
+        per_route[name] = row
+    lags = sorted(s[4] * 1000 for s in samples)
+    return {
+        'duration_s': round(duration, 1),
+        'overall': _distribution([s[1] * 1000 for s in samples]),
+        'max_send_lag_ms': round(lags[-1], 1) if lags else 0.0,
+        'routes': per_route
+    }
+
+def compare(report, baseline, threshold, min_count):
+    # (ルート名, 変更前, 変更後) の一覧と、p50 / p95 が threshold を超えて悪化したルート
+    rows = []
+    regressions = []
+    for name, row in report['routes'].items():
+        base = baseline['routes'].get(name)
+        if base is None:
+            continue
+        rows.append((name, base, row))
+        if min(base['count'], row['count']) < min_count:
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            if base[key] and row[key] > base[key] * (1 + threshold):
+                regressions.append(f"{name}: {key} {base[key]} -> {row[key]}")
+    return rows, regressions
+
+def _change(before, after):
+    return f"{(after - before) / before:+.0%}" if before else '-'
+
+def print_report(report, skipped):
+    print(f"{'route':<48}{'count':>7}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'errors':>8}{'status≠':>8}")
+    for name, row in report['routes'].items():
+        print(f"{name:<48}{row['count']:>7}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+              f"{row['max_ms']:>10}{row['errors']:>8}{row['status_mismatch']:>8}")
+    overall = report['overall']
+    print()
+    print(f"total: {overall['count']} requests in {report['duration_s']}s, "
+          f"p50 {overall['p50_ms']} ms, p95 {overall['p95_ms']} ms, p99 {overall['p99_ms']} ms "
+          f"(max send lag {report['max_send_lag_ms']} ms)")
+    if skipped:
+        print("not replayed: " + ', '.join(f"{reason} {count}" for reason, count in sorted(skipped.items())))
+
+def print_comparison(rows, baseline, report):
+    print()
+    print(f"{'route':<48}{'p50 before':>12}{'after':>9}{'':>7}{'p95 before':>12}{'after':>9}{'':>7}")
+    for name, base, row in rows:
+        print(f"{name:<48}{base['p50_ms']:>12}{row['p50_ms']:>9}{_change(base['p50_ms'], row['p50_ms']):>7}"
+              f"{base['p95_ms']:>12}{row['p95_ms']:>9}{_change(base['p95_ms'], row['p95_ms']):>7}")
+    before, after = baseline['overall'], report['overall']
+    print(f"{'overall':<48}{before['p50_ms']:>12}{after['p50_ms']:>9}{_change(before['p50_ms'], after['p50_ms']):>7}"
+          f"{before['p95_ms']:>12}{after['p95_ms']:>9}{_change(before['p95_ms'], after['p95_ms']):>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description='記録したアクセスの再現と応答時間の比較')
+    parser.add_argument('workload', nargs='?', help='記録ファイル（settings.WORKLOAD_CAPTURE_PATH）')
+    parser.add_argument('--db', help='使用するデータベース（コピーして使う）')
+    parser.add_argument('--root', default=ROOT, help='サーバーを起動するチェックアウト（既定はこのリポジトリ）')
+    parser.add_argument('--speed', type=float, default=1.0, help='再現の速さ（10 で記録の 10 倍の頻度）')
+    parser.add_argument('--concurrency', type=int, default=32, help='同時に送るリクエストの上限')
+    parser.add_argument('--json', help='結果を JSON で保存するファイル（--compare の比較元になる）')
+    parser.add_argument('--compare', help='比較する以前の結果（--json で保存したもの）')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p50 / p95 の許容増加率')
+    parser.add_argument('--min-count', type=int, default=5, help='比較するルートの最小件数')
+    parser.add_argument('--serve', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve[0], args.serve[1], args.serve[2], int(args.serve[3]))
+        return 0
+    if not args.workload or not args.db:
+        parser.error('workload and --db are required')
+
+    sys.path.insert(0, ROOT)
+    import workload
+    entries = workload.read(args.workload)
+    if not entries:
+        print(f"no requests in {args.workload}", file=sys.stderr)
+        return 1
+
+    work_dir = tempfile.mkdtemp(prefix='mv-replay-')
+    server = None
+    try:
+        db_path, emails = prepare_db(work_dir, args.db)
+        planned, skipped = plan(entries, emails)
+        port = _free_port()
+        env = dict(os.environ, PYTHONWARNINGS='ignore')
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve',
+                                   os.path.abspath(args.root), db_path, work_dir, str(port)], env=env)
+        base_url = f'http://127.0.0.1:{port}'
+        _wait_ready(base_url)
+        samples, duration = run(base_url, planned, emails, args.speed, args.concurrency)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = summarize(samples, duration)
+    report['speed'] = args.speed
+    report['root'] = os.path.abspath(args.root)
+    report['skipped'] = skipped
+    print_report(report, skipped)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('speed') != args.speed:
+            print(f"warning: baseline was replayed at {baseline.get('speed')}x", file=sys.stderr)
+        rows, regressions = compare(report, baseline, args.threshold, args.min_count)
+        print_comparison(rows, baseline, report)
+        if regressions:
+            print()
+            print(f"regressions (threshold {args.threshold:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
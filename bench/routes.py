@@ -0,0 +1,188 @@
+import argparse
+import gc
+import json
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from work_settings import use_work_dir
+
+# 主要画面のベンチマーク（WSGI でプロセス内から呼び出す）
+#   python bench/routes.py                      # 計測して基準値と比較（悪化があれば終了コード 1）
+#   python bench/routes.py --save-baseline      # 計測結果を基準値として保存
+#   python bench/routes.py --db data/bench.db   # seed_scale.py で作成済みのデータを使う
+# 画面毎に所要時間（中央値）・SQL の実行回数・確保したメモリのピーク（tracemalloc）を出力する。
+# データを指定しない場合は seed_scale.generate() で一時データベースを作成する（シード固定）。
+# 所要時間とメモリは実行環境に依存するため、基準値は同じマシンで保存したものと比較すること。
+# SQL の実行回数は環境に依存しないため、少しでも増えれば悪化として扱う。
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+DEFAULT_BASELINE = os.path.join(ROOT, 'bench', 'baselines', 'routes.json')
+# 基準日は今日（当月のレポートにデータが入るようにする）
+DEFAULT_SCALE = dict(clients=50, sites=4, logs=200, requests=40, messages=4, files=10, seed=1)
+
+def prepare(work_dir, db_path):
+    import settings
+    if db_path is None:
+        import seed_scale
+        db_path = os.path.join(work_dir, 'bench.db')
+        seed_scale.generate(db_path, **DEFAULT_SCALE)
+    # index.py のインポート時に settings.DB_PATH へ接続するため、先に差し替える
+    use_work_dir(work_dir, db_path)
+    # プロセス内で完結させる（共有キャッシュ・集計ファイルは使わない）
+    settings.FRAGMENT_CACHE_DB = None
+    settings.METRICS_DB = None
+    # 部品キャッシュ・条件付き GET が効くと2回目以降の描画が省略されるため、計測では無効にする
+    settings.FRAGMENT_CACHE_ENABLED = False
+    from peewee import SqliteDatabase
+    from models import set_db
+    set_db(SqliteDatabase(db_path))
+    import index
+    return index.app
+
+def _login(client, email, password):
+    res = client.get('/login')
+    token = re.search(r'name="csrf_token" value="([^"]+)"', res.text).group(1)
+    client.post('/login', {'email': email, 'password': password, 'csrf_token': token})
+
+def build_routes():
+    # (名前, ユーザー種別, URL)
+    import settings
+    from models import Client, Site, Request, SharedFile, User
+    from utils import generate_file_token
+    client = Client.select().join(User).where(User.role == 'client').order_by(Client.id).first()
+    site = (Site.select().where(Site.client == client)
+            .order_by(Site.id).first())
+    request_obj = Request.select().where(Request.client == client).order_by(Request.id).first()
+    shared = (SharedFile.select()
+              .where((SharedFile.site == site) & (SharedFile.is_deleted == False) & (SharedFile.client_visible == True))
+              .order_by(SharedFile.id).first())
+    routes = [
+        ('admin_dashboard', 'admin', '/admin/'),
+        ('admin_requests', 'admin', '/admin/requests'),
+        ('admin_request_detail', 'admin', f'/admin/requests/{request_obj.id}'),
+        ('admin_site_logs', 'admin', f'/admin/sites/{site.id}/logs'),
+        ('admin_report_monthly', 'admin', f'/admin/reports/monthly/{client.id}'),
+        ('admin_report_monthly_print', 'admin', f'/admin/reports/monthly/{client.id}/print'),
+        ('client_dashboard', 'client', '/client/'),
+        ('client_logs', 'client', '/client/logs'),
+        ('client_report_monthly', 'client', '/client/reports/monthly'),
+        ('client_report_monthly_print', 'client', '/client/reports/monthly/print'),
+        ('client_request_detail', 'client', f'/client/requests/{request_obj.id}'),
+    ]
+    if shared is not None:
+        # 生成データのファイルは行のみなので、ダウンロード用に実ファイルを用意する
+        path = os.path.join(settings.UPLOAD_DIR, shared.stored_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(min(shared.size_bytes, 1024 * 1024)))
+        routes.append(('client_file_download', 'client', f'/files/{generate_file_token(shared.id)}'))
+    client_email = User.select(User.email).where(User.client == client).scalar()
+    return routes, client_email
+
+def measure(app_client, url, repeat):
+    from perf import count_queries
+    # 1回目はテンプレートのコンパイルなどを含むため捨てる
+    app_client.get(url)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with count_queries() as log:
+            res = app_client.get(url)
+        times.append((time.perf_counter() - start) * 1000)
+    queries = log.count
+    body_bytes = len(res.body)
+
+    gc.collect()
+    tracemalloc.start()
+    app_client.get(url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'time_ms': round(statistics.median(times), 2),
+        'queries': queries,
+        'peak_kb': round(peak / 1024, 1),
+        'body_kb': round(body_bytes / 1024, 1)
+    }
+
+def compare(results, baseline, threshold):
+    # 基準値より悪化した項目を返す [(画面, 項目, 基準値, 今回)]
+    regressions = []
+    for name, row in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if row['queries'] > base['queries']:
+            regressions.append((name, 'queries', base['queries'], row['queries']))
+        for key in ('time_ms', 'peak_kb'):
+            if base.get(key) and row[key] > base[key] * (1 + threshold):
+                regressions.append((name, key, base[key], row[key]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='主要画面のベンチマーク')
+    parser.add_argument('--db', help='計測に使うデータベース（省略時は一時データを生成）')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', help='計測する画面名（カンマ区切り）')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='計測結果を基準値として保存する')
+    parser.add_argument('--threshold', type=float, default=0.25, help='所要時間・メモリの許容増加率')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='mv-bench-routes-')
+    try:
+        app = prepare(work_dir, args.db)
+        from webtest import TestApp
+        routes, client_email = build_routes()
+        clients = {'admin': TestApp(app), 'client': TestApp(app)}
+        _login(clients['admin'], 'admin@example.com', 'admin')
+        _login(clients['client'], client_email, 'client')
+        only = set(args.only.split(',')) if args.only else None
+
+        results = {}
+        for name, role, url in routes:
+            if only and name not in only:
+                continue
+            results[name] = measure(clients[role], url, args.repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f).get('routes', {})
+    regressions = compare(results, baseline, args.threshold)
+    flagged = {(name, key) for name, key, _, _ in regressions}
+
+    print(f"{'route':<30}{'time(ms)':>10}{'queries':>9}{'peak(KB)':>11}{'body(KB)':>10}")
+    for name, row in results.items():
+        marks = ''.join('!' if (name, key) in flagged else ' ' for key in ('time_ms', 'queries', 'peak_kb'))
+        print(f"{name:<30}{row['time_ms']:>10}{row['queries']:>9}{row['peak_kb']:>11}{row['body_kb']:>10}  {marks}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'scale': 'default' if args.db is None else os.path.basename(args.db),
+                       'repeat': args.repeat,
+                       'routes': results}, f, ensure_ascii=False, indent=2, default=str)
+            f.write('\n')
+        print(f"baseline saved: {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"regressions (threshold {args.threshold:.0%}):")
+        for name, key, base, now in regressions:
+            print(f"  {name}: {key} {base} -> {now}")
+        return 1
+    if not baseline:
+        print("no baseline to compare (use --save-baseline)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# テンプレートの初回読み込み時間（CGI の 1 プロセス相当）を計測する
+#   python bench/template_load.py
+# 各サンプルは新しいプロセスで実行し、以下の3通りを比較する
+#   bottle : bottle.jinja2_template（テンプレート毎に Environment を作成、キャッシュなし）
+#   cold   : templating.py（バイトコードキャッシュが空の状態）
+#   warm   : templating.py（前回プロセスが保存したバイトコードを再利用）
+#   module : templating.py（build_templates.py で事前コンパイルしたモジュールを読み込み）
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+TEMPLATES = ['client/report_monthly.html', 'client/dashboard.html', 'admin/requests_list.html']
+
+def _context():
+    from settings import DEFAULT_LABELS, DEFAULT_SETTINGS
+    from utils import get_alert_level, format_date
+    return {
+        'current_user': None, 'active_page': None, 'csrf_token': 'x', 'messages': [],
+        'get_alert_level': get_alert_level, 'format_date': format_date,
+        'labels': DEFAULT_LABELS, 'app_settings': DEFAULT_SETTINGS, 'read_only_mode': False,
+        'client': {'display_name': 'bench'}, 'logs': [], 'important_logs': [], 'category_counts': {},
+        'notices': [], 'sites': [], 'alerts': [], 'requests': [], 'clients': [],
+        'selected_month': '2026-01', 'prev_month': '2025-12', 'next_month': '2026-02',
+        'is_print': False, 'is_admin_view': False, 'base_path': '/client/reports/monthly',
+        'today': datetime.date.today(), 'request': {},
+        'load_alerts': list, 'cache_scope': 'bench', 'cache_version': 0
+    }
+
+def run_child(mode, template):
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    # モジュールのインポート時間は計測対象外
+    if mode == 'bottle':
+        from bottle import jinja2_template, TEMPLATE_PATH
+        TEMPLATE_PATH.insert(0, os.path.join(ROOT, 'templates'))
+    else:
+        from templating import jinja2_template
+    ctx = _context()
+    if mode == 'bottle':
+        from templating import EXTENSIONS
+        ctx['template_settings'] = {'extensions': EXTENSIONS}
+    start = time.perf_counter()
+    jinja2_template(template, ctx)
+    return (time.perf_counter() - start) * 1000
+
+def sample(mode, template, cache_dir, clear, precompiled_dir=''):
+    if clear and os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+    env = dict(os.environ, BENCH_TEMPLATE_CACHE_DIR=cache_dir, BENCH_PRECOMPILED_DIR=precompiled_dir)
+    out = subprocess.check_output(
+        [sys.executable, __file__, '--child', mode, template], env=env, cwd=ROOT)
+    return float(out.decode().strip())
+
+def main():
+    parser = argparse.ArgumentParser(description='テンプレート読み込み時間の計測')
+    parser.add_argument('--samples', type=int, default=15)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        cache_dir = os.environ.get('BENCH_TEMPLATE_CACHE_DIR')
+        sys.path.insert(0, ROOT)
+        import settings
+        settings.TEMPLATE_CACHE_DIR = cache_dir
+        settings.TEMPLATE_AUTO_RELOAD = False
+        # 部品キャッシュが効くと描画の一部が省略されるため無効にする
+        settings.FRAGMENT_CACHE_ENABLED = False
+        settings.USE_PRECOMPILED_TEMPLATES = args.child[0] == 'module'
+        settings.PRECOMPILED_TEMPLATE_DIR = os.environ.get('BENCH_PRECOMPILED_DIR')
+        print(run_child(*args.child))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='mv-tplcache-')
+    cache_dir = os.path.join(work_dir, 'cache')
+    precompiled_dir = os.path.join(work_dir, 'compiled_templates')
+    sys.path.insert(0, ROOT)
+    from templating import compile_all_templates
+    compile_all_templates(precompiled_dir)
+    results = {}
+    for template in TEMPLATES:
+        row = {}
+        row['bottle'] = [sample('bottle', template, cache_dir, True) for _ in range(args.samples)]
+        row['cold'] = [sample('app', template, cache_dir, True) for _ in range(args.samples)]
+        sample('app', template, cache_dir, True)
+        row['warm'] = [sample('app', template, cache_dir, False) for _ in range(args.samples)]
+        row['module'] = [sample('module', template, cache_dir, True, precompiled_dir) for _ in range(args.samples)]
+        results[template] = {k: round(statistics.median(v), 2) for k, v in row.items()}
+
+    print(f"{'template':<32}{'bottle(ms)':>12}{'cold(ms)':>12}{'warm(ms)':>12}{'module(ms)':>12}")
+    for template, row in results.items():
+        print(f"{template:<32}{row['bottle']:>12}{row['cold']:>12}{row['warm']:>12}{row['module']:>12}")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(results))
+
+if __name__ == '__main__':
+    main()
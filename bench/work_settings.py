@@ -0,0 +1,22 @@
+import os
+
+# ベンチマーク用の設定（routes.py / loadtest.py / replay.py 共通）
+# データベースと、アプリが書き込むファイル（ログ・集計値・キャッシュ・アップロードなど）を
+# すべて作業用ディレクトリに向け、本番の data/ 以下に計測のアクセスが残らないようにする。
+# index.py の読み込み時に設定を参照するため、index をインポートする前に呼ぶこと。
+
+def use_work_dir(work_dir, db_path):
+    import settings
+    settings.DB_PATH = db_path
+    settings.TEMPLATE_CACHE_DIR = os.path.join(work_dir, 'template_cache')
+    settings.UPLOAD_DIR = os.path.join(work_dir, 'uploads')
+    settings.UPLOAD_STAGING_DIR = os.path.join(work_dir, 'upload_staging')
+    settings.FRAGMENT_CACHE_DB = os.path.join(work_dir, 'fragment_cache.db')
+    settings.SLOW_LOG_PATH = os.path.join(work_dir, 'slow_requests.log')
+    settings.METRICS_DB = os.path.join(work_dir, 'metrics.db')
+    settings.PROFILE_DIR = os.path.join(work_dir, 'profiles')
+    settings.LOG_PATH = os.path.join(work_dir, 'app.log')
+    settings.WORKLOAD_CAPTURE_PATH = os.path.join(work_dir, 'workload.jsonl')
+    settings.WORKLOAD_CAPTURE_ENABLED = False
+    settings.READ_ONLY_MODE = False
+    return settings
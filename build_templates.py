@@ -0,0 +1,23 @@
+import argparse
+import sys
+
+import settings
+from templating import compile_all_templates
+
+# デプロイ時に全テンプレートを事前コンパイルする
+#   python build_templates.py
+# 構文エラーのテンプレートがあれば終了コード 1 で失敗し、既存のコンパイル結果は変更しない
+
+if __name__ == '__main__':
+    from jinja2 import TemplateSyntaxError
+
+    parser = argparse.ArgumentParser(description='テンプレートを Python モジュールへ事前コンパイルします')
+    parser.add_argument('--target', default=settings.PRECOMPILED_TEMPLATE_DIR, help='出力先ディレクトリ')
+    args = parser.parse_args()
+
+    try:
+        count = compile_all_templates(args.target)
+    except TemplateSyntaxError as e:
+        print(f"template syntax error: {e.filename or e.name}:{e.lineno}: {e.message}", file=sys.stderr)
+        sys.exit(1)
+    print(f"compiled {count} templates into {args.target}")
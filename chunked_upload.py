@@ -0,0 +1,244 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import metrics
+import settings
+
+# 分割アップロード（再開可能）
+# UPLOAD_STAGING_DIR/<upload_id>/ に meta.json と data.part を置き、
+# チャンクを番号順に追記していく。finalize で UPLOAD_DIR に移動して SharedFile を作成する。
+# 同じアップロードへの追記・確定・中止は locked_upload() で直列化する（再試行や同時のリクエストに備える）。
+
+META_NAME = 'meta.json'
+DATA_NAME = 'data.part'
+LOCK_NAME = 'lock'
+
+def _staging_dir(upload_id):
+    # upload_id は uuid4 の hex のみ許可（パストラバーサル対策）
+    if not upload_id or len(upload_id) != 32 or not all(c in '0123456789abcdef' for c in upload_id):
+        return None
+    return os.path.join(settings.UPLOAD_STAGING_DIR, upload_id)
+
+def _write_meta(path, meta):
+    tmp_path = os.path.join(path, META_NAME + '.tmp')
+    with open(tmp_path, 'w') as fp:
+        json.dump(meta, fp)
+    os.replace(tmp_path, os.path.join(path, META_NAME))
+
+def load_upload(upload_id):
+    path = _staging_dir(upload_id)
+    if not path:
+        return None
+    try:
+        with open(os.path.join(path, META_NAME)) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+@contextlib.contextmanager
+def locked_upload(upload_id):
+    # ステージングディレクトリのロックファイルを flock で排他ロックし（プロセス間でも有効）、
+    # 取得後に読み直した meta を返す。確定・中止済みで存在しない場合は None
+    path = _staging_dir(upload_id)
+    fd = None
+    if path:
+        try:
+            fd = os.open(os.path.join(path, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o600)
+        except FileNotFoundError:
+            fd = None
+    if fd is None:
+        yield None
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # 待っている間に確定・中止された場合は meta が削除されている
+        yield load_upload(upload_id)
+    finally:
+        # close でロックも解放される
+        os.close(fd)
+
+def upload_status(meta):
+    return {
+        'upload_id': meta['upload_id'],
+        'filename': meta['filename'],
+        'total_size': meta['total_size'],
+        'received_bytes': meta['received_bytes'],
+        'next_chunk': len(meta['chunks']),
+        'chunk_size': settings.UPLOAD_CHUNK_BYTES,
+        'complete': meta['received_bytes'] == meta['total_size']
+    }
+
+def create_upload(user, filename, total_size, site_id=None, request_id=None, client_id=None, sha256=None,
+                  title=None, description=None, category=None, content_type=None, client_visible=True):
+    # 放置されたステージングデータは新規開始のたびに掃除する
+    purge_expired_uploads()
+
+    if not filename:
+        return None, "ファイル名が指定されていません"
+    filename = os.path.basename(filename.replace('\\', '/'))
+    name, ext = os.path.splitext(filename)
+    if ext.lower() not in settings.ALLOWED_EXTENSIONS:
+        return None, f"許可されていない拡張子です: {ext}"
+    if total_size is None or total_size <= 0:
+        return None, "ファイルサイズが不正です"
+    if total_size > settings.CHUNKED_UPLOAD_MAX_BYTES:
+        return None, f"ファイルサイズが大きすぎます (最大 {settings.CHUNKED_UPLOAD_MAX_BYTES/1024/1024}MB)"
+    if client_id is not None and user.role == 'client':
+        from storage_quota import check_quota
+        error = check_quota(client_id, total_size)
+        if error:
+            return None, error
+
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(settings.UPLOAD_STAGING_DIR, upload_id)
+    os.makedirs(path)
+    open(os.path.join(path, DATA_NAME), 'wb').close()
+
+    meta = {
+        'upload_id': upload_id,
+        'user_id': user.id,
+        'filename': filename,
+        'total_size': total_size,
+        'sha256': sha256.lower() if sha256 else None,
+        'site_id': site_id,
+        'request_id': request_id,
+        'title': title,
+        'description': description,
+        'category': category,
+        'content_type': content_type,
+        'client_visible': client_visible,
+        'received_bytes': 0,
+        'chunks': [],  # 受信済みチャンクの SHA-256（番号順）
+        'created_at': time.time()
+    }
+    _write_meta(path, meta)
+    return meta, None
+
+def append_chunk(meta, index, stream, length, sha256):
+    # index == 受信済み数 のチャンクのみ追記する。
+    # 受信済みのチャンクを同じハッシュで再送された場合は、レスポンス喪失後の再試行とみなして成功扱いにする
+    path = _staging_dir(meta['upload_id'])
+    received = len(meta['chunks'])
+    if not sha256:
+        return None, "チャンクのハッシュ(X-Chunk-SHA256)が指定されていません"
+    # 空のチャンクでは受信位置を進めない
+    if length <= 0:
+        return None, "空のチャンクは送信できません"
+    sha256 = sha256.lower()
+
+    if index < received:
+        if meta['chunks'][index] == sha256:
+            return meta, None
+        return None, "受信済みのチャンクと内容が一致しません"
+    if index > received:
+        return None, f"チャンク番号が不正です (次は {received})"
+    if length > settings.UPLOAD_CHUNK_BYTES:
+        return None, f"チャンクが大きすぎます (最大 {settings.UPLOAD_CHUNK_BYTES} bytes)"
+    if meta['received_bytes'] + length > meta['total_size']:
+        return None, "宣言されたファイルサイズを超えています"
+
+    data_path = os.path.join(path, DATA_NAME)
+    digest = hashlib.sha256()
+    with open(data_path, 'r+b') as fp:
+        # 前回の追記が途中で中断されていた場合に備え、確定済みの位置まで切り詰めてから書く
+        fp.truncate(meta['received_bytes'])
+        fp.seek(meta['received_bytes'])
+        remaining = length
+        while remaining > 0:
+            buf = stream.read(min(remaining, 64 * 1024))
+            if not buf:
+                break
+            digest.update(buf)
+            fp.write(buf)
+            remaining -= len(buf)
+        if remaining or digest.hexdigest() != sha256:
+            fp.truncate(meta['received_bytes'])
+            return None, "チャンクのハッシュが一致しません"
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    meta['chunks'].append(sha256)
+    meta['received_bytes'] += length
+    _write_meta(path, meta)
+    metrics.inc('mv_upload_bytes_total', length)
+    return meta, None
+
+def finalize_upload(meta, user, site=None, request_obj=None):
+    from utils import create_shared_file_record
+
+    path = _staging_dir(meta['upload_id'])
+    data_path = os.path.join(path, DATA_NAME)
+    try:
+        data_size = os.path.getsize(data_path)
+    except FileNotFoundError:
+        # 移動後、ステージングの削除前に中断された
+        return None, "アップロードは確定済みです"
+    if meta['received_bytes'] != meta['total_size'] or data_size != meta['total_size']:
+        return None, "すべてのチャンクを受信していません"
+
+    if meta['sha256']:
+        digest = hashlib.sha256()
+        with open(data_path, 'rb') as fp:
+            for buf in iter(lambda: fp.read(64 * 1024), b''):
+                digest.update(buf)
+        if digest.hexdigest() != meta['sha256']:
+            return None, "ファイル全体のハッシュが一致しません"
+
+    # 開始後に他のアップロードで使用量が増えている場合があるため、確定時にも容量を確認する
+    if user.role == 'client':
+        from storage_quota import check_quota, file_client_id
+        error = check_quota(file_client_id(site, request_obj), meta['total_size'])
+        if error:
+            return None, error
+
+    save_dir = os.path.join(settings.UPLOAD_DIR, str(uuid.uuid4()))
+    os.makedirs(save_dir, exist_ok=True)
+    save_path = os.path.join(save_dir, meta['filename'])
+    shutil.move(data_path, save_path)
+
+    shared_file = create_shared_file_record(
+        save_path,
+        meta['filename'],
+        meta['total_size'],
+        user,
+        site=site,
+        request_obj=request_obj,
+        title=meta['title'],
+        description=meta['description'],
+        category=meta['category'],
+        content_type=meta['content_type'],
+        client_visible=meta['client_visible']
+    )
+    shutil.rmtree(path, ignore_errors=True)
+    return shared_file, None
+
+def discard_upload(meta):
+    path = _staging_dir(meta['upload_id'])
+    shutil.rmtree(path, ignore_errors=True)
+
+def purge_expired_uploads(now=None):
+    # 最終更新から UPLOAD_STAGING_EXPIRE_SECONDS 以上経過したステージングデータを削除する
+    now = now or time.time()
+    removed = 0
+    try:
+        entries = os.scandir(settings.UPLOAD_STAGING_DIR)
+    except FileNotFoundError:
+        return 0
+    with entries:
+        for entry in entries:
+            if not entry.is_dir() or not _staging_dir(entry.name):
+                continue
+            try:
+                mtime = os.path.getmtime(os.path.join(entry.path, META_NAME))
+            except OSError:
+                mtime = entry.stat().st_mtime
+            if now - mtime > settings.UPLOAD_STAGING_EXPIRE_SECONDS:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+    return removed
@@ -0,0 +1,178 @@
+import argparse
+import datetime
+import os
+import shutil
+import time
+
+from peewee import fn, JOIN
+
+import settings
+from models import db, Site, Request, SharedFile, RequestMessage, bump_data_version, client_version_scope
+
+# アップロードファイルのガベージコレクション
+# - 論理削除から保持期間を過ぎたファイルを実ファイルごと削除する
+# - UPLOAD_DIR/<uuid>/ のうち SharedFile から参照されていないディレクトリ（孤立ファイル）を削除する
+# 全件をメモリに載せないよう、テーブルは id のキーセットで、ディレクトリは scandir で少しずつ走査する
+
+BATCH_SIZE = 500
+
+def _dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _file_dir(stored_path):
+    # stored_path は "<uuid>/<ファイル名>" 形式
+    head = stored_path.replace('\\', '/').split('/', 1)[0]
+    return os.path.join(settings.UPLOAD_DIR, head)
+
+def purge_deleted_files(retention_days, dry_run=False):
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=retention_days)
+    purged = 0
+    reclaimed = 0
+    last_id = 0
+    while True:
+        rows = list(SharedFile
+                    .select(SharedFile.id, SharedFile.stored_path,
+                            fn.COALESCE(Site.client, Request.client))
+                    .join(Site, JOIN.LEFT_OUTER, on=(SharedFile.site == Site.id))
+                    .switch(SharedFile)
+                    .join(Request, JOIN.LEFT_OUTER, on=(SharedFile.request == Request.id))
+                    .where((SharedFile.id > last_id) &
+                           (SharedFile.is_deleted == True) &
+                           (SharedFile.updated_at < cutoff))
+                    .order_by(SharedFile.id)
+                    .limit(BATCH_SIZE)
+                    .tuples())
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        affected_clients = set()
+        for file_id, stored_path, client_id in rows:
+            path = _file_dir(stored_path)
+            if dry_run:
+                purged += 1
+                reclaimed += _dir_size(path)
+                continue
+            # 走査後に復元された場合に備え、条件を付けて削除し、行が消えたときだけ実ファイルを消す
+            with db.atomic():
+                deleted = (SharedFile
+                           .delete()
+                           .where((SharedFile.id == file_id) &
+                                  (SharedFile.is_deleted == True) &
+                                  (SharedFile.updated_at < cutoff))
+                           .execute())
+                if deleted:
+                    RequestMessage.update(shared_file=None).where(RequestMessage.shared_file == file_id).execute()
+            if deleted:
+                affected_clients.add(client_id)
+                purged += 1
+                reclaimed += _dir_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+        # 一括削除は save() を通らないため、削除したファイルのクライアントのバージョンをバッチ毎に1回だけ上げる
+        bump_data_version(*[client_version_scope(c) for c in affected_clients])
+    return purged, reclaimed
+
+def _referenced_dirs(candidates):
+    # candidates: {ディレクトリ名: [stored_path候補, ...]}
+    paths = [p for values in candidates.values() for p in values]
+    referenced = set()
+    for i in range(0, len(paths), BATCH_SIZE):
+        query = (SharedFile
+                 .select(SharedFile.stored_path)
+                 .where(SharedFile.stored_path.in_(paths[i:i + BATCH_SIZE]))
+                 .tuples())
+        for (stored_path,) in query:
+            referenced.add(stored_path.replace('\\', '/').split('/', 1)[0])
+    return referenced
+
+def _remove_orphans(candidates, dry_run):
+    removed = 0
+    reclaimed = 0
+    referenced = _referenced_dirs(candidates)
+    for name in candidates:
+        if name in referenced:
+            continue
+        path = os.path.join(settings.UPLOAD_DIR, name)
+        removed += 1
+        reclaimed += _dir_size(path)
+        if not dry_run:
+            shutil.rmtree(path, ignore_errors=True)
+    return removed, reclaimed
+
+def purge_orphan_files(grace_seconds, dry_run=False, now=None):
+    # アップロード中は実ファイル保存から SharedFile 作成までの間に孤立状態があるため、
+    # 更新から grace_seconds 以内のディレクトリは対象外にする
+    now = now or time.time()
+    removed = 0
+    reclaimed = 0
+    candidates = {}
+    try:
+        entries = os.scandir(settings.UPLOAD_DIR)
+    except FileNotFoundError:
+        return 0, 0
+    with entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                if now - entry.stat().st_mtime < grace_seconds:
+                    continue
+                names = os.listdir(entry.path)
+            except OSError:
+                continue
+            candidates[entry.name] = [os.path.join(entry.name, n) for n in names]
+            if len(candidates) >= BATCH_SIZE:
+                r, b = _remove_orphans(candidates, dry_run)
+                removed += r
+                reclaimed += b
+                candidates = {}
+    if candidates:
+        r, b = _remove_orphans(candidates, dry_run)
+        removed += r
+        reclaimed += b
+    return removed, reclaimed
+
+def collect_garbage(retention_days=None, grace_seconds=None, dry_run=False):
+    from chunked_upload import purge_expired_uploads
+
+    if getattr(settings, 'READ_ONLY_MODE', False):
+        raise Exception("Database is in read-only mode.")
+    if retention_days is None:
+        retention_days = settings.FILE_GC_RETENTION_DAYS
+    if grace_seconds is None:
+        grace_seconds = settings.FILE_GC_ORPHAN_GRACE_SECONDS
+
+    purged, purged_bytes = purge_deleted_files(retention_days, dry_run=dry_run)
+    orphans, orphan_bytes = purge_orphan_files(grace_seconds, dry_run=dry_run)
+    staging = 0 if dry_run else purge_expired_uploads()
+    return {
+        'purged_files': purged,
+        'orphan_dirs': orphans,
+        'expired_staging': staging,
+        'reclaimed_bytes': purged_bytes + orphan_bytes
+    }
+
+if __name__ == '__main__':
+    from peewee import SqliteDatabase
+    from models import set_db
+
+    parser = argparse.ArgumentParser(description='削除済み・孤立したアップロードファイルを回収します')
+    parser.add_argument('--retention-days', type=int, default=settings.FILE_GC_RETENTION_DAYS,
+                        help='論理削除からの保持日数')
+    parser.add_argument('--grace-seconds', type=int, default=settings.FILE_GC_ORPHAN_GRACE_SECONDS,
+                        help='孤立ディレクトリとみなすまでの猶予秒数')
+    parser.add_argument('--dry-run', action='store_true', help='削除せずに対象のみ集計する')
+    args = parser.parse_args()
+
+    set_db(SqliteDatabase(settings.DB_PATH))
+    report = collect_garbage(args.retention_days, args.grace_seconds, dry_run=args.dry_run)
+    print(f"purged deleted files: {report['purged_files']}")
+    print(f"removed orphan dirs:  {report['orphan_dirs']}")
+    print(f"expired staging:      {report['expired_staging']}")
+    print(f"reclaimed bytes:      {report['reclaimed_bytes']}")
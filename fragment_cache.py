@@ -0,0 +1,173 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+import metrics
+import settings
+
+# ダッシュボード部品（フラグメント）のキャッシュ
+# キーは (部品名, 範囲, データバージョン)。データが変わればバージョンが変わるため、古い内容が返ることはない。
+# プロセス内の LRU（件数上限付き）と、複数プロセスで共有する SQLite ファイルの2段で保持する。
+# CGI では毎回プロセスが変わるため、実質的に効くのは SQLite 側。
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_shared_conn = None
+_shared_path = None
+
+def make_key(widget, scope, version):
+    return (str(widget), str(scope), repr(version))
+
+def _shared_connection():
+    # 共有キャッシュ（FRAGMENT_CACHE_DB）への接続。None の場合は共有しない
+    global _shared_conn, _shared_path
+    path = getattr(settings, 'FRAGMENT_CACHE_DB', None)
+    if not path:
+        return None
+    if _shared_conn is not None and _shared_path == path:
+        return _shared_conn
+    try:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=1, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS fragment ('
+                     'widget TEXT NOT NULL, scope TEXT NOT NULL, version TEXT NOT NULL, '
+                     'value TEXT NOT NULL, expires_at REAL NOT NULL, '
+                     'PRIMARY KEY (widget, scope, version))')
+        conn.execute('CREATE INDEX IF NOT EXISTS fragment_expires_at ON fragment (expires_at)')
+    except sqlite3.Error:
+        # キャッシュは補助的なものなので、使えない環境ではプロセス内のみで動作する
+        return None
+    _shared_conn = conn
+    _shared_path = path
+    return conn
+
+def _memory_get(key, now):
+    with _lock:
+        entry = _memory.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= now:
+            del _memory[key]
+            return None
+        _memory.move_to_end(key)
+        return value
+
+def _memory_set(key, value, expires_at):
+    limit = getattr(settings, 'FRAGMENT_CACHE_MAX_ENTRIES', 256)
+    with _lock:
+        _memory[key] = (value, expires_at)
+        _memory.move_to_end(key)
+        while len(_memory) > limit:
+            _memory.popitem(last=False)
+
+def get(widget, scope, version):
+    key = make_key(widget, scope, version)
+    now = time.time()
+    value = _memory_get(key, now)
+    if value is not None:
+        return value
+
+    conn = _shared_connection()
+    if conn is None:
+        return None
+    try:
+        row = conn.execute('SELECT value, expires_at FROM fragment WHERE widget = ? AND scope = ? AND version = ? AND expires_at > ?',
+                           key + (now,)).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    _memory_set(key, row[0], row[1])
+    return row[0]
+
+def put(widget, scope, version, value, ttl=None):
+    if ttl is None:
+        ttl = settings.FRAGMENT_CACHE_TTL
+    key = make_key(widget, scope, version)
+    now = time.time()
+    expires_at = now + ttl
+    _memory_set(key, value, expires_at)
+
+    conn = _shared_connection()
+    if conn is None:
+        return
+    try:
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # 同じ部品・範囲の古いバージョンと期限切れの行はここで掃除する
+            conn.execute('DELETE FROM fragment WHERE (widget = ? AND scope = ? AND version != ?) OR expires_at <= ?',
+                         key + (now,))
+            conn.execute('INSERT OR REPLACE INTO fragment (widget, scope, version, value, expires_at) VALUES (?, ?, ?, ?, ?)',
+                         key + (value, expires_at))
+    except sqlite3.Error:
+        pass
+
+def cached_fragment(widget, scope, version, render, ttl=None):
+    # ルートからも使える入口。キャッシュになければ render() の結果（文字列）を保存して返す
+    if not getattr(settings, 'FRAGMENT_CACHE_ENABLED', True):
+        return render()
+    value = get(widget, scope, version)
+    metrics.cache_event('fragment', value is not None)
+    if value is None:
+        value = str(render())
+        put(widget, scope, version, value, ttl)
+    return value
+
+def invalidate(widget=None, scope=None):
+    # 明示的な破棄（widget/scope を省略した場合は該当するもの全て）
+    with _lock:
+        for key in list(_memory):
+            if (widget is None or key[0] == str(widget)) and (scope is None or key[1] == str(scope)):
+                del _memory[key]
+
+    conn = _shared_connection()
+    if conn is None:
+        return
+    conditions = []
+    params = []
+    if widget is not None:
+        conditions.append('widget = ?')
+        params.append(str(widget))
+    if scope is not None:
+        conditions.append('scope = ?')
+        params.append(str(scope))
+    sql = 'DELETE FROM fragment'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    try:
+        with conn:
+            conn.execute(sql, params)
+    except sqlite3.Error:
+        pass
+
+def clear():
+    invalidate()
+
+class FragmentCacheExtension(Extension):
+    # テンプレート用のキャッシュタグ
+    # {% cache "部品名", 範囲, バージョン[, TTL秒] %} ... {% endcache %}
+    # キャッシュがあれば中身は評価しないため、中で参照するクエリも実行されない
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        if not 3 <= len(args) <= 4:
+            parser.fail('cache tag requires widget, scope, version and optional ttl', lineno)
+        if len(args) == 3:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', args), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, widget, scope, version, ttl, caller):
+        return cached_fragment(widget, scope, version, caller, ttl)
@@ -0,0 +1,51 @@
+import datetime
+import hashlib
+
+from bottle import request, response, HTTPResponse
+from models import client_data_version
+from auth import peek_csrf_token
+
+# クライアント画面の条件付き GET（ETag / 304）
+# クライアントのデータバージョン（models.DataVersion）から検証子を作り、If-None-Match が一致すれば
+# 重いクエリやテンプレート描画の前に 304 を返す。
+
+def make_etag(*parts):
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    # 圧縮の有無で本文のバイト列が変わるため弱い検証子とする
+    return f'W/"{digest}"'
+
+def _etag_matches(etag, if_none_match):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # 弱い比較（W/ の有無は区別しない）
+    target = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == target:
+            return True
+    return False
+
+def check_not_modified(*parts):
+    # 画面の内容を決める要素（ユーザー・CSRF トークン・日付・URL・データの状態）から ETag を作り、
+    # 一致すれば 304 で処理を打ち切る。一致しなければ ETag を付けて通常どおり描画させる
+    etag = make_etag(request.path, request.query_string, datetime.date.today().isoformat(), *parts)
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if request.method in ('GET', 'HEAD') and _etag_matches(etag, request.get_header('If-None-Match')):
+        raise HTTPResponse(status=304, **headers)
+    for key, value in headers.items():
+        response.set_header(key, value)
+    return etag
+
+def check_client_page_not_modified(user):
+    # クライアント画面共通の検証子
+    # CSRF トークンはページに埋め込まれるため、値そのものではなくハッシュを含める。
+    # 未発行の場合はここでは発行しない（ページ側で発行されれば、次回のリクエストから検証子が安定する）
+    token_digest = hashlib.sha1((peek_csrf_token() or '').encode('utf-8')).hexdigest()
+    return check_not_modified(
+        user.id, user.email, token_digest,
+        client_data_version(user.client_id)
+    )
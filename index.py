@@ -1,18 +1,20 @@
 #!/usr/local/bin/python3
 
-import os
-import sys
-import urllib.parse
-from bottle import Bottle, run, request, redirect, jinja2_view, static_file, abort, TEMPLATE_PATH, jinja2_template
-from models import init_db, User, Client, SharedFile, Site, set_db
-
-# テンプレートのパスを追加
-TEMPLATE_PATH.insert(0, os.path.join(os.path.dirname(__file__), 'templates'))
+import logging
+import secrets
+from bottle import Bottle, run, request, response, redirect, static_file, abort
+from models import init_db, User, set_db
+from templating import jinja2_view, jinja2_template, lazy
 from peewee import SqliteDatabase
-from auth import verify_password, set_session, get_current_user, generate_csrf_token, hash_password, login_required
+from auth import verify_password, set_session, get_current_user, generate_csrf_token, hash_password, login_required, check_file_access
 from routes_admin import admin_app
 from routes_client import client_app
+from routes_upload import upload_app
 from utils import verify_file_token
+from middleware import CompressionMiddleware
+from profiling import ProfilingMiddleware
+import applog
+import metrics
 import settings
 
 # Proxyを初期化
@@ -21,6 +23,15 @@ if not settings.DB_PATH.startswith('test_'): # テスト時は conftest.py で
 
 app = Bottle()
 
+# アプリケーションのログ（settings.LOG_LEVEL）
+applog.configure(root=app)
+log = applog.get_logger('index')
+if applog.enabled(logging.CRITICAL):
+    # ログの経過時間の起点（サブアプリへのリクエストもここを通る）
+    @app.hook('before_request')
+    def _log_request_start():
+        applog.begin_request(request.environ)
+
 # データベース初期化 (モジュール読み込み時には実行せず、明示的に呼び出す)
 def init_app_db():
     init_db()
@@ -36,32 +47,12 @@ def download_file(token):
     if not file_id:
         abort(404, "Invalid or expired token")
     
-    try:
-        f = SharedFile.get_by_id(file_id)
-    except SharedFile.DoesNotExist:
-        abort(404, "File not found")
-    
-    if f.is_deleted:
-        abort(404, "File is deleted")
-        
-    user = get_current_user()
-    
-    # 権限チェック
-    if user.role == 'admin':
-        # 管理者は全アクセス可（ただし削除済みはURL直接でも上記で弾いている）
-        pass
-    else:
-        # クライアントの場合
-        if not f.client_visible:
-            abort(403, "Access denied")
-        # サイト所属チェック
-        if f.site and f.site.client.id != user.client.id:
-            abort(403, "Access denied")
-        # 依頼所属チェック (Request実装時用)
-        if f.request and f.request.client.id != user.client.id:
-            abort(403, "Access denied")
-
-    return static_file(f.stored_path, root=settings.UPLOAD_DIR, download=f.original_filename)
+    f = check_file_access(file_id)
+
+    res = static_file(f.stored_path, root=settings.UPLOAD_DIR, download=f.original_filename)
+    if res.status_code in (200, 206):
+        metrics.inc('mv_download_bytes_total', int(res.headers.get('Content-Length', 0)))
+    return res
 
 # 初期管理者作成
 def create_default_admin():
@@ -86,16 +77,13 @@ def login():
 
     error = None
     if request.method == 'POST':
-        # CGI環境でのデバッグ用ログ出力
-        if settings.IS_CGI:
-            print(f"DEBUG: login POST - path: {request.path}, script_name: {request.environ.get('SCRIPT_NAME')}", file=sys.stderr)
+        log.debug("login POST: path=%s, SCRIPT_NAME=%s", request.path, request.environ.get('SCRIPT_NAME'))
 
         # CSRFチェックの追加
         try:
             check_csrf_token()
         except Exception as e:
-            if settings.IS_CGI:
-                print(f"DEBUG: CSRF failure: {str(e)}", file=sys.stderr)
+            log.debug("login: CSRF check failed: %s", e)
             abort(403, str(e))
 
         email = request.forms.decode().get('email')
@@ -113,14 +101,13 @@ def login():
         # ただしこの error はリダイレクトせずに render されるので文字化けの問題は起きにくいはず
 
         if user:
-            if settings.IS_CGI:
-                print(f"DEBUG: login success - user: {user.email}", file=sys.stderr)
+            log.info("login succeeded", extra={'login_user_id': user.id})
             set_session({'user_id': user.id})
             if user.role == 'admin': redirect('/admin')
             else: redirect('/client')
     
-    if settings.IS_CGI:
-        print(f"DEBUG: rendering login page - cookie: {request.get_cookie('session')}", file=sys.stderr)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("rendering login page: session cookie %s", 'present' if request.get_cookie('session') else 'absent')
     return {
         'error': error, 
         'csrf_token': generate_csrf_token(), 
@@ -143,6 +130,20 @@ def index():
     else:
         redirect('/client')
 
+@app.route('/metrics')
+def metrics_endpoint():
+    if not settings.METRICS_ENABLED:
+        abort(404)
+    token = settings.METRICS_TOKEN
+    if token:
+        if not secrets.compare_digest(request.get_header('Authorization', ''), f"Bearer {token}"):
+            abort(403, "Invalid metrics token")
+    # request.remote_addr は X-Forwarded-For を優先するため、接続元のアドレスで判定する
+    elif request.environ.get('REMOTE_ADDR') not in ('127.0.0.1', '::1'):
+        abort(403, "Metrics are only available from localhost (set METRICS_TOKEN)")
+    response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    return metrics.render()
+
 @app.route('/api/version')
 def api_version():
     return {
@@ -154,6 +155,7 @@ def api_version():
 # アプリケーションのマウント
 app.mount('/admin', admin_app)
 app.mount('/client', client_app)
+app.mount('/uploads', upload_app)
 
 @app.error(403)
 @admin_app.error(403)
@@ -161,22 +163,36 @@ app.mount('/client', client_app)
 def error403(error):
     from utils import get_display_labels, get_app_settings
     return jinja2_template('error_403.html', {
-        'current_user': get_current_user(),
+        'current_user': lazy(get_current_user),
         'read_only_mode': getattr(settings, 'READ_ONLY_MODE', False),
         'error_message': error.body,
-        'labels': get_display_labels(),
-        'app_settings': get_app_settings(),
-        'csrf_token': generate_csrf_token()
+        'labels': lazy(get_display_labels),
+        'app_settings': lazy(get_app_settings),
+        'csrf_token': lazy(generate_csrf_token)
     })
 
+# WSGI エントリポイント（レスポンス圧縮付き）
+if settings.COMPRESSION_ENABLED:
+    application = CompressionMiddleware(app)
+else:
+    application = app
+# 処理時間の計測（圧縮を含めた全体の時間と送信サイズを計測するため一番外側に置く）
+# 遅いリクエストのログは PROFILING_ENABLED、件数・所要時間の集計は METRICS_ENABLED、
+# cProfile の計測は PROFILE_CAPTURE_ENABLED、アクセスの記録は WORKLOAD_CAPTURE_ENABLED の場合のみ
+if (settings.PROFILING_ENABLED or settings.METRICS_ENABLED or settings.PROFILE_CAPTURE_ENABLED
+        or settings.WORKLOAD_CAPTURE_ENABLED):
+    application = ProfilingMiddleware(application, root=app,
+                                      log_path=settings.SLOW_LOG_PATH if settings.PROFILING_ENABLED else '')
+
 # マウント後に各アプリの catchall も設定（テスト用）
 def set_apps_catchall(value):
     app.catchall = value
     admin_app.catchall = value
     client_app.catchall = value
+    upload_app.catchall = value
 
 if __name__ == '__main__':
     if settings.IS_CGI:
-        run(app, server='cgi')
+        run(application, server='cgi')
     else:
-        run(app, host='localhost', port=8080, debug=settings.DEBUG, reloader=True)
+        run(application, host='localhost', port=8080, debug=settings.DEBUG, reloader=True)
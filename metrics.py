@@ -0,0 +1,193 @@
+import atexit
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import settings
+
+# 稼働状況の集計（Prometheus のテキスト形式で /metrics から出力する）
+# 値はすべて加算のみのカウンター（ヒストグラムもバケット毎のカウンター）として扱う。
+# プロセス内で溜めた増分を METRICS_FLUSH_SECONDS 毎（CGI ではプロセス終了時）に METRICS_DB へ加算するため、
+# 複数のプロセスで処理しても合計が出力される。METRICS_DB が None の場合はプロセス内の値のみ。
+
+# 名前: (種類, 説明)
+METRICS = {
+    'mv_http_requests_total': ('counter', 'HTTP requests by route and status.'),
+    'mv_http_request_duration_seconds': ('histogram', 'HTTP request latency (until the response body is sent).'),
+    'mv_db_queries_total': ('counter', 'SQL statements executed by route.'),
+    'mv_db_query_duration_seconds_total': ('counter', 'Time spent executing SQL by route.'),
+    'mv_db_locked_total': ('counter', 'SQL statements that failed with "database is locked".'),
+    'mv_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit/miss).'),
+    'mv_upload_bytes_total': ('counter', 'Bytes received as uploaded files (including chunked uploads).'),
+    'mv_download_bytes_total': ('counter', 'Bytes sent as file downloads (single files and ZIP bundles).'),
+}
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+# {(名前, ラベル文字列): 未書き込みの増分}
+_pending = {}
+_last_flush = time.time()
+_conn = None
+_conn_path = None
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(labels):
+    # Prometheus のラベル表記（キー順に並べ、同じラベルが同じ行になるようにする）
+    return ','.join(f'{key}="{_escape(labels[key])}"' for key in sorted(labels))
+
+def inc(name, value=1, **labels):
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        return
+    key = (name, format_labels(labels))
+    with _lock:
+        _pending[key] = _pending.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    # ヒストグラムへの記録（le は累積）
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        return
+    # 0 のバケットも出力しないと histogram_quantile() が正しく計算できないため、全バケットを持つ
+    updates = [(format_labels(dict(labels, le=_format_value(le))), 1 if seconds <= le else 0) for le in DURATION_BUCKETS]
+    updates.append((format_labels(dict(labels, le='+Inf')), 1))
+    with _lock:
+        for bucket_labels, value in updates:
+            key = (f'{name}_bucket', bucket_labels)
+            _pending[key] = _pending.get(key, 0) + value
+        base = format_labels(labels)
+        _pending[(f'{name}_sum', base)] = _pending.get((f'{name}_sum', base), 0) + seconds
+        _pending[(f'{name}_count', base)] = _pending.get((f'{name}_count', base), 0) + 1
+
+def cache_event(cache, hit):
+    inc('mv_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+def observe_request(method, route, status, seconds, queries, sql_seconds):
+    inc('mv_http_requests_total', method=method, route=route, status=status)
+    observe('mv_http_request_duration_seconds', seconds, method=method, route=route)
+    if queries:
+        inc('mv_db_queries_total', queries, method=method, route=route)
+        inc('mv_db_query_duration_seconds_total', sql_seconds, method=method, route=route)
+    maybe_flush()
+
+def _connection():
+    global _conn, _conn_path
+    path = getattr(settings, 'METRICS_DB', None)
+    if not path:
+        return None
+    if _conn is not None and _conn_path == path:
+        return _conn
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=1, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS metric ('
+                     'name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, '
+                     'PRIMARY KEY (name, labels))')
+    except sqlite3.Error:
+        return None
+    _conn = conn
+    _conn_path = path
+    return conn
+
+def flush():
+    # 溜めた増分を共有ファイルに加算する（書けなければ次回に持ち越す）
+    global _last_flush
+    with _lock:
+        _last_flush = time.time()
+        if not _pending:
+            return True
+        rows = [(name, labels, value) for (name, labels), value in _pending.items()]
+        _pending.clear()
+    conn = _connection()
+    written = False
+    if conn is not None:
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('INSERT INTO metric (name, labels, value) VALUES (?, ?, ?) '
+                                 'ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value', rows)
+            written = True
+        except sqlite3.Error:
+            pass
+    if not written:
+        with _lock:
+            for name, labels, value in rows:
+                _pending[(name, labels)] = _pending.get((name, labels), 0) + value
+    return written
+
+def maybe_flush():
+    if time.time() - _last_flush >= getattr(settings, 'METRICS_FLUSH_SECONDS', 5):
+        flush()
+
+def snapshot():
+    # {(名前, ラベル文字列): 値}（共有ファイルの値 + 未書き込みの増分）
+    flush()
+    values = {}
+    conn = _connection()
+    if conn is not None:
+        try:
+            for name, labels, value in conn.execute('SELECT name, labels, value FROM metric'):
+                values[(name, labels)] = value
+        except sqlite3.Error:
+            pass
+    with _lock:
+        for key, value in _pending.items():
+            values[key] = values.get(key, 0) + value
+    return values
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _base_name(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+_LE_LABEL = re.compile(r'(^|,)le="([^"]*)"')
+
+def _histogram_order(base, name, labels):
+    # ラベル毎に _bucket（le の昇順）, _count, _sum の順に並べる
+    match = _LE_LABEL.search(labels)
+    if match is None:
+        return (labels, True, 0.0, name)
+    le = match.group(2)
+    rest = _LE_LABEL.sub('', labels).lstrip(',')
+    return (rest, name != f'{base}_bucket', float('inf') if le == '+Inf' else float(le), name)
+
+def render(values=None):
+    values = snapshot() if values is None else values
+    grouped = {}
+    for (name, labels), value in values.items():
+        grouped.setdefault(_base_name(name), []).append((name, labels, value))
+    lines = []
+    for base in sorted(grouped):
+        kind, help_text = METRICS.get(base, ('untyped', ''))
+        lines.append(f'# HELP {base} {help_text}')
+        lines.append(f'# TYPE {base} {kind}')
+        rows = grouped[base]
+        if kind == 'histogram':
+            rows.sort(key=lambda r: _histogram_order(base, r[0], r[1]))
+        else:
+            rows.sort()
+        for name, labels, value in rows:
+            lines.append(f'{name}{{{labels}}} {_format_value(value)}' if labels else f'{name} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    # プロセス内の値を破棄し、共有ファイルへの接続を閉じる（テスト用）
+    global _conn, _conn_path
+    with _lock:
+        _pending.clear()
+        if _conn is not None:
+            _conn.close()
+        _conn = None
+        _conn_path = None
+
+atexit.register(flush)
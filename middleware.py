@@ -0,0 +1,189 @@
+import zlib
+
+import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# レスポンス圧縮（WSGI ミドルウェア）
+# text/html, application/json, text/csv を Accept-Encoding に応じて gzip（brotli が入っていれば br）で圧縮する。
+# ストリーミングされる本文にも対応し、アプリから受け取ったチャンク毎に圧縮して送り出す。
+
+COMPRESSIBLE_TYPES = {'text/html', 'application/json', 'text/csv'}
+
+def _accepted_encodings(environ):
+    accepted = {}
+    for item in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return {name for name, q in accepted.items() if q > 0}
+
+class _GzipEncoder(object):
+    name = 'gzip'
+
+    def __init__(self, level):
+        # wbits=31: gzip ヘッダー付き
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        # チャンク毎に同期フラッシュして、ストリーミング中も受け取った分はすぐ送れるようにする
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush(zlib.Z_FINISH)
+
+class _BrotliEncoder(object):
+    name = 'br'
+
+    def __init__(self, level):
+        # brotli の品質は 0-11。gzip の 1-9 をおおよそ対応させる
+        self._obj = brotli.Compressor(quality=min(11, max(0, level)))
+
+    def compress(self, data):
+        return self._obj.process(data) + self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+class CompressionMiddleware(object):
+    def __init__(self, app, min_size=None, level=None, exclude_prefixes=None):
+        self.app = app
+        self.min_size = settings.COMPRESSION_MIN_BYTES if min_size is None else min_size
+        self.level = settings.COMPRESSION_LEVEL if level is None else level
+        # /files/ は配信ファイルそのもの（多くは圧縮済み形式）なので対象外
+        self.exclude_prefixes = tuple(exclude_prefixes if exclude_prefixes is not None else settings.COMPRESSION_EXCLUDE_PREFIXES)
+
+    def _choose_encoder(self, environ):
+        accepted = _accepted_encodings(environ)
+        if brotli is not None and 'br' in accepted:
+            return _BrotliEncoder(self.level)
+        if 'gzip' in accepted:
+            return _GzipEncoder(self.level)
+        return None
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if (environ.get('REQUEST_METHOD') == 'HEAD' or
+                not environ.get('HTTP_ACCEPT_ENCODING') or
+                path.startswith(self.exclude_prefixes)):
+            return self.app(environ, start_response)
+
+        captured = {}
+        written = []
+
+        def _start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            captured['exc_info'] = exc_info
+            # 旧式の write() で書かれた本文は溜めておき、本文の先頭として扱う
+            return written.append
+
+        app_iter = self.app(environ, _start_response)
+        return self._respond(environ, start_response, captured, app_iter, written)
+
+    def _respond(self, environ, start_response, captured, app_iter, written):
+        iterator = iter(app_iter)
+        pending = written
+        try:
+            # start_response が最初のチャンク取得時に呼ばれるアプリにも対応する
+            while 'status' not in captured:
+                try:
+                    pending.append(next(iterator))
+                except StopIteration:
+                    break
+
+            status = captured['status']
+            headers = list(captured['headers'])
+            header_map = {k.lower(): v for k, v in headers}
+            content_type = header_map.get('content-type', '').split(';')[0].strip().lower()
+            code = int(status.split(' ', 1)[0])
+
+            compressible = (content_type in COMPRESSIBLE_TYPES and
+                            'content-encoding' not in header_map and
+                            code not in (204, 304) and code >= 200)
+            if compressible:
+                headers = self._add_vary(headers, header_map)
+            encoder = self._choose_encoder(environ) if compressible else None
+
+            content_length = header_map.get('content-length')
+            if encoder is not None and content_length is not None:
+                try:
+                    if int(content_length) < self.min_size:
+                        encoder = None
+                except ValueError:
+                    encoder = None
+
+            if encoder is not None and content_length is None:
+                # 長さ不明（ストリーミング）の場合は、しきい値に達するまで先読みして判断する
+                buffered = sum(len(c) for c in pending)
+                finished = False
+                while buffered < self.min_size:
+                    try:
+                        chunk = next(iterator)
+                    except StopIteration:
+                        finished = True
+                        break
+                    pending.append(chunk)
+                    buffered += len(chunk)
+                if finished:
+                    encoder = None
+                    body = b''.join(pending)
+                    pending = [body]
+                    headers.append(('Content-Length', str(len(body))))
+        except BaseException:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+            raise
+
+        if encoder is None:
+            start_response(status, headers, captured.get('exc_info'))
+            return self._passthrough(pending, iterator, app_iter)
+
+        headers = [(k, v) for k, v in headers if k.lower() != 'content-length']
+        headers.append(('Content-Encoding', encoder.name))
+        start_response(status, headers, captured.get('exc_info'))
+        return self._compress(encoder, pending, iterator, app_iter)
+
+    def _add_vary(self, headers, header_map):
+        vary = header_map.get('vary')
+        if vary is None:
+            return headers + [('Vary', 'Accept-Encoding')]
+        if 'accept-encoding' in vary.lower():
+            return headers
+        return [(k, v) for k, v in headers if k.lower() != 'vary'] + [('Vary', vary + ', Accept-Encoding')]
+
+    def _passthrough(self, pending, iterator, app_iter):
+        try:
+            for chunk in pending:
+                yield chunk
+            for chunk in iterator:
+                yield chunk
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+    def _compress(self, encoder, pending, iterator, app_iter):
+        try:
+            for chunk in pending:
+                if chunk:
+                    yield encoder.compress(chunk)
+            for chunk in iterator:
+                if chunk:
+                    yield encoder.compress(chunk)
+            yield encoder.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
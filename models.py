@@ -8,6 +8,9 @@ def set_db(database):
     db.initialize(database)
 
 class BaseModel(Model):
+    # データバージョンの範囲を決める外部キー（これが変わる更新では変更前の範囲も更新する）
+    data_version_owner_fields = ()
+
     class Meta:
         database = db
     
@@ -17,6 +20,30 @@ class BaseModel(Model):
             raise Exception("Database is in read-only mode.")
         return super(BaseModel, self).save(*args, **kwargs)
 
+    def data_version_scopes(self):
+        # このレコードの変更で更新するデータバージョンの範囲（クライアントに属するモデルで上書きする）
+        return set()
+
+    def _save_with_data_version(self, save, *args, **kwargs):
+        with db.atomic():
+            scopes = set()
+            dirty = {f.name for f in self.dirty_fields}
+            if self._pk is not None and dirty.intersection(self.data_version_owner_fields):
+                previous = type(self).get_or_none(type(self)._meta.primary_key == self._pk)
+                if previous is not None:
+                    scopes |= previous.data_version_scopes()
+            result = save(*args, **kwargs)
+            scopes |= self.data_version_scopes()
+            bump_data_version(*scopes)
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        with db.atomic():
+            scopes = self.data_version_scopes()
+            result = super(BaseModel, self).delete_instance(*args, **kwargs)
+            bump_data_version(*scopes)
+        return result
+
     @classmethod
     def create(cls, **query):
         import settings
@@ -35,7 +62,10 @@ class Client(BaseModel):
 
     def save(self, *args, **kwargs):
         self.updated_at = datetime.datetime.now()
-        return super(BaseModel, self).save(*args, **kwargs)
+        return self._save_with_data_version(super(BaseModel, self).save, *args, **kwargs)
+
+    def data_version_scopes(self):
+        return {client_version_scope(self.id)}
 
 class User(BaseModel):
     email = CharField(unique=True)
@@ -62,9 +92,14 @@ class Site(BaseModel):
     created_at = DateTimeField(default=datetime.datetime.now)
     updated_at = DateTimeField(default=datetime.datetime.now)
 
+    data_version_owner_fields = ('client',)
+
     def save(self, *args, **kwargs):
         self.updated_at = datetime.datetime.now()
-        return super(BaseModel, self).save(*args, **kwargs)
+        return self._save_with_data_version(super(BaseModel, self).save, *args, **kwargs)
+
+    def data_version_scopes(self):
+        return {client_version_scope(self.client_id)}
 
 class MaintenanceLog(BaseModel):
     site = ForeignKeyField(Site, backref='logs')
@@ -80,9 +115,14 @@ class MaintenanceLog(BaseModel):
     created_at = DateTimeField(default=datetime.datetime.now)
     updated_at = DateTimeField(default=datetime.datetime.now)
 
+    data_version_owner_fields = ('site',)
+
     def save(self, *args, **kwargs):
         self.updated_at = datetime.datetime.now()
-        return super(MaintenanceLog, self).save(*args, **kwargs)
+        return self._save_with_data_version(super(MaintenanceLog, self).save, *args, **kwargs)
+
+    def data_version_scopes(self):
+        return {client_version_scope(_site_client_id(self.site_id))}
 
 class Request(BaseModel):
     client = ForeignKeyField(Client, backref='requests')
@@ -97,9 +137,14 @@ class Request(BaseModel):
     created_at = DateTimeField(default=datetime.datetime.now)
     updated_at = DateTimeField(default=datetime.datetime.now)
 
+    data_version_owner_fields = ('client',)
+
     def save(self, *args, **kwargs):
         self.updated_at = datetime.datetime.now()
-        return super(Request, self).save(*args, **kwargs)
+        return self._save_with_data_version(super(Request, self).save, *args, **kwargs)
+
+    def data_version_scopes(self):
+        return {client_version_scope(self.client_id)}
 
 class RequestMessage(BaseModel):
     request = ForeignKeyField(Request, backref='messages')
@@ -109,6 +154,14 @@ class RequestMessage(BaseModel):
     shared_file = DeferredForeignKey('SharedFile', backref='request_messages', null=True)
     created_at = DateTimeField(default=datetime.datetime.now)
 
+    data_version_owner_fields = ('request',)
+
+    def save(self, *args, **kwargs):
+        return self._save_with_data_version(super(RequestMessage, self).save, *args, **kwargs)
+
+    def data_version_scopes(self):
+        return {client_version_scope(_request_client_id(self.request_id))}
+
 class LogTemplate(BaseModel):
     name = CharField()
     category = CharField()
@@ -126,6 +179,12 @@ class DisplayLabel(BaseModel):
     key = CharField(unique=True)
     value = CharField()
 
+    def save(self, *args, **kwargs):
+        return self._save_with_data_version(super(DisplayLabel, self).save, *args, **kwargs)
+
+    def data_version_scopes(self):
+        return {SETTINGS_VERSION_SCOPE}
+
 class AppSetting(BaseModel):
     key = CharField(unique=True)
     value = TextField()
@@ -133,7 +192,10 @@ class AppSetting(BaseModel):
 
     def save(self, *args, **kwargs):
         self.updated_at = datetime.datetime.now()
-        return super(AppSetting, self).save(*args, **kwargs)
+        return self._save_with_data_version(super(AppSetting, self).save, *args, **kwargs)
+
+    def data_version_scopes(self):
+        return {SETTINGS_VERSION_SCOPE}
 
 class Notice(BaseModel):
     site = ForeignKeyField(Site, backref='notices')
@@ -145,9 +207,14 @@ class Notice(BaseModel):
     created_at = DateTimeField(default=datetime.datetime.now)
     updated_at = DateTimeField(default=datetime.datetime.now)
 
+    data_version_owner_fields = ('site',)
+
     def save(self, *args, **kwargs):
         self.updated_at = datetime.datetime.now()
-        return super(Notice, self).save(*args, **kwargs)
+        return self._save_with_data_version(super(Notice, self).save, *args, **kwargs)
+
+    def data_version_scopes(self):
+        return {client_version_scope(_site_client_id(self.site_id))}
 
 class SharedFile(BaseModel):
     site = ForeignKeyField(Site, backref='shared_files', null=True)
@@ -165,10 +232,88 @@ class SharedFile(BaseModel):
     created_at = DateTimeField(default=datetime.datetime.now)
     updated_at = DateTimeField(default=datetime.datetime.now)
 
+    data_version_owner_fields = ('site', 'request')
+
     def save(self, *args, **kwargs):
         self.updated_at = datetime.datetime.now()
-        return super(SharedFile, self).save(*args, **kwargs)
+        return self._save_with_data_version(super(SharedFile, self).save, *args, **kwargs)
+
+    def data_version_scopes(self):
+        if self.site_id:
+            return {client_version_scope(_site_client_id(self.site_id))}
+        return {client_version_scope(_request_client_id(self.request_id))}
+
+class ClientStorageUsage(BaseModel):
+    # クライアント毎のファイル使用量（アップロード・削除・復元時に差分で更新する）
+    client = ForeignKeyField(Client, backref='storage_usage', unique=True)
+    used_bytes = BigIntegerField(default=0)
+    file_count = IntegerField(default=0)
+    quota_bytes = BigIntegerField(null=True)  # null = settings.CLIENT_STORAGE_QUOTA_BYTES
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+class DataVersion(BaseModel):
+    # キャッシュ無効化用のデータバージョン（範囲毎に単調増加する）
+    # scope: 'client:<id>' = クライアント単位, 'settings' = 表示設定・ラベル,
+    #        'all' = 全クライアント（シードの再作成など、対象のクライアントを特定しない一括更新時）
+    # ファイル回収（file_gc.py）の一括削除は、削除したファイルのクライアントの範囲をバッチ毎に1回だけ上げる
+    scope = CharField(unique=True)
+    version = BigIntegerField(default=0)
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+ALL_VERSION_SCOPE = 'all'
+SETTINGS_VERSION_SCOPE = 'settings'
+
+def client_version_scope(client_id):
+    return f"client:{client_id}" if client_id else None
+
+def _site_client_id(site_id):
+    if not site_id:
+        return None
+    return Site.select(Site.client).where(Site.id == site_id).scalar()
+
+def _request_client_id(request_id):
+    if not request_id:
+        return None
+    return Request.select(Request.client).where(Request.id == request_id).scalar()
+
+# このプロセスで表示設定・ラベルを変更した回数（utils のリクエスト内キャッシュの無効化用）
+settings_change_count = 0
+
+def bump_data_version(*scopes):
+    # 保存処理と同じトランザクション内で呼ぶ。
+    # update()/delete() による一括更新では save() を通らないため、呼び出し側で明示的に呼ぶこと
+    global settings_change_count
+    scopes = sorted({scope for scope in scopes if scope})
+    if not scopes:
+        return
+    if SETTINGS_VERSION_SCOPE in scopes or ALL_VERSION_SCOPE in scopes:
+        settings_change_count += 1
+    now = datetime.datetime.now()
+    (DataVersion
+     .insert_many([{'scope': scope, 'version': 1, 'updated_at': now} for scope in scopes])
+     .on_conflict(
+         conflict_target=[DataVersion.scope],
+         update={DataVersion.version: DataVersion.version + 1, DataVersion.updated_at: now})
+     .execute())
+
+def get_data_versions(*scopes):
+    versions = dict.fromkeys(scopes, 0)
+    query = DataVersion.select(DataVersion.scope, DataVersion.version).where(DataVersion.scope.in_(list(scopes))).tuples()
+    for scope, version in query:
+        versions[scope] = version
+    return versions
+
+def client_data_version(client_id):
+    # クライアント向け画面のキャッシュキー（1クエリ）
+    # クライアント自身・全体・表示設定の各バージョンの組を返す
+    scope = client_version_scope(client_id)
+    versions = get_data_versions(scope, ALL_VERSION_SCOPE, SETTINGS_VERSION_SCOPE)
+    return (versions[scope], versions[ALL_VERSION_SCOPE], versions[SETTINGS_VERSION_SCOPE])
+
+def global_data_version():
+    # 全範囲のバージョンの合計（管理画面など、クライアントをまたぐ画面のキャッシュキー）
+    return DataVersion.select(fn.COALESCE(fn.SUM(DataVersion.version), 0)).scalar()
 
 def init_db():
     db.connect()
-    db.create_tables([User, Client, Site, MaintenanceLog, Notice, LogTemplate, DisplayLabel, AppSetting, Request, RequestMessage, SharedFile])
+    db.create_tables([User, Client, Site, MaintenanceLog, Notice, LogTemplate, DisplayLabel, AppSetting, Request, RequestMessage, SharedFile, ClientStorageUsage, DataVersion])
@@ -0,0 +1,129 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from peewee import OperationalError
+
+from models import db
+
+# 実行された SQL の記録（性能計測・テスト用）
+# データベースの execute_sql を一度だけ差し替え、count_queries() の範囲内で実行された SQL を記録する。
+# 記録はスレッド毎なので、同時に処理中の他のリクエストの SQL は混ざらない。
+
+_local = threading.local()
+ROOT = os.path.dirname(os.path.abspath(__file__))
+_SELF = os.path.abspath(__file__)
+
+def _call_sites(frame):
+    # アプリ内の呼び出し元（外側から順）。テンプレートはテンプレート上の行番号に変換する
+    sites = []
+    while frame is not None:
+        template = frame.f_globals.get('__jinja_template__')
+        code = frame.f_code
+        if template is not None:
+            sites.append(f"{template.name}:{template.get_corresponding_lineno(frame.f_lineno)}")
+        else:
+            filename = code.co_filename
+            if not filename.startswith('<'):
+                filename = os.path.abspath(filename)
+            if filename.startswith(ROOT) and filename != _SELF and os.sep + 'tests' + os.sep not in filename:
+                sites.append(f"{os.path.relpath(filename, ROOT)}:{frame.f_lineno} in {code.co_name}")
+        frame = frame.f_back
+    sites.reverse()
+    return sites
+
+class QueryLog(object):
+    def __init__(self, capture_stack=False):
+        self.capture_stack = capture_stack
+        # (sql, params, 所要秒数, 呼び出し元 ["ファイル:行 in 関数" / "テンプレート:行"] or None)
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def total_time(self):
+        return sum(s[2] for s in self.statements)
+
+    def __len__(self):
+        return len(self.statements)
+
+def _active_logs():
+    logs = getattr(_local, 'logs', None)
+    if logs is None:
+        logs = _local.logs = []
+    return logs
+
+def install(database=None):
+    # 対象のデータベース（省略時は models.db に設定されているもの）の execute_sql を記録付きにする
+    database = database or db.obj
+    if getattr(database, '_perf_original_execute_sql', None) is not None:
+        return database
+    original = database.execute_sql
+
+    def execute_sql(sql, params=None, *args, **kwargs):
+        logs = getattr(_local, 'logs', None)
+        if not logs:
+            return original(sql, params, *args, **kwargs)
+        stack = None
+        if any(log.capture_stack for log in logs):
+            stack = _call_sites(sys._getframe(1))
+        start = time.perf_counter()
+        try:
+            return original(sql, params, *args, **kwargs)
+        except OperationalError as e:
+            if 'locked' in str(e):
+                import metrics
+                metrics.inc('mv_db_locked_total')
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            for log in logs:
+                log.statements.append((sql, params, elapsed, stack if log.capture_stack else None))
+
+    database._perf_original_execute_sql = original
+    database.execute_sql = execute_sql
+    return database
+
+def uninstall(database=None):
+    database = database or db.obj
+    original = getattr(database, '_perf_original_execute_sql', None)
+    if original is not None:
+        del database.execute_sql
+        database._perf_original_execute_sql = None
+
+def begin(capture_stack=False, database=None):
+    # 記録を開始する（with を使えない場合用。end() と必ず対にすること）
+    install(database)
+    log = QueryLog(capture_stack)
+    _active_logs().append(log)
+    return log
+
+def end(log):
+    logs = _active_logs()
+    if log in logs:
+        logs.remove(log)
+    return log
+
+@contextmanager
+def count_queries(capture_stack=False, database=None):
+    # with count_queries() as log: ... の範囲で実行された SQL を log.statements に記録する（入れ子可）
+    log = begin(capture_stack, database)
+    try:
+        yield log
+    finally:
+        end(log)
+
+def format_statements(log, limit=None):
+    # 記録した SQL を呼び出し元付きで整形する（テストの失敗メッセージ用）
+    lines = []
+    for i, (sql, params, elapsed, sites) in enumerate(log.statements[:limit], 1):
+        lines.append(f"{i:3d}. {sql}  {list(params or [])}")
+        for site in sites or []:
+            lines.append(f"       at {site}")
+    if limit is not None and len(log.statements) > limit:
+        lines.append(f"     ... {len(log.statements) - limit} more")
+    return "\n".join(lines)
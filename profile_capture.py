@@ -0,0 +1,229 @@
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import urllib.parse
+
+from bottle import Router, HTTPError
+
+import settings
+
+# 個別リクエストの cProfile 計測（ProfilingMiddleware から呼ばれる）
+# 次のどちらかに当てはまるリクエストだけを cProfile 付きで処理し、結果を PROFILE_DIR に保存する。
+#   1. 管理画面で発行した署名付きの URL（?_profile=<トークン>。パスと有効期限を含む）
+#   2. 管理画面で指定したルート（"GET /client/reports/monthly" など）の次の N 回
+# 保存した .prof は pstats / snakeviz でそのまま開ける。一覧用の概要は同名の .json に保存する。
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+QUERY_PARAM = '_profile'
+ARMED_NAME = 'armed.json'
+# 保存したファイル名（日時-メソッド-パス）
+_NAME_PATTERN = re.compile(r'^\d{8}-\d{6}-\d{6}-[A-Z]+-[0-9A-Za-z-]+$')
+_lock = threading.Lock()
+_armed_cache = {'key': None, 'routes': [], 'router': None}
+
+def _serializer():
+    from itsdangerous import URLSafeTimedSerializer
+    return URLSafeTimedSerializer(settings.SECRET_KEY, salt=settings.PROFILE_TOKEN_SALT)
+
+def make_token(path):
+    # path（クエリを除く）に対してのみ有効なトークン
+    return _serializer().dumps({'path': path})
+
+def signed_url(url):
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    query = [(k, v) for k, v in query if k != QUERY_PARAM] + [(QUERY_PARAM, make_token(parts.path or '/'))]
+    return urllib.parse.urlunsplit(('', '', parts.path or '/', urllib.parse.urlencode(query), ''))
+
+def _token_matches(environ):
+    query = environ.get('QUERY_STRING', '')
+    # 通常のリクエストではクエリを解析しない
+    if QUERY_PARAM + '=' not in query:
+        return False
+    token = urllib.parse.parse_qs(query).get(QUERY_PARAM, [''])[0]
+    from itsdangerous import BadData
+    try:
+        payload = _serializer().loads(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except BadData:
+        return False
+    return payload.get('path') == environ.get('PATH_INFO', '')
+
+# --- ルート指定（次の N 回） ---
+
+def _armed_path():
+    return os.path.join(settings.PROFILE_DIR, ARMED_NAME)
+
+def armed_routes():
+    # [{'method', 'rule', 'remaining'}]
+    try:
+        with open(_armed_path(), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def _write_armed(routes):
+    path = _armed_path()
+    routes = [r for r in routes if r['remaining'] > 0]
+    if not routes:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(routes, f)
+    os.replace(tmp, path)
+
+def arm(method, rule, count):
+    with _lock:
+        routes = [r for r in armed_routes() if (r['method'], r['rule']) != (method, rule)]
+        routes.append({'method': method, 'rule': rule, 'remaining': int(count)})
+        _write_armed(routes)
+
+def disarm(method, rule):
+    with _lock:
+        _write_armed([r for r in armed_routes() if (r['method'], r['rule']) != (method, rule)])
+
+def _armed_router():
+    # 指定がなければ stat 1回で終わる（ファイルがない）
+    path = _armed_path()
+    try:
+        key = (path, os.stat(path).st_mtime_ns)
+    except OSError:
+        return None, []
+    if _armed_cache['key'] != key:
+        routes = armed_routes()
+        router = Router()
+        for index, route in enumerate(routes):
+            router.add(route['rule'], route['method'], index)
+        _armed_cache.update(key=key, routes=routes, router=router)
+    return _armed_cache['router'], _armed_cache['routes']
+
+def _take_armed(environ):
+    router, routes = _armed_router()
+    if router is None:
+        return False
+    try:
+        index, _ = router.match(environ)
+    except HTTPError:
+        # 一致するルートがない（404 / 405）
+        return False
+    key = (routes[index]['method'], routes[index]['rule'])
+    # 回数を減らす（複数プロセスで同時に取った場合は1回多く計測されることがある）
+    with _lock:
+        current = armed_routes()
+        for route in current:
+            if (route['method'], route['rule']) == key and route['remaining'] > 0:
+                route['remaining'] -= 1
+                _write_armed(current)
+                return True
+    return False
+
+# --- 計測 ---
+
+def start(environ):
+    # 計測対象なら cProfile.Profile を返す（対象外は None）
+    if not getattr(settings, 'PROFILE_CAPTURE_ENABLED', True):
+        return None
+    if not (_token_matches(environ) or _take_armed(environ)):
+        return None
+    return cProfile.Profile()
+
+def enable(profiler):
+    try:
+        profiler.enable()
+        return True
+    except ValueError:
+        # 別のスレッドで計測中（Python 3.12 以降は同時に1つしか有効にできない）
+        return False
+
+def _slug(text):
+    return re.sub(r'[^0-9A-Za-z]+', '-', text).strip('-')[:60] or 'root'
+
+def top_functions(stats, sort='cumulative', limit=20):
+    # [{'function', 'calls', 'tottime_ms', 'cumtime_ms'}]
+    stats.sort_stats(sort)
+    rows = []
+    for func in stats.fcn_list[:limit]:
+        cc, nc, tt, ct, _ = stats.stats[func]
+        filename, line, name = func
+        if filename == '~':
+            label = name
+        else:
+            label = f"{os.path.relpath(filename, ROOT) if filename.startswith(ROOT) else filename}:{line}({name})"
+        rows.append({'function': label, 'calls': nc, 'tottime_ms': round(tt * 1000, 3), 'cumtime_ms': round(ct * 1000, 3)})
+    return rows
+
+def save(profiler, route, method, path, status, total_ms):
+    directory = settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.datetime.now()
+    name = f"{now.strftime('%Y%m%d-%H%M%S-%f')}-{method}-{_slug(path)}"
+    profiler.dump_stats(os.path.join(directory, name + '.prof'))
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    summary = {
+        'name': name,
+        'time': now.isoformat(timespec='seconds'),
+        'route': route,
+        'method': method,
+        'path': path,
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'calls': stats.total_calls,
+        'top': top_functions(stats, 'cumulative', 10)
+    }
+    with open(os.path.join(directory, name + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False)
+    _prune(directory)
+    return name
+
+def _prune(directory):
+    # 古いものから PROFILE_KEEP 件を超えた分を削除する
+    names = sorted(n[:-5] for n in os.listdir(directory) if n.endswith('.prof') and _NAME_PATTERN.match(n[:-5]))
+    for name in names[:max(0, len(names) - settings.PROFILE_KEEP)]:
+        delete(name)
+
+def list_profiles():
+    # 新しい順の概要
+    directory = settings.PROFILE_DIR
+    try:
+        names = sorted((n for n in os.listdir(directory) if n.endswith('.json') and _NAME_PATTERN.match(n[:-5])), reverse=True)
+    except OSError:
+        return []
+    profiles = []
+    for filename in names:
+        try:
+            with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+def profile_path(name):
+    # 一覧にある名前のみ受け付ける（パスの指定は不可）
+    if not _NAME_PATTERN.match(name or ''):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, name + '.prof')
+    return path if os.path.isfile(path) else None
+
+def load_stats(name, sort='cumulative', limit=50):
+    path = profile_path(name)
+    if path is None:
+        return None
+    return top_functions(pstats.Stats(path, stream=io.StringIO()), sort, limit)
+
+def delete(name):
+    if not _NAME_PATTERN.match(name or ''):
+        return
+    for ext in ('.prof', '.json'):
+        try:
+            os.remove(os.path.join(settings.PROFILE_DIR, name + ext))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,271 @@
+import datetime
+import json
+import math
+import os
+import threading
+import time
+
+import metrics
+import perf
+import profile_capture
+import settings
+import workload
+from utils import rotate_file
+
+# リクエスト毎の処理時間の計測（WSGI ミドルウェア）
+# 全体の所要時間・SQL の実行回数と所要時間・テンプレートの描画時間・応答サイズを計測し、
+# SLOW_REQUEST_MS を超えたリクエストを実行した SQL 付きで遅いリクエストのログ（JSON Lines）に追記する。
+# ログは SLOW_LOG_MAX_BYTES を超えると .1, .2 ... に退避する（複数プロセスから追記しても行が混ざらないよう1回の write で書く）。
+# 管理画面の /admin/perf はこのログを画面（ルート）毎に集計して表示する。
+# 全リクエストの件数・所要時間は metrics.py にも記録する。
+# 管理画面で指定したリクエストは cProfile 付きで処理する（profile_capture.py）。
+# WORKLOAD_CAPTURE_ENABLED の場合は全リクエストの概要を記録する（workload.py）。
+
+_local = threading.local()
+_rotate_lock = threading.Lock()
+
+class RequestProfile(object):
+    __slots__ = ('method', 'path', 'start', 'template_time', 'log', 'status', 'bytes', 'profiler')
+
+    def __init__(self, environ):
+        self.method = environ.get('REQUEST_METHOD', 'GET')
+        self.path = environ.get('PATH_INFO', '')
+        self.start = time.perf_counter()
+        self.template_time = 0.0
+        self.log = None
+        self.status = None
+        self.bytes = 0
+        self.profiler = None
+
+def current():
+    # 処理中のリクエストの計測（計測していなければ None）
+    return getattr(_local, 'profile', None)
+
+def add_template_time(seconds):
+    profile = current()
+    if profile is not None:
+        profile.template_time += seconds
+
+def timed_iter(parts):
+    # ストリーミング描画の各チャンクの生成時間をテンプレート時間に加算する
+    profile = current()
+    if profile is None:
+        yield from parts
+        return
+    iterator = iter(parts)
+    while True:
+        start = time.perf_counter()
+        try:
+            part = next(iterator)
+        except StopIteration:
+            profile.template_time += time.perf_counter() - start
+            return
+        profile.template_time += time.perf_counter() - start
+        yield part
+
+def mount_prefixes(root):
+    # マウントしたアプリ -> URL の接頭辞（index.py の app.mount('/admin', admin_app) など）
+    prefixes = {}
+    for route in getattr(root, 'routes', []):
+        # bottle の設定は 'mountpoint.prefix' / 'mountpoint.target' に展開されて保存される
+        target = route.config.get('mountpoint.target')
+        if target is not None:
+            prefixes[id(target)] = route.config.get('mountpoint.prefix', '').rstrip('/')
+    return prefixes
+
+class ProfilingMiddleware(object):
+    def __init__(self, app, root=None, threshold_ms=None, log_path=None):
+        self.app = app
+        # ルート名の解決に使う Bottle アプリ（マウント先の接頭辞を付けるため）
+        self.prefixes = mount_prefixes(root) if root is not None else {}
+        self.threshold_ms = settings.SLOW_REQUEST_MS if threshold_ms is None else threshold_ms
+        self.log_path = settings.SLOW_LOG_PATH if log_path is None else log_path
+
+    def route_rule(self, environ):
+        # 処理したルートの URL パターン（/admin/requests/<id:int> など。集計の単位）
+        route = environ.get('bottle.route')
+        if route is None:
+            return '(unmatched)'
+        return self.prefixes.get(id(route.app), '') + route.rule
+
+    def route_name(self, environ):
+        return f"{environ.get('REQUEST_METHOD', 'GET')} {self.route_rule(environ)}"
+
+    def __call__(self, environ, start_response):
+        stale = current()
+        if stale is not None and stale.log is not None:
+            # close() されずに終わった前回のリクエストの記録を外す
+            perf.end(stale.log)
+        profile = _local.profile = RequestProfile(environ)
+        profile.log = perf.begin()
+        profiler = profile_capture.start(environ)
+        if profiler is not None and profile_capture.enable(profiler):
+            profile.profiler = profiler
+
+        def _start_response(status, headers, exc_info=None):
+            profile.status = status
+            return start_response(status, headers, exc_info)
+
+        try:
+            app_iter = self.app(environ, _start_response)
+        except BaseException:
+            self.finish(environ, profile)
+            raise
+        finally:
+            if profile.profiler is not None:
+                profile.profiler.disable()
+        return _ProfiledBody(self, environ, profile, app_iter)
+
+    def finish(self, environ, profile):
+        if current() is profile:
+            _local.profile = None
+        perf.end(profile.log)
+        elapsed = time.perf_counter() - profile.start
+        status = profile.status.split(' ', 1)[0] if profile.status else ''
+        metrics.observe_request(profile.method, self.route_rule(environ), status, elapsed,
+                                profile.log.count, profile.log.total_time)
+        total_ms = elapsed * 1000
+        if profile.profiler is not None:
+            profile.profiler.disable()
+            try:
+                profile_capture.save(profile.profiler, self.route_name(environ), profile.method, profile.path,
+                                     int(status) if status else None, total_ms)
+            except OSError:
+                pass
+        if settings.WORKLOAD_CAPTURE_ENABLED:
+            try:
+                workload.append(workload.build_entry(environ, self.route_rule(environ), int(status) if status else None,
+                                                     total_ms, profile.log.count))
+            except OSError:
+                pass
+        if total_ms < self.threshold_ms or not self.log_path:
+            return None
+        entry = build_entry(self.route_name(environ), profile, total_ms)
+        try:
+            append_entry(self.log_path, entry)
+        except OSError:
+            # ログが書けなくてもリクエストは失敗させない
+            pass
+        return entry
+
+class _ProfiledBody(object):
+    # 本文を送り終えた（close された）時点で計測を終える
+    def __init__(self, middleware, environ, profile, app_iter):
+        self.middleware = middleware
+        self.environ = environ
+        self.profile = profile
+        self.app_iter = app_iter
+        self.closed = False
+
+    def __iter__(self):
+        profiler = self.profile.profiler
+        if profiler is None:
+            for chunk in self.app_iter:
+                self.profile.bytes += len(chunk)
+                yield chunk
+            return
+        # ストリーミング描画は本文の取り出し時に行われるため、その間も計測する（送信中は止める）
+        iterator = iter(self.app_iter)
+        while True:
+            profiler.enable()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                profiler.disable()
+            self.profile.bytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.middleware.finish(self.environ, self.profile)
+
+def build_entry(route, profile, total_ms):
+    log = profile.log
+    statements = log.statements
+    limit = settings.SLOW_LOG_MAX_STATEMENTS
+    return {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'route': route,
+        'method': profile.method,
+        'path': profile.path,
+        'status': int(profile.status.split(' ', 1)[0]) if profile.status else None,
+        'total_ms': round(total_ms, 2),
+        'sql_ms': round(log.total_time * 1000, 2),
+        'queries': log.count,
+        'template_ms': round(profile.template_time * 1000, 2),
+        'bytes': profile.bytes,
+        # パラメータ（入力値）は記録しない
+        'sql': [{'sql': sql, 'ms': round(elapsed * 1000, 3)} for sql, _, elapsed, _ in statements[:limit]],
+        'sql_truncated': max(0, len(statements) - limit)
+    }
+
+def append_entry(path, entry):
+    line = (json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode('utf-8')
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with _rotate_lock:
+        try:
+            if os.path.getsize(path) + len(line) > settings.SLOW_LOG_MAX_BYTES:
+                rotate_file(path, settings.SLOW_LOG_BACKUPS)
+        except OSError:
+            pass
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+def read_entries(path=None):
+    # 遅いリクエストのログを古い順に読む（退避したファイルを含む）
+    path = path or settings.SLOW_LOG_PATH
+    paths = [f"{path}.{i}" for i in range(settings.SLOW_LOG_BACKUPS, 0, -1)] + [path]
+    entries = []
+    for p in paths:
+        try:
+            with open(p, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # 書き込み途中の行などは読み飛ばす
+                        continue
+        except OSError:
+            continue
+    return entries
+
+def _percentile(values, pct):
+    # 最近傍順位法
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+def summarize(entries):
+    # ルート毎の集計（合計時間の多い順）
+    routes = {}
+    for entry in entries:
+        routes.setdefault(entry.get('route'), []).append(entry)
+    rows = []
+    for route, items in routes.items():
+        totals = [e['total_ms'] for e in items]
+        rows.append({
+            'route': route,
+            'count': len(items),
+            'p50_ms': _percentile(totals, 50),
+            'p95_ms': _percentile(totals, 95),
+            'max_ms': max(totals),
+            'sum_ms': round(sum(totals), 2),
+            'avg_sql_ms': round(sum(e.get('sql_ms', 0) for e in items) / len(items), 2),
+            'avg_queries': round(sum(e.get('queries', 0) for e in items) / len(items), 1),
+            'avg_template_ms': round(sum(e.get('template_ms', 0) for e in items) / len(items), 2),
+            'last': items[-1]['time']
+        })
+    rows.sort(key=lambda r: r['sum_ms'], reverse=True)
+    return rows
@@ -0,0 +1,126 @@
+from collections import namedtuple
+
+from peewee import JOIN
+from models import Client, User, Site, MaintenanceLog, Notice, Request, RequestMessage, SharedFile
+
+# 一覧画面用の読み取り専用の行
+# Model インスタンス（変更追跡付き）を行毎に作らず、画面で使う列だけをタプルで取得して namedtuple にする。
+# 結合先の名前は ClientRef / SiteRef として入れ子にしているため、テンプレートからは
+# site.client.display_name / log.site.name のように従来どおり参照でき、行毎の追加クエリも発生しない。
+
+ClientRef = namedtuple('ClientRef', ['id', 'display_name'])
+SiteRef = namedtuple('SiteRef', ['id', 'name'])
+UserRef = namedtuple('UserRef', ['id', 'email'])
+FileRef = namedtuple('FileRef', ['id', 'title'])
+
+SiteRow = namedtuple('SiteRow', [
+    'id', 'name', 'url', 'contract_type', 'renewal_date', 'domain_expire_date', 'ssl_expire_date', 'client'
+])
+RequestRow = namedtuple('RequestRow', [
+    'id', 'subject', 'body', 'priority', 'status', 'updated_at', 'client', 'site'
+])
+LogRow = namedtuple('LogRow', [
+    'id', 'performed_at', 'category', 'summary', 'details', 'is_important', 'is_visible_to_client', 'site'
+])
+NoticeRow = namedtuple('NoticeRow', ['id', 'title', 'body', 'site'])
+MessageRow = namedtuple('MessageRow', ['id', 'author_role', 'body', 'created_at', 'author_user', 'shared_file'])
+
+class RowQuery(object):
+    # 行クエリの入れ物
+    # 通常の for / if では1回だけ実行して結果を保持し、StreamRows からはカーソルで1行ずつ読み出す
+    def __init__(self, query, factory):
+        self.query = query.tuples()
+        self.factory = factory
+        self._rows = None
+
+    def iterator(self):
+        factory = self.factory
+        # peewee のクエリはカーソルを保持するため、読み出し毎に複製して実行する
+        for row in self.query.clone().iterator():
+            yield factory(row)
+
+    def exists(self):
+        if self._rows is not None:
+            return bool(self._rows)
+        return self.query.exists()
+
+    def _load(self):
+        if self._rows is None:
+            self._rows = list(self.iterator())
+        return self._rows
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __bool__(self):
+        return bool(self._load())
+
+def _filtered(query, conditions, order_by, limit=None):
+    if conditions:
+        query = query.where(*conditions)
+    if order_by is not None:
+        query = query.order_by(*order_by) if isinstance(order_by, (list, tuple)) else query.order_by(order_by)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def _site_row(row):
+    return SiteRow(row[0], row[1], row[2], row[3], row[4], row[5], row[6], ClientRef(row[7], row[8]))
+
+def site_rows(*conditions, order_by=None):
+    query = (Site
+             .select(Site.id, Site.name, Site.url, Site.contract_type, Site.renewal_date,
+                     Site.domain_expire_date, Site.ssl_expire_date, Client.id, Client.display_name)
+             .join(Client))
+    return RowQuery(_filtered(query, conditions, order_by), _site_row)
+
+def _request_row(row):
+    site = SiteRef(row[8], row[9]) if row[8] is not None else None
+    return RequestRow(row[0], row[1], row[2], row[3], row[4], row[5], ClientRef(row[6], row[7]), site)
+
+def request_rows(*conditions, order_by=None):
+    # サイト未指定（全体）の依頼があるため、サイトは外部結合
+    query = (Request
+             .select(Request.id, Request.subject, Request.body, Request.priority, Request.status, Request.updated_at,
+                     Client.id, Client.display_name, Site.id, Site.name)
+             .join(Client)
+             .switch(Request)
+             .join(Site, JOIN.LEFT_OUTER))
+    return RowQuery(_filtered(query, conditions, order_by), _request_row)
+
+def _log_row(row):
+    return LogRow(row[0], row[1], row[2], row[3], row[4], row[5], row[6], SiteRef(row[7], row[8]))
+
+def log_rows(*conditions, order_by=None, limit=None):
+    query = (MaintenanceLog
+             .select(MaintenanceLog.id, MaintenanceLog.performed_at, MaintenanceLog.category, MaintenanceLog.summary,
+                     MaintenanceLog.details, MaintenanceLog.is_important, MaintenanceLog.is_visible_to_client,
+                     Site.id, Site.name)
+             .join(Site))
+    return RowQuery(_filtered(query, conditions, order_by, limit), _log_row)
+
+def _notice_row(row):
+    return NoticeRow(row[0], row[1], row[2], SiteRef(row[3], row[4]))
+
+def notice_rows(*conditions, order_by=None):
+    query = (Notice
+             .select(Notice.id, Notice.title, Notice.body, Site.id, Site.name)
+             .join(Site))
+    return RowQuery(_filtered(query, conditions, order_by), _notice_row)
+
+def _message_row(row):
+    shared_file = FileRef(row[6], row[7]) if row[6] is not None else None
+    return MessageRow(row[0], row[1], row[2], row[3], UserRef(row[4], row[5]), shared_file)
+
+def message_rows(request_id):
+    # 依頼のやりとり（投稿者と添付ファイルを同時に取得）
+    query = (RequestMessage
+             .select(RequestMessage.id, RequestMessage.author_role, RequestMessage.body, RequestMessage.created_at,
+                     User.id, User.email, SharedFile.id, SharedFile.title)
+             .join(User, on=(RequestMessage.author_user == User.id))
+             .switch(RequestMessage)
+             .join(SharedFile, JOIN.LEFT_OUTER, on=(RequestMessage.shared_file == SharedFile.id)))
+    return RowQuery(_filtered(query, (RequestMessage.request == request_id,), RequestMessage.created_at), _message_row)
@@ -1,35 +1,36 @@
-from bottle import Bottle, request, redirect, jinja2_view, response, abort
+from bottle import Bottle, request, redirect, response, abort
+from templating import jinja2_view, lazy, StreamRows
 import urllib.parse
-from models import Client, User, Site, MaintenanceLog, Notice, LogTemplate, DisplayLabel, AppSetting, Request, RequestMessage, SharedFile
+from models import Client, User, Site, MaintenanceLog, Notice, LogTemplate, DisplayLabel, AppSetting, Request, RequestMessage, SharedFile, ClientStorageUsage, global_data_version
 from auth import login_required, get_current_user, check_csrf_token, generate_csrf_token, hash_password
 from utils import get_alert_level, format_date, get_display_labels, get_app_settings, get_month_range, get_prev_next_month, generate_file_token, save_uploaded_file
 import datetime
 import os
 import uuid
 from settings import UPLOAD_DIR, MAX_UPLOAD_BYTES, ALLOWED_EXTENSIONS
+from storage_quota import set_file_deleted, recalculate_usage
+from read_models import site_rows, log_rows, notice_rows, request_rows, message_rows
 
 admin_app = Bottle()
 
 def get_common_context(active_page=None):
+    # 各値はテンプレートが参照したときに初めて計算される（印刷用レポートなど、使わない画面では計算しない）
     from bottle import request
     import settings
     return {
-        'current_user': get_current_user(),
+        'current_user': lazy(get_current_user),
         'active_page': active_page,
-        'csrf_token': generate_csrf_token(),
+        'csrf_token': lazy(generate_csrf_token),
         'get_alert_level': get_alert_level,
         'format_date': format_date,
-        'labels': get_display_labels(),
-        'app_settings': get_app_settings(),
-        'messages': get_flash(),
+        'labels': lazy(get_display_labels),
+        'app_settings': lazy(get_app_settings),
+        'messages': lazy(get_flash),
         'request': request,
         'read_only_mode': getattr(settings, 'READ_ONLY_MODE', False)
     }
 
-@admin_app.route('/')
-@login_required(role='admin')
-@jinja2_view('admin/dashboard.html')
-def admin_dashboard():
+def _dashboard_alerts():
     # 期限アラート一覧
     sites = Site.select().where(Site.is_active == True)
     alerts = []
@@ -62,12 +63,23 @@ def admin_dashboard():
     
     # 1. 警告(7日以内)を最優先, 2. 期限が近い順
     alerts.sort(key=lambda x: (x['priority'], x['days_to_expire']))
-    
-    # 直近の保守ログ
-    recent_logs = MaintenanceLog.select().order_by(MaintenanceLog.performed_at.desc()).limit(10)
+    return alerts
+
+@admin_app.route('/')
+@login_required(role='admin')
+@jinja2_view('admin/dashboard.html')
+def admin_dashboard():
+    # 各部品はテンプレート側の {% cache %} でキャッシュされ、ヒットした場合は
+    # 期限アラートの集計・直近ログのクエリとも実行されない
+    recent_logs = log_rows(order_by=MaintenanceLog.performed_at.desc(), limit=10)
     
     ctx = get_common_context('admin_dashboard')
-    ctx.update({'alerts': alerts, 'recent_logs': recent_logs})
+    ctx.update({
+        'load_alerts': _dashboard_alerts,
+        'recent_logs': recent_logs,
+        # アラートは日付で変わるため、データバージョンに日付を含める
+        'cache_version': (global_data_version(), datetime.date.today().isoformat())
+    })
     return ctx
 
 @admin_app.route('/clients')
@@ -172,12 +184,12 @@ def admin_client_user_new(id):
 def admin_sites():
     client_id = request.query.decode().get('client_id')
     q = request.query.decode().get('q', '').strip()
-    query = Site.select()
+    conditions = []
     if client_id:
-        query = query.where(Site.client == client_id)
+        conditions.append(Site.client == client_id)
     if q:
-        query = query.where(Site.name.contains(q))
-    sites = query.order_by(Site.id.desc())
+        conditions.append(Site.name.contains(q))
+    sites = site_rows(*conditions, order_by=Site.id.desc())
     clients = Client.select()
     ctx = get_common_context('admin_sites')
     ctx.update({'sites': sites, 'clients': clients, 'selected_client_id': client_id, 'q': q})
@@ -238,16 +250,17 @@ def admin_site_edit(id):
 
 @admin_app.route('/sites/<id:int>/logs')
 @login_required(role='admin')
-@jinja2_view('admin/site_logs.html')
+@jinja2_view('admin/site_logs.html', stream=True)
 def admin_site_logs(id):
     site = Site.get_by_id(id)
     q = request.query.decode().get('q', '').strip()
-    query = MaintenanceLog.select().where(MaintenanceLog.site == site)
+    conditions = [MaintenanceLog.site == site]
     if q:
-        query = query.where(MaintenanceLog.summary.contains(q))
-    logs = query.order_by(MaintenanceLog.performed_at.desc())
+        conditions.append(MaintenanceLog.summary.contains(q))
+    logs = log_rows(*conditions, order_by=MaintenanceLog.performed_at.desc())
     ctx = get_common_context('admin_sites')
-    ctx.update({'site': site, 'logs': logs, 'q': q})
+    # 件数が多くなるため、描画しながらカーソルから1行ずつ読み出す
+    ctx.update({'site': site, 'logs': StreamRows(logs), 'q': q})
     return ctx
 
 @admin_app.route('/sites/<id:int>/logs/new', method=['GET', 'POST'])
@@ -371,12 +384,13 @@ def admin_report_monthly(client_id):
     prev_month, next_month = get_prev_next_month(month)
     
     # ログ
-    logs = MaintenanceLog.select().join(Site).where(
+    logs = log_rows(
         (Site.client == client) &
         (MaintenanceLog.is_visible_to_client == True) &
         (MaintenanceLog.performed_at >= start_date) &
-        (MaintenanceLog.performed_at <= end_date)
-    ).order_by(MaintenanceLog.performed_at.desc())
+        (MaintenanceLog.performed_at <= end_date),
+        order_by=MaintenanceLog.performed_at.desc()
+    )
     
     # 重要対応 (最大5件)
     important_logs = [log for log in logs if log.is_important][:5]
@@ -388,17 +402,18 @@ def admin_report_monthly(client_id):
         category_counts[cat] = category_counts.get(cat, 0) + 1
     
     # 注意事項
-    notices = Notice.select().join(Site).where(
+    notices = notice_rows(
         (Site.client == client) &
         (Notice.is_visible_to_client == True) &
         (
             ((Notice.start_date.is_null()) | (Notice.start_date <= end_date)) &
             ((Notice.end_date.is_null()) | (Notice.end_date >= start_date))
-        )
-    ).order_by(Notice.created_at.desc())
+        ),
+        order_by=Notice.created_at.desc()
+    )
     
     # サイト情報（契約・期限）
-    sites = Site.select().where((Site.client == client) & (Site.is_active == True))
+    sites = site_rows((Site.client == client) & (Site.is_active == True))
     
     # アラート集計 (v1.5: 期限切れ間近の通知)
     alerts = []
@@ -574,8 +589,7 @@ def admin_file_edit(file_id):
 def admin_file_delete(file_id):
     check_csrf_token()
     f = SharedFile.get_by_id(file_id)
-    f.is_deleted = True
-    f.save()
+    set_file_deleted(f, True)
     set_flash("ファイルを非表示にしました。", "success")
     redirect(f'/admin/sites/{f.site.id}/files')
 
@@ -584,11 +598,174 @@ def admin_file_delete(file_id):
 def admin_file_restore(file_id):
     check_csrf_token()
     f = SharedFile.get_by_id(file_id)
-    f.is_deleted = False
-    f.save()
+    set_file_deleted(f, False)
     set_flash("ファイルを再表示しました。", "success")
     redirect(f'/admin/sites/{f.site.id}/files')
 
+# ファイル容量
+@admin_app.route('/storage', method=['GET', 'POST'])
+@login_required(role='admin')
+@jinja2_view('admin/storage.html')
+def admin_storage():
+    import settings
+    if request.method == 'POST':
+        check_csrf_token()
+        action = request.forms.decode().get('action')
+        if action == 'recalculate':
+            recalculate_usage()
+            set_flash("使用量を再集計しました。", "success")
+        elif action == 'update_quota':
+            forms = request.forms.decode()
+            quota_mb = (forms.get('quota_mb') or '').strip()
+            try:
+                client_id = int(forms.get('client_id'))
+                quota_bytes = int(float(quota_mb) * 1024 * 1024) if quota_mb else None
+            except (TypeError, ValueError, OverflowError):
+                client_id, quota_bytes = None, -1
+            if (quota_bytes is not None and quota_bytes < 0) or not Client.select().where(Client.id == client_id).exists():
+                set_flash("クライアントと容量上限（0 以上の MB）を指定してください。", "danger")
+                redirect('/admin/storage')
+            updated = (ClientStorageUsage
+                       .update(quota_bytes=quota_bytes)
+                       .where(ClientStorageUsage.client == client_id)
+                       .execute())
+            if not updated:
+                ClientStorageUsage.create(client=client_id, quota_bytes=quota_bytes)
+            set_flash("容量上限を更新しました。", "success")
+        redirect('/admin/storage')
+
+    # 集計済みの使用量テーブルを読むだけで、SharedFile の集計は行わない
+    usages = {u.client_id: u for u in ClientStorageUsage.select()}
+    rows = []
+    for client in Client.select().order_by(Client.id):
+        usage = usages.get(client.id)
+        used = usage.used_bytes if usage else 0
+        quota = usage.quota_bytes if usage and usage.quota_bytes is not None else settings.CLIENT_STORAGE_QUOTA_BYTES
+        rows.append({
+            'client': client,
+            'used_bytes': used,
+            'file_count': usage.file_count if usage else 0,
+            'quota_bytes': quota,
+            'custom_quota': bool(usage and usage.quota_bytes is not None),
+            'percent': min(100, round(used * 100 / quota, 1)) if quota else 100
+        })
+    rows.sort(key=lambda r: r['percent'], reverse=True)
+
+    ctx = get_common_context('admin_storage')
+    ctx.update({'rows': rows, 'default_quota_bytes': settings.CLIENT_STORAGE_QUOTA_BYTES})
+    return ctx
+
+# 遅いリクエスト（profiling.py が記録したログの集計）
+@admin_app.route('/perf')
+@login_required(role='admin')
+@jinja2_view('admin/perf.html')
+def admin_perf():
+    import settings
+    import profiling
+    entries = profiling.read_entries()
+    route = request.query.decode().get('route')
+    recent = [e for e in entries if not route or e.get('route') == route]
+    ctx = get_common_context('admin_perf')
+    ctx.update({
+        'summary': profiling.summarize(entries),
+        'recent': recent[::-1][:50],
+        'selected_route': route,
+        'entry_count': len(entries),
+        'profiling_enabled': settings.PROFILING_ENABLED,
+        'threshold_ms': settings.SLOW_REQUEST_MS
+    })
+    return ctx
+
+def _profile_route_choices():
+    # 計測対象に指定できるルート（"GET /admin/sites/<id:int>" など）
+    from routes_client import client_app
+    choices = []
+    for prefix, sub_app in (('/admin', admin_app), ('/client', client_app)):
+        for route in sub_app.routes:
+            methods = route.method if isinstance(route.method, (list, tuple)) else [route.method]
+            for method in methods:
+                choices.append((method, prefix + route.rule))
+    return sorted(set(choices), key=lambda c: (c[1], c[0]))
+
+# cProfile による計測（profile_capture.py）
+@admin_app.route('/profiles', method=['GET', 'POST'])
+@login_required(role='admin')
+@jinja2_view('admin/profiles.html')
+def admin_profiles():
+    import settings
+    import profile_capture
+    signed = None
+    if request.method == 'POST':
+        check_csrf_token()
+        forms = request.forms.decode()
+        action = forms.get('action')
+        if action == 'arm':
+            method, _, rule = (forms.get('route') or '').partition(' ')
+            try:
+                count = int(forms.get('count') or 1)
+            except ValueError:
+                count = 0
+            if (method, rule) not in _profile_route_choices() or not 1 <= count <= 100:
+                set_flash("ルートと回数（1〜100）を指定してください。", "danger")
+            else:
+                profile_capture.arm(method, rule, count)
+                set_flash(f"{method} {rule} の次の {count} 回を計測します。", "success")
+                redirect('/admin/profiles')
+        elif action == 'disarm':
+            method, _, rule = (forms.get('route') or '').partition(' ')
+            profile_capture.disarm(method, rule)
+            set_flash("計測の指定を解除しました。", "success")
+            redirect('/admin/profiles')
+        elif action == 'sign':
+            url = (forms.get('url') or '').strip()
+            parts = urllib.parse.urlsplit(url)
+            if not parts.path.startswith('/'):
+                set_flash("計測する URL は / から始まるパスで指定してください。", "danger")
+            else:
+                signed = profile_capture.signed_url(url)
+        elif action == 'delete':
+            profile_capture.delete(forms.get('name'))
+            set_flash("プロファイルを削除しました。", "success")
+            redirect('/admin/profiles')
+
+    ctx = get_common_context('admin_profiles')
+    ctx.update({
+        'profiles': profile_capture.list_profiles(),
+        'armed': profile_capture.armed_routes(),
+        'route_choices': _profile_route_choices(),
+        'signed_url': signed,
+        'capture_enabled': settings.PROFILE_CAPTURE_ENABLED,
+        'token_max_age': settings.PROFILE_TOKEN_MAX_AGE
+    })
+    return ctx
+
+@admin_app.route('/profiles/<name>')
+@login_required(role='admin')
+@jinja2_view('admin/profile_detail.html')
+def admin_profile_detail(name):
+    import profile_capture
+    sort = request.query.get('sort')
+    if sort not in ('cumulative', 'tottime'):
+        sort = 'cumulative'
+    rows = profile_capture.load_stats(name, sort)
+    if rows is None:
+        abort(404, "Profile not found")
+    summary = next((p for p in profile_capture.list_profiles() if p['name'] == name), {'name': name})
+    ctx = get_common_context('admin_profiles')
+    ctx.update({'profile': summary, 'rows': rows, 'sort': sort})
+    return ctx
+
+@admin_app.route('/profiles/<name>/download')
+@login_required(role='admin')
+def admin_profile_download(name):
+    from bottle import static_file
+    import profile_capture
+    path = profile_capture.profile_path(name)
+    if path is None:
+        abort(404, "Profile not found")
+    return static_file(os.path.basename(path), root=os.path.dirname(path),
+                       mimetype='application/octet-stream', download=name + '.prof')
+
 @admin_app.route('/sites/<id:int>/notices/new', method=['GET', 'POST'])
 @login_required(role='admin')
 @jinja2_view('admin/notice_form.html')
@@ -637,15 +814,15 @@ def admin_requests():
     client_id = request.query.decode().get('client_id')
     q = request.query.decode().get('q', '').strip()
     
-    query = Request.select()
+    conditions = []
     if status:
-        query = query.where(Request.status == status)
+        conditions.append(Request.status == status)
     if client_id:
-        query = query.where(Request.client == client_id)
+        conditions.append(Request.client == client_id)
     if q:
-        query = query.where((Request.subject.contains(q)) | (Request.body.contains(q)))
+        conditions.append((Request.subject.contains(q)) | (Request.body.contains(q)))
         
-    requests = query.order_by(Request.updated_at.desc())
+    requests = request_rows(*conditions, order_by=Request.updated_at.desc())
     clients = Client.select()
     
     ctx = get_common_context('admin_requests')
@@ -718,6 +895,7 @@ def admin_request_detail(id):
     ctx = get_common_context('admin_requests')
     ctx.update({
         'request': req, 
+        'request_messages': message_rows(req.id),
         'initial_files': initial_files,
         'generate_file_token': generate_file_token, 
         'SharedFile': SharedFile,
@@ -1,75 +1,93 @@
-from bottle import Bottle, request, redirect, jinja2_view, abort
-from models import Client, User, Site, MaintenanceLog, Notice, Request, RequestMessage, SharedFile
-from auth import login_required, get_current_user, generate_csrf_token, check_csrf_token
-from utils import get_alert_level, format_date, get_month_range, get_prev_next_month, get_display_labels, get_app_settings, generate_file_token, save_uploaded_file
+from bottle import Bottle, request, redirect, abort
+from templating import jinja2_view, lazy, StreamRows
+from models import db, Site, MaintenanceLog, Notice, Request, RequestMessage, SharedFile, client_data_version
+from auth import login_required, get_current_user, generate_csrf_token, check_csrf_token, check_client_access
+from utils import get_alert_level, format_date, get_month_range, get_prev_next_month, get_display_labels, get_app_settings, generate_file_token, save_uploaded_file, store_uploaded_file, create_shared_file_record, zip_bundle_response
+from storage_quota import check_request_quota, check_upload_quota
+from http_cache import check_client_page_not_modified
+from read_models import site_rows, log_rows, notice_rows, request_rows, message_rows
 import datetime
+import os
+import shutil
 
 client_app = Bottle()
 
 def get_common_context(active_page=None):
+    # 各値はテンプレートが参照したときに初めて計算される（印刷用レポートなど、使わない画面では計算しない）
     from bottle import request
     import settings
     return {
-        'current_user': get_current_user(),
+        'current_user': lazy(get_current_user),
         'active_page': active_page,
-        'csrf_token': generate_csrf_token(),
+        'csrf_token': lazy(generate_csrf_token),
         'get_alert_level': get_alert_level,
         'format_date': format_date,
-        'labels': get_display_labels(),
-        'app_settings': get_app_settings(),
+        'labels': lazy(get_display_labels),
+        'app_settings': lazy(get_app_settings),
         'request': request,
         'read_only_mode': getattr(settings, 'READ_ONLY_MODE', False)
     }
 
-def check_client_access(site_id=None, client_id=None):
-    user = get_current_user()
-    if not user or user.role != 'client':
-        abort(403)
-    if client_id and user.client.id != client_id:
-        abort(403)
-    if site_id:
-        site = Site.get_by_id(site_id)
-        if site.client.id != user.client.id:
-            abort(403)
-        return site
-    return None
+def _dashboard_alerts(client_id):
+    # アラート（自社サイトのみ）
+    sites = Site.select().where((Site.client == client_id) & (Site.is_active == True))
+    alerts = []
+    for site in sites:
+        domain_alert = get_alert_level(site.domain_expire_date)
+        ssl_alert = get_alert_level(site.ssl_expire_date)
+        if domain_alert in ['warning', 'danger'] or ssl_alert in ['warning', 'danger']:
+            alerts.append({'site': site, 'domain_alert': domain_alert, 'ssl_alert': ssl_alert})
+    return alerts
 
 @client_app.route('/')
 @login_required(role='client')
 @jinja2_view('client/dashboard.html')
 def client_dashboard():
     user = get_current_user()
+    # 前回表示から変化がなければ 304 を返す
+    check_client_page_not_modified(user)
     client = user.client
     
+    # 非表示に設定された部品のクエリは組み立てない
+    app_settings = get_app_settings()
+    show_cards = app_settings.get('show_top_cards')
+    today = datetime.date.today()
+
+    # 以下のクエリはテンプレート側の {% cache %} がヒットしなかった場合のみ実行される
     # 今月の対応内容
-    start_date, end_date = get_month_range()
-    logs = MaintenanceLog.select().join(Site).where(
-        (Site.client == client) &
-        (MaintenanceLog.is_visible_to_client == True) &
-        (MaintenanceLog.performed_at >= start_date) &
-        (MaintenanceLog.performed_at <= end_date)
-    ).order_by(MaintenanceLog.performed_at.desc())
+    logs = []
+    if show_cards and app_settings.get('show_maintenance_log'):
+        start_date, end_date = get_month_range()
+        logs = log_rows(
+            (Site.client == client) &
+            (MaintenanceLog.is_visible_to_client == True) &
+            (MaintenanceLog.performed_at >= start_date) &
+            (MaintenanceLog.performed_at <= end_date),
+            order_by=MaintenanceLog.performed_at.desc()
+        )
     
-    # アラート（自社サイトのみ）
-    sites = Site.select().where((Site.client == client) & (Site.is_active == True))
-    alerts = []
-    for site in sites:
-        domain_alert = get_alert_level(site.domain_expire_date)
-        ssl_alert = get_alert_level(site.ssl_expire_date)
-        if domain_alert in ['warning', 'danger'] or ssl_alert in ['warning', 'danger']:
-            alerts.append({'site': site, 'domain_alert': domain_alert, 'ssl_alert': ssl_alert})
-            
     # 直近の注意事項
-    today = datetime.date.today()
-    notices = Notice.select().join(Site).where(
-        (Site.client == client) &
-        (Notice.is_visible_to_client == True) &
-        ((Notice.start_date.is_null()) | (Notice.start_date <= today)) &
-        ((Notice.end_date.is_null()) | (Notice.end_date >= today))
-    ).order_by(Notice.created_at.desc())
+    notices = []
+    if show_cards and app_settings.get('show_notice'):
+        notices = notice_rows(
+            (Site.client == client) &
+            (Notice.is_visible_to_client == True) &
+            ((Notice.start_date.is_null()) | (Notice.start_date <= today)) &
+            ((Notice.end_date.is_null()) | (Notice.end_date >= today)),
+            order_by=Notice.created_at.desc()
+        )
 
     ctx = get_common_context('client_dashboard')
-    ctx.update({'logs': logs, 'alerts': alerts, 'notices': notices, 'client': client})
+    ctx.update({
+        'app_settings': app_settings,
+        'logs': logs,
+        'load_alerts': lambda: _dashboard_alerts(user.client_id),
+        'notices': notices,
+        'client': client,
+        'cache_scope': f"client:{user.client_id}",
+        # 今月の範囲・アラートは日付で変わるため、データバージョンに日付を含める
+        'cache_version': (client_data_version(user.client_id), today.isoformat())
+    })
     return ctx
 
 @client_app.route('/sites')
@@ -77,7 +95,7 @@ def client_dashboard():
 @jinja2_view('client/sites.html')
 def client_sites():
     user = get_current_user()
-    sites = Site.select().where(Site.client == user.client).order_by(Site.id.desc())
+    sites = site_rows(Site.client == user.client_id, order_by=Site.id.desc())
     ctx = get_common_context('client_sites')
     ctx.update({'sites': sites})
     return ctx
@@ -87,24 +105,31 @@ def client_sites():
 @jinja2_view('client/site_detail.html')
 def client_site_detail(id):
     site = check_client_access(site_id=id)
+    check_client_page_not_modified(get_current_user())
+    app_settings = get_app_settings()
     
-    today = datetime.date.today()
-    notices = Notice.select().where(
-        (Notice.site == site) &
-        (Notice.is_visible_to_client == True) &
-        ((Notice.start_date.is_null()) | (Notice.start_date <= today)) &
-        ((Notice.end_date.is_null()) | (Notice.end_date >= today))
-    ).order_by(Notice.created_at.desc())
+    notices = []
+    if app_settings.get('show_notice'):
+        today = datetime.date.today()
+        notices = Notice.select().where(
+            (Notice.site == site) &
+            (Notice.is_visible_to_client == True) &
+            ((Notice.start_date.is_null()) | (Notice.start_date <= today)) &
+            ((Notice.end_date.is_null()) | (Notice.end_date >= today))
+        ).order_by(Notice.created_at.desc())
     
     # 共有ファイル（最新5件）
-    files = SharedFile.select().where(
-        (SharedFile.site == site) &
-        (SharedFile.client_visible == True) &
-        (SharedFile.is_deleted == False)
-    ).order_by(SharedFile.id.desc()).limit(5)
+    files = []
+    if app_settings.get('show_files'):
+        files = SharedFile.select().where(
+            (SharedFile.site == site) &
+            (SharedFile.client_visible == True) &
+            (SharedFile.is_deleted == False)
+        ).order_by(SharedFile.id.desc()).limit(5)
     
     ctx = get_common_context('client_sites')
     ctx.update({
+        'app_settings': app_settings,
         'site': site, 
         'notices': notices, 
         'files': files,
@@ -135,6 +160,22 @@ def client_site_files(id):
     })
     return ctx
 
+@client_app.route('/sites/<id:int>/files/bundle')
+@login_required(role='client')
+def client_site_files_bundle(id):
+    app_settings = get_app_settings()
+    if not app_settings.get('show_files'):
+        abort(404, "This feature is disabled.")
+    site = check_client_access(site_id=id)
+
+    files = SharedFile.select().where(
+        (SharedFile.site == site) &
+        (SharedFile.client_visible == True) &
+        (SharedFile.is_deleted == False)
+    ).order_by(SharedFile.id)
+
+    return zip_bundle_response(files.iterator(), f'site-{site.id}-files.zip')
+
 @client_app.route('/sites/<id:int>/logs')
 @login_required(role='client')
 @jinja2_view('client/site_logs.html')
@@ -147,12 +188,13 @@ def client_site_logs(id):
     start_date, end_date = get_month_range(month)
     prev_month, next_month = get_prev_next_month(month)
     
-    logs = MaintenanceLog.select().where(
+    logs = log_rows(
         (MaintenanceLog.site == site) &
         (MaintenanceLog.is_visible_to_client == True) &
         (MaintenanceLog.performed_at >= start_date) &
-        (MaintenanceLog.performed_at <= end_date)
-    ).order_by(MaintenanceLog.performed_at.desc())
+        (MaintenanceLog.performed_at <= end_date),
+        order_by=MaintenanceLog.performed_at.desc()
+    )
     
     ctx = get_common_context('client_sites')
     ctx.update({
@@ -167,7 +209,7 @@ def client_site_logs(id):
 
 @client_app.route('/logs')
 @login_required(role='client')
-@jinja2_view('client/logs.html')
+@jinja2_view('client/logs.html', stream=True)
 def client_all_logs():
     app_settings = get_app_settings()
     if not app_settings.get('show_maintenance_log'):
@@ -177,16 +219,18 @@ def client_all_logs():
     start_date, end_date = get_month_range(month)
     prev_month, next_month = get_prev_next_month(month)
     
-    logs = MaintenanceLog.select().join(Site).where(
-        (Site.client == user.client) &
+    # 件数が多くなるため、描画しながらカーソルから1行ずつ読み出す（サイト名も同時に取得）
+    logs = log_rows(
+        (Site.client == user.client_id) &
         (MaintenanceLog.is_visible_to_client == True) &
         (MaintenanceLog.performed_at >= start_date) &
-        (MaintenanceLog.performed_at <= end_date)
-    ).order_by(MaintenanceLog.performed_at.desc())
+        (MaintenanceLog.performed_at <= end_date),
+        order_by=MaintenanceLog.performed_at.desc()
+    )
     
     ctx = get_common_context('client_logs')
     ctx.update({
-        'logs': logs, 
+        'logs': StreamRows(logs),
         'selected_month': month or datetime.date.today().strftime('%Y-%m'),
         'prev_month': prev_month,
         'next_month': next_month
@@ -203,6 +247,7 @@ def client_report_monthly():
         abort(404, "This feature is disabled.")
     
     user = get_current_user()
+    check_client_page_not_modified(user)
     client = user.client
     month = request.query.decode().get('month')
     is_print = request.url.endswith('/print')
@@ -210,50 +255,58 @@ def client_report_monthly():
     start_date, end_date = get_month_range(month)
     prev_month, next_month = get_prev_next_month(month)
     
-    # ログ
-    logs = MaintenanceLog.select().join(Site).where(
-        (Site.client == client) &
-        (MaintenanceLog.is_visible_to_client == True) &
-        (MaintenanceLog.performed_at >= start_date) &
-        (MaintenanceLog.performed_at <= end_date)
-    ).order_by(MaintenanceLog.performed_at.desc())
-    
-    # 重要対応 (最大5件)
-    important_logs = [log for log in logs if log.is_important][:5]
-    
-    # カテゴリ集計
+    # ログ（非表示の場合はクエリ・集計とも行わない）
+    logs = []
+    important_logs = []
     category_counts = {}
-    for log in logs:
-        cat = log.category or "その他"
-        category_counts[cat] = category_counts.get(cat, 0) + 1
-    
-    # 注意事項
-    # レポート期間内に有効なものを抽出
-    notices = Notice.select().join(Site).where(
-        (Site.client == client) &
-        (Notice.is_visible_to_client == True) &
-        (
-            ((Notice.start_date.is_null()) | (Notice.start_date <= end_date)) &
-            ((Notice.end_date.is_null()) | (Notice.end_date >= start_date))
+    if app_settings.get('show_maintenance_log'):
+        logs = log_rows(
+            (Site.client == client) &
+            (MaintenanceLog.is_visible_to_client == True) &
+            (MaintenanceLog.performed_at >= start_date) &
+            (MaintenanceLog.performed_at <= end_date),
+            order_by=MaintenanceLog.performed_at.desc()
         )
-    ).order_by(Notice.created_at.desc())
+        
+        # 重要対応 (最大5件)
+        important_logs = [log for log in logs if log.is_important][:5]
+        
+        # カテゴリ集計
+        for log in logs:
+            cat = log.category or "その他"
+            category_counts[cat] = category_counts.get(cat, 0) + 1
     
     # サイト情報（契約・期限）
-    sites = Site.select().where((Site.client == client) & (Site.is_active == True))
+    sites = site_rows((Site.client == client) & (Site.is_active == True))
     
-    # アラート集計 (v1.5: 期限切れ間近の通知)
+    # 注意事項とアラートは「注意事項」欄にのみ表示される
+    notices = []
     alerts = []
-    for site in sites:
-        d_alert = get_alert_level(site.domain_expire_date)
-        s_alert = get_alert_level(site.ssl_expire_date)
-        if d_alert in ['warning', 'danger']:
-            alerts.append({'site': site.name, 'type': 'ドメイン期限', 'date': site.domain_expire_date, 'level': d_alert})
-        if s_alert in ['warning', 'danger']:
-            alerts.append({'site': site.name, 'type': 'SSL証明書期限', 'date': site.ssl_expire_date, 'level': s_alert})
+    if app_settings.get('show_notice'):
+        # レポート期間内に有効なものを抽出
+        notices = notice_rows(
+            (Site.client == client) &
+            (Notice.is_visible_to_client == True) &
+            (
+                ((Notice.start_date.is_null()) | (Notice.start_date <= end_date)) &
+                ((Notice.end_date.is_null()) | (Notice.end_date >= start_date))
+            ),
+            order_by=Notice.created_at.desc()
+        )
+        
+        # アラート集計 (v1.5: 期限切れ間近の通知)
+        for site in sites:
+            d_alert = get_alert_level(site.domain_expire_date)
+            s_alert = get_alert_level(site.ssl_expire_date)
+            if d_alert in ['warning', 'danger']:
+                alerts.append({'site': site.name, 'type': 'ドメイン期限', 'date': site.domain_expire_date, 'level': d_alert})
+            if s_alert in ['warning', 'danger']:
+                alerts.append({'site': site.name, 'type': 'SSL証明書期限', 'date': site.ssl_expire_date, 'level': s_alert})
 
     base_path = '/client/reports/monthly'
     ctx = get_common_context('client_reports')
     ctx.update({
+        'app_settings': app_settings,
         'client': client,
         'logs': logs,
         'important_logs': important_logs,
@@ -280,7 +333,7 @@ def client_requests():
         abort(404, "This feature is disabled.")
     
     user = get_current_user()
-    requests = Request.select().where(Request.client == user.client).order_by(Request.updated_at.desc())
+    requests = request_rows(Request.client == user.client_id, order_by=Request.updated_at.desc())
     ctx = get_common_context('client_requests')
     ctx.update({'requests': requests})
     return ctx
@@ -294,9 +347,10 @@ def client_request_new():
         abort(404, "This feature is disabled.")
     
     user = get_current_user()
-    sites = Site.select().where((Site.client == user.client) & (Site.is_active == True))
+    sites = Site.select().where((Site.client == user.client_id) & (Site.is_active == True))
     
     if request.method == 'POST':
+        check_request_quota(user.client_id)
         check_csrf_token()
         site_id = request.forms.decode().get('site_id')
         subject = request.forms.decode().get('subject')
@@ -305,24 +359,38 @@ def client_request_new():
         
         site = None
         if site_id and site_id != 'all':
-            site = Site.get_by_id(site_id)
-            if site.client.id != user.client.id:
-                abort(403)
-        
-        new_request = Request.create(
-            client=user.client,
-            site=site,
-            subject=subject,
-            body=body,
-            priority=priority,
-            created_by=user,
-            status='new'
-        )
+            site = check_client_access(site_id=site_id)
         
-        # 添付ファイル
+        # 添付ファイル（保存できない場合は依頼も作成しない）
+        # 実ファイルの書き込み中にデータベースのロックを持たないよう、トランザクションの前に保存する
         upload = request.files.get('file')
+        stored = None
         if upload and upload.filename and upload.filename != 'empty':
-            save_uploaded_file(upload, user, request_obj=new_request)
+            check_upload_quota(user.client_id, upload)
+            stored, error = store_uploaded_file(upload, user, user.client_id)
+            if error:
+                abort(400, error)
+
+        try:
+            with db.atomic():
+                new_request = Request.create(
+                    client=user.client_id,
+                    site=site,
+                    subject=subject,
+                    body=body,
+                    priority=priority,
+                    created_by=user,
+                    status='new'
+                )
+                if stored:
+                    save_path, size = stored
+                    create_shared_file_record(save_path, upload.filename, size, user, request_obj=new_request,
+                                              content_type=upload.content_type)
+        except Exception:
+            # 記録できなかった実ファイルは残さない（残った場合も file_gc.py が孤立ファイルとして回収する）
+            if stored:
+                shutil.rmtree(os.path.dirname(stored[0]), ignore_errors=True)
+            raise
 
         redirect(f'/client/requests/{new_request.id}')
         
@@ -335,23 +403,21 @@ def client_request_new():
 @jinja2_view('client/requests_detail.html')
 def client_request_detail(id):
     user = get_current_user()
-    try:
-        req = Request.get_by_id(id)
-    except Request.DoesNotExist:
-        abort(404)
-        
-    if req.client.id != user.client.id:
-        abort(403)
+    req = check_client_access(request_id=id)
         
     if request.method == 'POST':
+        check_request_quota(user.client_id)
         check_csrf_token()
         body = request.forms.decode().get('body')
         if body:
             shared_file = None
             upload = request.files.get('file')
             if upload and upload.filename and upload.filename != 'empty':
-                # クライアントからの添付は常に可視
+                check_upload_quota(user.client_id, upload)
+                # クライアントからの添付は常に可視（保存できない場合は返信も作成しない）
                 shared_file, error = save_uploaded_file(upload, user, request_obj=req)
+                if error:
+                    abort(400, error)
 
             RequestMessage.create(
                 request=req,
@@ -370,13 +436,36 @@ def client_request_detail(id):
             RequestMessage.select(RequestMessage.shared_file).where(RequestMessage.shared_file.is_null(False))
         )
     )
+    attachment_count = SharedFile.select().where(
+        (SharedFile.request == req) &
+        (SharedFile.client_visible == True) &
+        (SharedFile.is_deleted == False)
+    ).count()
     
     ctx = get_common_context('client_requests')
     ctx.update({
         'request': req, 
+        'request_messages': message_rows(req.id),
         'initial_files': initial_files,
+        'attachment_count': attachment_count,
         'generate_file_token': generate_file_token, 
         'SharedFile': SharedFile, 
         'RequestMessage': RequestMessage
     })
     return ctx
+
+@client_app.route('/requests/<id:int>/files/bundle')
+@login_required(role='client')
+def client_request_files_bundle(id):
+    app_settings = get_app_settings()
+    if not app_settings.get('show_requests'):
+        abort(404, "This feature is disabled.")
+    req = check_client_access(request_id=id)
+
+    files = SharedFile.select().where(
+        (SharedFile.request == req) &
+        (SharedFile.client_visible == True) &
+        (SharedFile.is_deleted == False)
+    ).order_by(SharedFile.id)
+
+    return zip_bundle_response(files.iterator(), f'request-{req.id}-files.zip')
@@ -0,0 +1,150 @@
+import contextlib
+
+from bottle import Bottle, request, response, abort
+from models import Site, Request
+from auth import login_required, get_current_user, check_csrf_token, check_client_access
+from chunked_upload import (load_upload, locked_upload, upload_status, create_upload, append_chunk, finalize_upload,
+                            discard_upload)
+from utils import get_app_settings
+import settings
+
+# 分割アップロード API
+#   POST   /uploads                          開始（filename, size, site_id または request_id）
+#   GET    /uploads/<upload_id>              状態取得（中断後の再開位置の確認）
+#   PUT    /uploads/<upload_id>/chunks/<n>   n 番目のチャンクを送信（X-Chunk-SHA256 必須）
+#   POST   /uploads/<upload_id>/finalize     完了して SharedFile を作成
+#   DELETE /uploads/<upload_id>              中止
+# POST 以外のメソッドでは CSRF トークンを X-CSRF-Token ヘッダーで送る
+
+upload_app = Bottle()
+
+def _error(status, message, **extra):
+    response.status = status
+    result = {'status': 'error', 'message': message}
+    result.update(extra)
+    return result
+
+def _resolve_target(user, site_id=None, request_id=None):
+    # サイトへのアップロードは管理者のみ、依頼への添付は管理者か依頼元クライアント
+    if site_id:
+        if user.role != 'admin':
+            abort(403)
+        site = Site.get_or_none(Site.id == site_id)
+        if site is None:
+            abort(404)
+        return site, None
+    if request_id:
+        if user.role == 'admin':
+            req = Request.get_or_none(Request.id == request_id)
+            if req is None:
+                abort(404)
+        else:
+            if not get_app_settings().get('show_requests'):
+                abort(404, "This feature is disabled.")
+            req = check_client_access(request_id=request_id)
+        return None, req
+    abort(400, "site_id or request_id is required")
+
+def _check_own_upload(meta):
+    if meta is None:
+        abort(404, "Upload not found")
+    if meta['user_id'] != get_current_user().id:
+        abort(403)
+    return meta
+
+def _get_own_upload(upload_id):
+    return _check_own_upload(load_upload(upload_id))
+
+@contextlib.contextmanager
+def _locked_own_upload(upload_id):
+    # 追記・確定・中止はロックを取ってから読み直した meta で処理する（確定済みなら 404）
+    with locked_upload(upload_id) as meta:
+        yield _check_own_upload(meta)
+
+@upload_app.route('/', method='POST')
+@login_required()
+def upload_create():
+    check_csrf_token()
+    user = get_current_user()
+    params = request.json if request.json is not None else request.forms.decode()
+
+    def _int_or_none(value):
+        try:
+            return int(value) if value not in (None, '') else None
+        except (TypeError, ValueError):
+            abort(400, "Invalid number")
+
+    site_id = _int_or_none(params.get('site_id'))
+    request_id = _int_or_none(params.get('request_id'))
+    site, req = _resolve_target(user, site_id=site_id, request_id=request_id)
+
+    # クライアントからの添付は常に可視
+    client_visible = True
+    if user.role == 'admin' and 'client_visible' in params:
+        client_visible = str(params.get('client_visible')).lower() in ('1', 'true', 'on')
+
+    meta, error = create_upload(
+        user,
+        params.get('filename'),
+        _int_or_none(params.get('size')),
+        site_id=site.id if site else None,
+        request_id=req.id if req else None,
+        client_id=site.client_id if site else req.client_id,
+        sha256=params.get('sha256'),
+        title=params.get('title'),
+        description=params.get('description'),
+        category=params.get('category'),
+        content_type=params.get('content_type'),
+        client_visible=client_visible
+    )
+    if error:
+        return _error(400, error)
+    response.status = 201
+    return upload_status(meta)
+
+@upload_app.route('/<upload_id>', method='GET')
+@login_required()
+def upload_show(upload_id):
+    return upload_status(_get_own_upload(upload_id))
+
+@upload_app.route('/<upload_id>/chunks/<index:int>', method='PUT')
+@login_required()
+def upload_chunk(upload_id, index):
+    check_csrf_token()
+    _get_own_upload(upload_id)
+    length = request.content_length
+    if length < 0:
+        return _error(411, "Content-Length is required")
+    if length == 0:
+        return _error(400, "Empty chunk")
+    # 本文を読む前に上限を確認する
+    if length > settings.UPLOAD_CHUNK_BYTES:
+        return _error(413, f"Chunk too large (max {settings.UPLOAD_CHUNK_BYTES} bytes)")
+
+    with _locked_own_upload(upload_id) as meta:
+        if index > len(meta['chunks']):
+            return _error(409, "Unexpected chunk index", next_chunk=len(meta['chunks']))
+        meta, error = append_chunk(meta, index, request.body, length, request.get_header('X-Chunk-SHA256'))
+        if error:
+            return _error(400, error)
+        return upload_status(meta)
+
+@upload_app.route('/<upload_id>/finalize', method='POST')
+@login_required()
+def upload_finalize(upload_id):
+    check_csrf_token()
+    user = get_current_user()
+    with _locked_own_upload(upload_id) as meta:
+        site, req = _resolve_target(user, site_id=meta['site_id'], request_id=meta['request_id'])
+        shared_file, error = finalize_upload(meta, user, site=site, request_obj=req)
+        if error:
+            return _error(409, error, **upload_status(meta))
+    return {'status': 'OK', 'file_id': shared_file.id, 'size_bytes': shared_file.size_bytes}
+
+@upload_app.route('/<upload_id>', method='DELETE')
+@login_required()
+def upload_discard(upload_id):
+    check_csrf_token()
+    with _locked_own_upload(upload_id) as meta:
+        discard_upload(meta)
+    return {'status': 'OK'}
@@ -1,5 +1,5 @@
 from peewee import SqliteDatabase
-from models import init_db, Client, User, Site, MaintenanceLog, Notice, set_db, LogTemplate, Request, RequestMessage
+from models import init_db, Client, User, Site, MaintenanceLog, Notice, set_db, LogTemplate, Request, RequestMessage, bump_data_version, ALL_VERSION_SCOPE
 import settings
 from auth import hash_password
 import datetime
@@ -18,6 +18,8 @@ def seed_data():
     User.delete().execute()
     Client.delete().execute()
     LogTemplate.delete().execute()
+    # 一括削除は save() を通らないため、キャッシュ用のデータバージョンをまとめて上げる
+    bump_data_version(ALL_VERSION_SCOPE)
 
     # 管理者ユーザー
     admin_pw = hash_password("admin")
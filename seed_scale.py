@@ -0,0 +1,256 @@
+import argparse
+import datetime
+import hashlib
+import os
+import random
+import sqlite3
+import time
+
+from peewee import SqliteDatabase, chunked
+from models import (db, set_db, init_db, Client, User, Site, MaintenanceLog, Notice, Request, RequestMessage,
+                    SharedFile, ClientStorageUsage, bump_data_version, ALL_VERSION_SCOPE)
+from auth import hash_password
+
+# ベンチマーク用の大量データ生成（seed.py の拡大版）
+#   python seed_scale.py --db data/bench.db --clients 200 --sites 5 --logs 800 --requests 100 --messages 5 --files 20
+# 上記でおよそ 100 万行。クライアント数 × サイト数 × 各件数 で規模を決める。
+# - 同じ --seed と --base-date からは同じ内容のデータベースが作られる（ID も固定で採番する）
+# - 行は insert_many でまとめて書き込み、TRANSACTION_ROWS 行毎にコミットする
+# - パスワードのハッシュ計算（PBKDF2）は1回だけ行い、全ユーザーで共有する
+# - SharedFile は行のみで、実ファイルは作成しない
+# 既存の本番データベース（settings.DB_PATH）を上書きしないよう、出力先は新規ファイルのみとする
+
+TRANSACTION_ROWS = 50000
+# SQLite の1文あたりのパラメーター数の上限（SQLITE_MAX_VARIABLE_NUMBER。3.32 より前は 999）
+MAX_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+# (値, 重み)
+LOG_CATEGORIES = [('アップデート', 45), ('バックアップ確認', 20), ('セキュリティ', 10), ('不具合対応', 10),
+                  ('問い合わせ対応', 10), ('その他', 5)]
+CONTRACT_TYPES = [('月次保守', 60), ('月次保守(高負荷)', 15), ('スポット', 15), (None, 10)]
+REQUEST_STATUSES = [('done', 70), ('in_progress', 20), ('new', 10)]
+FILE_CATEGORIES = [('レポート', 40), ('見積書', 20), ('請求書', 20), (None, 20)]
+FILE_TYPES = [('pdf', 'application/pdf', 50), ('png', 'image/png', 25), ('xlsx', None, 15), ('zip', 'application/zip', 10)]
+
+def _weighted(rng, choices):
+    values = [c[0] for c in choices]
+    weights = [c[-1] for c in choices]
+    return lambda: rng.choices(values, weights)[0]
+
+def _recent_date(rng, base_date, days):
+    # 直近ほど件数が多くなる分布（三角分布の最頻値を基準日に置く）
+    return base_date - datetime.timedelta(days=int(rng.triangular(0, days, 0)))
+
+def _at(rng, date):
+    return datetime.datetime.combine(date, datetime.time(rng.randint(9, 19), rng.randint(0, 59), rng.randint(0, 59)))
+
+def _bulk_insert(model, fields, rows):
+    # パラメーター数の上限に収まる件数ずつ insert_many し、TRANSACTION_ROWS 行毎にコミットする。
+    # peewee は insert_many の SQL 組み立てに行数分の時間がかかるため、同じ件数の SQL は1回だけ組み立て、
+    # 以降は値（Field.db_value で変換）だけを差し替えて実行する
+    batch_size = max(1, MAX_VARIABLES // len(fields))
+    per_transaction = max(1, TRANSACTION_ROWS // batch_size)
+    converters = [field.db_value for field in fields]
+    statements = {}
+    total = 0
+    batches = chunked(rows, batch_size)
+    while True:
+        inserted = 0
+        with db.atomic():
+            for _ in range(per_transaction):
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                sql = statements.get(len(batch))
+                if sql is None:
+                    sql, params = model.insert_many(batch, fields=fields).sql()
+                    # 既定値を持つ列を fields から漏らすと peewee が値を補うため、列数がずれる
+                    if len(params) != len(batch) * len(fields):
+                        raise ValueError(f"{model.__name__}: fields must include every column with a default")
+                    statements[len(batch)] = sql
+                db.execute_sql(sql, [convert(value) for row in batch for convert, value in zip(converters, row)])
+                inserted += len(batch)
+        total += inserted
+        if inserted < batch_size * per_transaction:
+            return total
+
+def generate(path, clients=10, sites=3, logs=100, requests=10, messages=3, files=5, days=730,
+             seed=1, base_date=None, verbose=False):
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    rng = random.Random(seed)
+    base_date = base_date or datetime.date.today()
+    base_at = datetime.datetime.combine(base_date, datetime.time(0, 0))
+
+    # 生成専用の一時的なデータベースなので、ジャーナルと同期書き込みは省く
+    database = SqliteDatabase(path, pragmas={'journal_mode': 'off', 'synchronous': 0, 'cache_size': -64000})
+    set_db(database)
+    init_db()
+
+    # ソルトもシードから決めて、ハッシュ値まで再現できるようにする
+    salt = hashlib.sha256(f"seed_scale:{seed}".encode()).hexdigest()[:32]
+    admin_pw = hash_password('admin', salt)
+    client_pw = hash_password('client', salt)
+
+    category = _weighted(rng, LOG_CATEGORIES)
+    contract_type = _weighted(rng, CONTRACT_TYPES)
+    status = _weighted(rng, REQUEST_STATUSES)
+    file_category = _weighted(rng, FILE_CATEGORIES)
+    file_type = _weighted(rng, [(t, t[2]) for t in FILE_TYPES])
+
+    counts = {}
+    started = time.perf_counter()
+
+    def insert(model, fields, rows):
+        counts[model.__name__] = _bulk_insert(model, fields, rows)
+        if verbose:
+            print(f"{model.__name__:<20}{counts[model.__name__]:>10}  {time.perf_counter() - started:.1f}s")
+
+    # ID は 1 から順に採番したものとして参照する
+    # ユーザー: 1 = 管理者, 1 + n = クライアント n の担当者
+    admin_id = 1
+    def client_user_id(client_id):
+        return 1 + client_id
+    def site_id(client_id, index):
+        return (client_id - 1) * sites + index + 1
+    def request_id(client_id, index):
+        return (client_id - 1) * requests + index + 1
+
+    insert(Client, [Client.id, Client.name, Client.display_name, Client.is_active, Client.created_at, Client.updated_at],
+           ((c, f"client-{c:05d}", f"クライアント{c:05d}", rng.random() > 0.05,
+             base_at - datetime.timedelta(days=days), base_at)
+            for c in range(1, clients + 1)))
+
+    users = [(admin_id, 'admin@example.com', admin_pw, 'admin', None, True, base_at - datetime.timedelta(days=days))]
+    users += [(client_user_id(c), f"client{c:05d}@example.com", client_pw, 'client', c, True,
+               base_at - datetime.timedelta(days=days)) for c in range(1, clients + 1)]
+    insert(User, [User.id, User.email, User.password_hash, User.role, User.client, User.is_active, User.created_at], users)
+
+    def site_rows():
+        for c in range(1, clients + 1):
+            for i in range(sites):
+                start = base_date - datetime.timedelta(days=rng.randint(30, days))
+                # 期限は一部が期限切れ・期限間近になるように散らす
+                yield (site_id(c, i), c, f"サイト{c:05d}-{i + 1}", f"https://site{c:05d}-{i + 1}.example.com",
+                       contract_type(), start, base_date + datetime.timedelta(days=rng.randint(-10, 365)),
+                       base_date + datetime.timedelta(days=rng.randint(-5, 400)),
+                       base_date + datetime.timedelta(days=rng.randint(-5, 90)),
+                       rng.random() > 0.03, _at(rng, start), base_at)
+    insert(Site, [Site.id, Site.client, Site.name, Site.url, Site.contract_type, Site.contract_start_date,
+                  Site.renewal_date, Site.domain_expire_date, Site.ssl_expire_date, Site.is_active,
+                  Site.created_at, Site.updated_at], site_rows())
+
+    def log_rows():
+        for s in range(1, clients * sites + 1):
+            for i in range(logs):
+                performed = _recent_date(rng, base_date, days)
+                cat = category()
+                performed_at = _at(rng, performed)
+                yield (s, performed, cat, f"{cat} #{i + 1}", f"{cat}を実施しました。\n確認済み。" if rng.random() < 0.7 else None,
+                       rng.random() < 0.85, rng.random() < 0.05, admin_id, performed_at, performed_at)
+    insert(MaintenanceLog, [MaintenanceLog.site, MaintenanceLog.performed_at, MaintenanceLog.category,
+                            MaintenanceLog.summary, MaintenanceLog.details, MaintenanceLog.is_visible_to_client,
+                            MaintenanceLog.is_important, MaintenanceLog.created_by, MaintenanceLog.created_at,
+                            MaintenanceLog.updated_at], log_rows())
+
+    def notice_rows():
+        for s in range(1, clients * sites + 1):
+            for i in range(rng.randint(0, 3)):
+                start = _recent_date(rng, base_date, days)
+                end = start + datetime.timedelta(days=rng.randint(7, 60)) if rng.random() < 0.6 else None
+                yield (s, f"お知らせ {i + 1}", "作業予定のお知らせです。", start, end, rng.random() < 0.9,
+                       _at(rng, start), _at(rng, start))
+    insert(Notice, [Notice.site, Notice.title, Notice.body, Notice.start_date, Notice.end_date,
+                    Notice.is_visible_to_client, Notice.created_at, Notice.updated_at], notice_rows())
+
+    # 依頼の作成日時は依頼メッセージでも使うため、ID 順に保持する
+    request_created = []
+    def request_rows():
+        for c in range(1, clients + 1):
+            for i in range(requests):
+                created = _at(rng, _recent_date(rng, base_date, days))
+                request_created.append(created)
+                site = site_id(c, rng.randrange(sites)) if sites and rng.random() < 0.8 else None
+                yield (request_id(c, i), c, site, f"依頼 {c:05d}-{i + 1}", "対応をお願いします。",
+                       'high' if rng.random() < 0.15 else 'normal', status(), client_user_id(c),
+                       created, created + datetime.timedelta(hours=rng.randint(0, 24 * 14)))
+    insert(Request, [Request.id, Request.client, Request.site, Request.subject, Request.body, Request.priority,
+                     Request.status, Request.created_by, Request.created_at, Request.updated_at], request_rows())
+
+    def message_rows():
+        for c in range(1, clients + 1):
+            for i in range(requests):
+                r = request_id(c, i)
+                at = request_created[r - 1]
+                for m in range(messages):
+                    at += datetime.timedelta(minutes=rng.randint(10, 60 * 48))
+                    # クライアントと管理者が交互にやり取りする
+                    if m % 2 == 0:
+                        yield (r, client_user_id(c), 'client', f"追加の連絡です（{m + 1}）", at)
+                    else:
+                        yield (r, admin_id, 'admin', f"確認しました（{m + 1}）", at)
+    insert(RequestMessage, [RequestMessage.request, RequestMessage.author_user, RequestMessage.author_role,
+                            RequestMessage.body, RequestMessage.created_at], message_rows())
+
+    usage = {}
+    def file_rows():
+        n = 0
+        for c in range(1, clients + 1):
+            for i in range(sites * files):
+                n += 1
+                ext, content_type, _ = file_type()
+                size = min(int(rng.lognormvariate(11, 1.5)), 50 * 1024 * 1024)
+                deleted = rng.random() < 0.03
+                # サイトの資料と依頼の添付を 3:1 程度で混ぜる
+                if requests and rng.random() < 0.25:
+                    site, req = None, request_id(c, rng.randrange(requests))
+                else:
+                    site, req = site_id(c, i % sites), None
+                if not deleted:
+                    used = usage.setdefault(c, [0, 0])
+                    used[0] += size
+                    used[1] += 1
+                created = _at(rng, _recent_date(rng, base_date, days))
+                name = f"file{n:07d}.{ext}"
+                yield (site, req, admin_id, name, file_category(), name, f"seed-{n:07d}/{name}", size, content_type,
+                       rng.random() < 0.9, deleted, created, created)
+    insert(SharedFile, [SharedFile.site, SharedFile.request, SharedFile.uploaded_by, SharedFile.title,
+                        SharedFile.category, SharedFile.original_filename, SharedFile.stored_path,
+                        SharedFile.size_bytes, SharedFile.content_type, SharedFile.client_visible,
+                        SharedFile.is_deleted, SharedFile.created_at, SharedFile.updated_at], file_rows())
+
+    insert(ClientStorageUsage, [ClientStorageUsage.client, ClientStorageUsage.used_bytes, ClientStorageUsage.file_count,
+                                ClientStorageUsage.updated_at],
+           ((c, used[0], used[1], base_at) for c, used in sorted(usage.items())))
+
+    # 一括挿入は save() を通らないため、キャッシュ用のデータバージョンをまとめて上げる
+    bump_data_version(ALL_VERSION_SCOPE)
+    database.execute_sql('ANALYZE')
+    database.close()
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ベンチマーク用の大量データを生成します')
+    parser.add_argument('--db', default=os.path.join('data', 'bench.db'), help='出力先（新規ファイル）')
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--sites', type=int, default=3, help='クライアント毎のサイト数')
+    parser.add_argument('--logs', type=int, default=100, help='サイト毎の保守ログ数')
+    parser.add_argument('--requests', type=int, default=10, help='クライアント毎の依頼数')
+    parser.add_argument('--messages', type=int, default=3, help='依頼毎のメッセージ数')
+    parser.add_argument('--files', type=int, default=5, help='サイト毎のファイル数')
+    parser.add_argument('--days', type=int, default=730, help='データの期間（基準日から遡る日数）')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--base-date', type=datetime.date.fromisoformat, default=None,
+                        help='基準日 YYYY-MM-DD（省略時は今日）')
+    parser.add_argument('--force', action='store_true', help='出力先が既にあれば削除してから作成する')
+    args = parser.parse_args()
+
+    if args.force and os.path.exists(args.db):
+        os.remove(args.db)
+    started = time.perf_counter()
+    counts = generate(args.db, args.clients, args.sites, args.logs, args.requests, args.messages, args.files,
+                      args.days, args.seed, args.base_date, verbose=True)
+    print(f"total rows: {sum(counts.values())}  ({time.perf_counter() - started:.1f}s)")
@@ -12,6 +12,70 @@ if os.path.exists('dev.flag'):
 else:
     IS_CGI = True
 
+# テンプレート設定
+# コンパイル済みテンプレートのキャッシュ先（None で無効）
+TEMPLATE_CACHE_DIR = os.path.join('data', 'template_cache')
+# テンプレート変更の自動検知（本番（CGI）では無効にしてファイルの更新確認を省く）
+TEMPLATE_AUTO_RELOAD = not IS_CGI
+# 事前コンパイル済みテンプレート（python build_templates.py で生成。デプロイ毎に再生成すること）
+PRECOMPILED_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compiled_templates')
+USE_PRECOMPILED_TEMPLATES = IS_CGI
+# 長い一覧画面（保守ログ一覧）を描画しながら送信する
+# 前段のプロキシ等が応答をすべてバッファする環境では効果がないため False にしてよい
+TEMPLATE_STREAMING = True
+TEMPLATE_STREAM_FIRST_CHUNK_BYTES = 1024  # 最初のチャンク（head 部分）はこのサイズで送る
+TEMPLATE_STREAM_CHUNK_BYTES = 16 * 1024
+# True にするとテンプレート毎に実際に参照されたコンテキストのキーを記録し、終了時に標準エラーへ出力する
+TEMPLATE_CONTEXT_STATS = False
+
+# ダッシュボード部品のキャッシュ（fragment_cache.py）
+FRAGMENT_CACHE_ENABLED = True
+FRAGMENT_CACHE_TTL = 10 * 60  # 秒
+FRAGMENT_CACHE_MAX_ENTRIES = 256  # プロセス内に保持する件数
+FRAGMENT_CACHE_DB = os.path.join('data', 'fragment_cache.db')  # 複数プロセスで共有する場合（None で無効）
+
+# レスポンス圧縮設定（text/html, application/json, text/csv）
+COMPRESSION_ENABLED = True
+COMPRESSION_LEVEL = 6  # 1（高速）〜 9（高圧縮）
+COMPRESSION_MIN_BYTES = 1024  # これより小さい本文は圧縮しない
+COMPRESSION_EXCLUDE_PREFIXES = ('/files/',)
+
+# リクエスト毎の処理時間の計測（profiling.py）
+PROFILING_ENABLED = True
+SLOW_REQUEST_MS = 500  # これ以上かかったリクエストを遅いリクエストのログに記録する
+SLOW_LOG_PATH = os.path.join('data', 'slow_requests.log')
+SLOW_LOG_MAX_BYTES = 5 * 1024 * 1024  # 超えたら .1, .2 ... に退避する
+SLOW_LOG_BACKUPS = 3
+SLOW_LOG_MAX_STATEMENTS = 100  # 1リクエスト分として記録する SQL の上限
+
+# アプリケーションのログ（applog.py。別スレッドでまとめて LOG_PATH に書き込む）
+# 'DEBUG' にするとセッション・CSRF・ログインの詳細を記録する。'OFF' で無効
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING')
+LOG_PATH = os.path.join('data', 'app.log')
+LOG_BATCH_SIZE = 200  # 1回の書き込みでまとめる最大件数
+LOG_FLUSH_SECONDS = 1.0  # ログを出してから書き込むまでの最大待ち時間
+LOG_MAX_BYTES = 5 * 1024 * 1024  # 超えたら .1, .2 ... に退避する
+LOG_BACKUPS = 3
+
+# 個別リクエストの cProfile 計測（profile_capture.py。管理画面「プロファイル」から指定する）
+PROFILE_CAPTURE_ENABLED = True
+PROFILE_DIR = os.path.join('data', 'profiles')
+PROFILE_KEEP = 50  # 保存する件数（古いものから削除）
+PROFILE_TOKEN_MAX_AGE = 60 * 60  # 署名付き URL の有効期限（秒）
+PROFILE_TOKEN_SALT = os.environ.get('PROFILE_TOKEN_SALT', 'maintainview-profile-salt')
+
+# 実際のアクセスの記録（workload.py。bench/replay.py で再現して変更前後を比較する）
+# 入力値そのものは記録しないが、記録中はファイルが増え続けるため必要な期間だけ有効にすること
+WORKLOAD_CAPTURE_ENABLED = os.environ.get('WORKLOAD_CAPTURE') == '1'
+WORKLOAD_CAPTURE_PATH = os.path.join('data', 'workload.jsonl')
+
+# 稼働状況の集計（metrics.py。/metrics から Prometheus 形式で出力）
+METRICS_ENABLED = True
+METRICS_DB = os.path.join('data', 'metrics.db')  # 複数プロセスの値を集計する共有ファイル（None でプロセス内のみ）
+METRICS_FLUSH_SECONDS = 5  # 共有ファイルへの書き込み間隔（CGI ではプロセス終了時にも書き込む）
+# /metrics の取得に必要なトークン（Authorization: Bearer ...）。未設定の場合はローカルホストからのみ取得可能
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 # デモ用読み取り専用モード (True: 書き込み禁止, False: 通常)
 READ_ONLY_MODE = False
 
@@ -61,3 +125,23 @@ UPLOAD_DIR = os.path.join('data', 'uploads')
 MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10MB
 ALLOWED_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.gif', '.txt', '.csv', '.xlsx'}
 FILE_TOKEN_SALT = os.environ.get('FILE_TOKEN_SALT', 'maintainview-file-salt')
+
+# 分割アップロード（再開可能）設定
+UPLOAD_STAGING_DIR = os.path.join('data', 'upload_staging')
+CHUNKED_UPLOAD_MAX_BYTES = 200 * 1024 * 1024  # 200MB
+UPLOAD_CHUNK_BYTES = 4 * 1024 * 1024  # 1チャンクの上限 4MB
+UPLOAD_STAGING_EXPIRE_SECONDS = 24 * 60 * 60  # 最終受信から24時間で破棄
+
+# ファイル回収（python file_gc.py）設定
+FILE_GC_RETENTION_DAYS = 30  # 論理削除から実ファイル削除までの保持日数
+FILE_GC_ORPHAN_GRACE_SECONDS = 60 * 60  # アップロード途中を誤って消さないための猶予
+
+# クライアント毎のファイル容量上限（管理画面からクライアント単位で変更可能）
+CLIENT_STORAGE_QUOTA_BYTES = 500 * 1024 * 1024  # 500MB
+# 本文を読む前の容量チェックで、フォーム項目分として許容する余裕
+QUOTA_FORM_OVERHEAD_BYTES = 64 * 1024
+
+# 一括ダウンロード（ZIP）設定
+# 既に圧縮済みの形式は再圧縮せず無圧縮(STORED)で格納してCPUを節約する
+ZIP_STORED_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.gif', '.xlsx', '.zip'}
+ZIP_CHUNK_BYTES = 64 * 1024
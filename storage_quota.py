@@ -0,0 +1,125 @@
+import datetime
+
+import settings
+from models import db, Client, Site, Request, SharedFile, ClientStorageUsage
+
+# クライアント毎のファイル使用量
+# 使用量は SharedFile の作成・論理削除・復元と同じトランザクション内で差分更新する。
+# 論理削除されたファイルは使用量に含めない（実ファイルは file_gc.py で回収される）。
+
+def file_client_id(site=None, request_obj=None):
+    if site is not None:
+        return site.client_id
+    if request_obj is not None:
+        return request_obj.client_id
+    return None
+
+def shared_file_client_id(f):
+    if f.site_id:
+        return Site.select(Site.client).where(Site.id == f.site_id).scalar()
+    if f.request_id:
+        return Request.select(Request.client).where(Request.id == f.request_id).scalar()
+    return None
+
+def adjust_usage(client_id, delta_bytes, delta_files):
+    if not client_id:
+        return
+    (ClientStorageUsage
+     .insert(client=client_id, used_bytes=max(delta_bytes, 0), file_count=max(delta_files, 0),
+             updated_at=datetime.datetime.now())
+     .on_conflict(
+         conflict_target=[ClientStorageUsage.client],
+         update={
+             ClientStorageUsage.used_bytes: ClientStorageUsage.used_bytes + delta_bytes,
+             ClientStorageUsage.file_count: ClientStorageUsage.file_count + delta_files,
+             ClientStorageUsage.updated_at: datetime.datetime.now()
+         })
+     .execute())
+
+def get_usage(client_id):
+    # (使用量, 上限) を返す
+    row = (ClientStorageUsage
+           .select(ClientStorageUsage.used_bytes, ClientStorageUsage.quota_bytes)
+           .where(ClientStorageUsage.client == client_id)
+           .tuples()
+           .first())
+    if row is None:
+        return 0, settings.CLIENT_STORAGE_QUOTA_BYTES
+    used, quota = row
+    return used, quota if quota is not None else settings.CLIENT_STORAGE_QUOTA_BYTES
+
+def check_quota(client_id, incoming_bytes):
+    if not client_id:
+        return None
+    used, quota = get_usage(client_id)
+    if used + incoming_bytes > quota:
+        return f"ファイル容量の上限を超えています (使用中 {used/1024/1024:.1f}MB / 上限 {quota/1024/1024:.1f}MB)"
+    return None
+
+def check_request_quota(client_id):
+    # リクエスト本文を読む前に Content-Length で判定する（フォーム項目分の余裕を見込む）
+    from bottle import request, abort
+    length = request.content_length
+    if length <= settings.QUOTA_FORM_OVERHEAD_BYTES:
+        return
+    error = check_quota(client_id, length - settings.QUOTA_FORM_OVERHEAD_BYTES)
+    if error:
+        abort(413, error)
+
+def check_upload_quota(client_id, upload):
+    # 添付が余裕分に収まる小さなファイルでも、残り容量を超える場合は記録の作成前に拒否する
+    from bottle import abort
+    upload.file.seek(0, 2)
+    size = upload.file.tell()
+    upload.file.seek(0)
+    error = check_quota(client_id, size)
+    if error:
+        abort(413, error)
+
+def set_file_deleted(f, is_deleted):
+    # 論理削除・復元を使用量の更新と同時に行う
+    with db.atomic():
+        changed = f.is_deleted != is_deleted
+        f.is_deleted = is_deleted
+        f.save()
+        if changed:
+            sign = -1 if is_deleted else 1
+            adjust_usage(shared_file_client_id(f), sign * f.size_bytes, sign)
+
+def recalculate_usage():
+    # 既存データからの全件再集計（導入時や不整合の修正用。通常の画面表示では使わない）
+    from peewee import fn, JOIN
+    totals = {}
+    query = (SharedFile
+             .select(fn.COALESCE(Site.client, Request.client).alias('client_id'),
+                     fn.SUM(SharedFile.size_bytes), fn.COUNT(SharedFile.id))
+             .join(Site, JOIN.LEFT_OUTER, on=(SharedFile.site == Site.id))
+             .switch(SharedFile)
+             .join(Request, JOIN.LEFT_OUTER, on=(SharedFile.request == Request.id))
+             .where(SharedFile.is_deleted == False)
+             .group_by(fn.COALESCE(Site.client, Request.client))
+             .tuples())
+    for client_id, total, count in query:
+        if client_id:
+            totals[client_id] = (total or 0, count)
+
+    with db.atomic():
+        for (client_id,) in Client.select(Client.id).tuples():
+            used, count = totals.get(client_id, (0, 0))
+            (ClientStorageUsage
+             .insert(client=client_id, used_bytes=used, file_count=count, updated_at=datetime.datetime.now())
+             .on_conflict(
+                 conflict_target=[ClientStorageUsage.client],
+                 update={
+                     ClientStorageUsage.used_bytes: used,
+                     ClientStorageUsage.file_count: count,
+                     ClientStorageUsage.updated_at: datetime.datetime.now()
+                 })
+             .execute())
+    return len(totals)
+
+if __name__ == '__main__':
+    from peewee import SqliteDatabase
+    from models import set_db
+    set_db(SqliteDatabase(settings.DB_PATH))
+    print(f"recalculated: {recalculate_usage()} clients")
@@ -0,0 +1,260 @@
+import atexit
+import compileall
+import functools
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, ModuleLoader, ChoiceLoader
+from jinja2.runtime import Context
+
+import metrics
+import profiling
+import settings
+
+# Jinja2 の Environment をアプリ全体で1つだけ持つ。
+# bottle の jinja2_view はテンプレート毎に Environment を作り、コンパイル結果もプロセス内にしか残らないため、
+# CGI では毎回 layout.html とページテンプレートを構文解析・コンパイルし直していた。
+# ここではコンパイル済みバイトコードを TEMPLATE_CACHE_DIR に保存し、次のプロセスから再利用する。
+# さらにデプロイ時に build_templates.py で全テンプレートをモジュール化しておけば、本番ではインポートのみで済む。
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+# {% cache %} タグ（fragment_cache.py）
+EXTENSIONS = ['fragment_cache.FragmentCacheExtension']
+
+class MtimeBytecodeCache(FileSystemBytecodeCache):
+    # キャッシュキーにテンプレートの更新時刻を含め、編集されたテンプレートは別エントリとして扱う
+    # （Jinja2 側でもソースのチェックサムで照合されるため、古いバイトコードが使われることはない）
+    def get_cache_key(self, name, filename=None):
+        key = name
+        if filename:
+            try:
+                key = f"{name}|{filename}|{os.path.getmtime(filename)}"
+            except OSError:
+                key = f"{name}|{filename}"
+        return super(MtimeBytecodeCache, self).get_cache_key(key)
+
+    def load_bytecode(self, bucket):
+        # プロセス内の Environment にないテンプレートを読み込む度に呼ばれる（ヒット率の集計用）
+        super(MtimeBytecodeCache, self).load_bytecode(bucket)
+        metrics.cache_event('template', bucket.code is not None)
+
+class LazyValue(object):
+    # テンプレートが最初に参照した時点で計算される値（共通コンテキスト用）
+    __slots__ = ('func', 'resolved', 'value')
+
+    def __init__(self, func):
+        self.func = func
+        self.resolved = False
+        self.value = None
+
+    def resolve(self):
+        if not self.resolved:
+            self.value = self.func()
+            self.resolved = True
+        return self.value
+
+def lazy(func):
+    return LazyValue(func)
+
+# テンプレート毎のコンテキスト参照状況（TEMPLATE_CONTEXT_STATS = True の場合のみ記録）
+# {テンプレート名: {'renders': 描画回数, 'provided': {渡されたキー}, 'used': {参照されたキー}}}
+_context_usage = {}
+_context_usage_lock = threading.Lock()
+
+class LazyContext(Context):
+    # LazyValue を参照時に解決するコンテキスト
+    def __init__(self, environment, parent, name, blocks, globals=None):
+        super(LazyContext, self).__init__(environment, parent, name, blocks, globals)
+        self._stats = None
+        if getattr(settings, 'TEMPLATE_CONTEXT_STATS', False):
+            provided = set(parent) - set(environment.globals)
+            with _context_usage_lock:
+                self._stats = _context_usage.setdefault(name, {'renders': 0, 'provided': set(), 'used': set()})
+                self._stats['renders'] += 1
+                self._stats['provided'] |= provided
+
+    def resolve_or_missing(self, key):
+        value = super(LazyContext, self).resolve_or_missing(key)
+        if self._stats is not None and key in self.parent:
+            with _context_usage_lock:
+                self._stats['used'].add(key)
+        if isinstance(value, LazyValue):
+            value = value.resolve()
+        return value
+
+def context_usage_report():
+    # テンプレート毎に、参照されたキーと渡されたが参照されなかったキーを返す
+    with _context_usage_lock:
+        return {
+            name: {
+                'renders': stats['renders'],
+                'used': sorted(stats['used']),
+                'unused': sorted(stats['provided'] - stats['used'])
+            }
+            for name, stats in _context_usage.items()
+        }
+
+def reset_context_usage():
+    with _context_usage_lock:
+        _context_usage.clear()
+
+def _print_context_usage():
+    report = context_usage_report()
+    if not report:
+        return
+    print("template context usage:", file=sys.stderr)
+    for name in sorted(report):
+        row = report[name]
+        print(f"  {name} (renders: {row['renders']})", file=sys.stderr)
+        print(f"    used:   {', '.join(row['used'])}", file=sys.stderr)
+        print(f"    unused: {', '.join(row['unused'])}", file=sys.stderr)
+
+if getattr(settings, 'TEMPLATE_CONTEXT_STATS', False):
+    atexit.register(_print_context_usage)
+
+_environment = None
+
+def _precompiled_dir():
+    path = getattr(settings, 'PRECOMPILED_TEMPLATE_DIR', None)
+    if path and getattr(settings, 'USE_PRECOMPILED_TEMPLATES', False) and os.path.isdir(path):
+        return path
+    return None
+
+def create_environment():
+    # 事前コンパイル済みのテンプレート（python build_templates.py で生成）があればそれを優先して読み込む。
+    # 見つからないテンプレートは通常どおりソースから読み込む
+    precompiled = _precompiled_dir()
+    if precompiled:
+        env = Environment(
+            loader=ChoiceLoader([ModuleLoader(precompiled), FileSystemLoader(TEMPLATE_DIR, encoding='utf-8')]),
+            extensions=EXTENSIONS,
+            auto_reload=False
+        )
+        env.context_class = LazyContext
+        return env
+
+    bytecode_cache = None
+    cache_dir = getattr(settings, 'TEMPLATE_CACHE_DIR', None)
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            bytecode_cache = MtimeBytecodeCache(cache_dir)
+        except OSError:
+            # 書き込めない環境ではキャッシュなしで動作する
+            bytecode_cache = None
+    env = Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR, encoding='utf-8'),
+        bytecode_cache=bytecode_cache,
+        extensions=EXTENSIONS,
+        auto_reload=getattr(settings, 'TEMPLATE_AUTO_RELOAD', True)
+    )
+    env.context_class = LazyContext
+    return env
+
+def compile_all_templates(target, environment=None):
+    # templates/ 配下の全テンプレートを Python モジュールとして target にコンパイルする。
+    # 構文エラーがあれば例外を送出し、既存の target は変更しない
+    env = environment or Environment(loader=FileSystemLoader(TEMPLATE_DIR, encoding='utf-8'), extensions=EXTENSIONS)
+    parent = os.path.dirname(os.path.abspath(target))
+    os.makedirs(parent, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='.compiled_templates-', dir=parent)
+    try:
+        env.compile_templates(work_dir, zip=None, extensions=['html'], ignore_errors=False)
+        # インポート時にコンパイルが走らないよう .pyc も作成しておく
+        if not compileall.compile_dir(work_dir, quiet=1):
+            raise RuntimeError("failed to byte-compile templates")
+        count = len([name for name in os.listdir(work_dir) if name.endswith('.py')])
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.replace(work_dir, target)
+    except Exception:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    return count
+
+def get_environment():
+    global _environment
+    if _environment is None:
+        _environment = create_environment()
+    return _environment
+
+def reset_environment():
+    # 設定変更後（テストなど）に Environment を作り直す
+    global _environment
+    _environment = None
+
+def jinja2_template(name, *args, **kwargs):
+    for dictarg in args:
+        kwargs.update(dictarg)
+    if profiling.current() is None:
+        return get_environment().get_template(name).render(**kwargs)
+    start = time.perf_counter()
+    try:
+        return get_environment().get_template(name).render(**kwargs)
+    finally:
+        profiling.add_template_time(time.perf_counter() - start)
+
+def _buffered(parts, chunk_size, first_chunk_size):
+    # Template.generate() は細かい断片を返すため、ある程度まとめてから送る。
+    # 最初のチャンク（レイアウトの head 部分）は小さめの閾値ですぐに送り出す
+    buf = []
+    size = 0
+    limit = first_chunk_size
+    for part in parts:
+        buf.append(part)
+        size += len(part)
+        if size >= limit:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+            limit = chunk_size
+    if buf:
+        yield ''.join(buf)
+
+def jinja2_stream(name, *args, **kwargs):
+    # テンプレートを少しずつ描画して返すジェネレータ（長い一覧画面用）
+    for dictarg in args:
+        kwargs.update(dictarg)
+    # 最初のチャンクを送った時点でヘッダーは確定するため、Cookie を発行し得る値
+    # （CSRF トークン・フラッシュメッセージなど）はここで先に解決しておく
+    for key, value in list(kwargs.items()):
+        if isinstance(value, LazyValue):
+            kwargs[key] = value.resolve()
+    template = get_environment().get_template(name)
+    return _buffered(profiling.timed_iter(template.generate(**kwargs)),
+                     getattr(settings, 'TEMPLATE_STREAM_CHUNK_BYTES', 16 * 1024),
+                     getattr(settings, 'TEMPLATE_STREAM_FIRST_CHUNK_BYTES', 1024))
+
+class StreamRows(object):
+    # ストリーミング描画用の行の入れ物
+    # 行をメモリに溜めずにカーソルから1行ずつ読み出す（{% if rows %} は1件だけ存在確認する）
+    def __init__(self, query):
+        self.query = query
+
+    def __bool__(self):
+        return self.query.exists()
+
+    def __iter__(self):
+        return iter(self.query.iterator())
+
+def jinja2_view(name, stream=False, **defaults):
+    # bottle.jinja2_view と同じ使い方ができるデコレータ
+    # dict を返した場合のみテンプレートを描画し、それ以外はそのまま返す
+    # stream=True の場合は描画しながら送信する（TEMPLATE_STREAMING = False なら通常の描画）
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            if isinstance(result, dict) or result is None:
+                tplvars = defaults.copy()
+                tplvars.update(result or {})
+                if stream and getattr(settings, 'TEMPLATE_STREAMING', True):
+                    return jinja2_stream(name, tplvars)
+                return jinja2_template(name, tplvars)
+            return result
+        return wrapper
+    return decorator
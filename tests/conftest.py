@@ -7,7 +7,7 @@ from webtest import TestApp
 # プロジェクトルートをパスに追加
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from models import db, set_db, init_db, User, Client, Site, MaintenanceLog, Notice, LogTemplate, AppSetting, Request
+from models import db, set_db, init_db, User, Client, Site, MaintenanceLog, Notice, LogTemplate, AppSetting, Request, RequestMessage, SharedFile, ClientStorageUsage, DataVersion
 from auth import hash_password
 from index import app, set_apps_catchall
 
@@ -19,6 +19,55 @@ def disable_readonly_mode():
     yield
     settings.READ_ONLY_MODE = original
 
+@pytest.fixture(scope='session', autouse=True)
+def template_cache_dir(tmp_path_factory):
+    # テンプレートのバイトコードキャッシュをテスト用の一時ディレクトリに置く
+    import settings
+    import templating
+    original = settings.TEMPLATE_CACHE_DIR
+    settings.TEMPLATE_CACHE_DIR = str(tmp_path_factory.mktemp('template_cache'))
+    templating.reset_environment()
+    yield settings.TEMPLATE_CACHE_DIR
+    settings.TEMPLATE_CACHE_DIR = original
+    templating.reset_environment()
+
+@pytest.fixture(scope='session', autouse=True)
+def app_log(tmp_path_factory):
+    # アプリケーションのログはテスト用の一時ファイルへ書き込む
+    import applog
+    path = str(tmp_path_factory.mktemp('log') / 'app.log')
+    applog.configure(path=path, root=app)
+    yield path
+    applog.configure(root=app)
+
+@pytest.fixture(autouse=True)
+def fragment_cache_db(tmp_path, monkeypatch):
+    # 部品キャッシュはテスト毎に空の一時ファイルを使う（テスト間でデータバージョンが重複するため）
+    import settings
+    import fragment_cache
+    monkeypatch.setattr(settings, 'FRAGMENT_CACHE_DB', str(tmp_path / 'fragment_cache.db'))
+    fragment_cache.clear()
+    yield settings.FRAGMENT_CACHE_DB
+    fragment_cache.clear()
+
+@pytest.fixture(autouse=True)
+def metrics_db(tmp_path, monkeypatch):
+    # 稼働状況の集計値もテスト毎に空の一時ファイルへ書き込む
+    import settings
+    import metrics
+    monkeypatch.setattr(settings, 'METRICS_DB', str(tmp_path / 'metrics.db'))
+    metrics.reset()
+    yield settings.METRICS_DB
+    metrics.reset()
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path, monkeypatch):
+    # cProfile の計測結果・ルート指定もテスト毎の一時ディレクトリに保存する
+    import settings
+    path = str(tmp_path / 'profiles')
+    monkeypatch.setattr(settings, 'PROFILE_DIR', path)
+    return path
+
 @pytest.fixture(scope='session')
 def test_db():
     # テスト用の一時データベース
@@ -32,11 +81,39 @@ def test_db():
 def clean_db(test_db):
     # 各テスト前にデータをクリア（またはトランザクション）
     # 今回は単純にテーブルのデータを削除
-    models = [User, Client, Site, MaintenanceLog, Notice, LogTemplate, AppSetting, Request]
+    models = [User, Client, Site, MaintenanceLog, Notice, LogTemplate, AppSetting, Request, RequestMessage, SharedFile, ClientStorageUsage, DataVersion]
     for model in models:
         model.delete().execute()
     yield
 
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    # アップロード先をテスト用の一時ディレクトリに差し替える
+    import settings
+    path = tmp_path / 'uploads'
+    path.mkdir()
+    monkeypatch.setattr(settings, 'UPLOAD_DIR', str(path))
+    return path
+
+@pytest.fixture
+def shared_file_factory(upload_dir):
+    def _create_shared_file(uploaded_by, site=None, request_obj=None, filename='doc.txt', content=b'hello', **kwargs):
+        import uuid
+        file_dir = upload_dir / str(uuid.uuid4())
+        file_dir.mkdir()
+        (file_dir / filename).write_bytes(content)
+        return SharedFile.create(
+            site=site,
+            request=request_obj,
+            uploaded_by=uploaded_by,
+            title=kwargs.pop('title', filename),
+            original_filename=filename,
+            stored_path=os.path.join(file_dir.name, filename),
+            size_bytes=len(content),
+            **kwargs
+        )
+    return _create_shared_file
+
 @pytest.fixture
 def test_app():
     # Bottleの catchall を False にすると、テスト中に発生した例外のスタックトレースが見やすくなる
@@ -160,3 +237,18 @@ class AuthClient:
 @pytest.fixture
 def auth_client(test_app):
     return AuthClient(test_app)
+
+@pytest.fixture
+def query_budget(test_db):
+    # with query_budget(上限): ... の範囲で実行された SQL が上限を超えたら、SQL と呼び出し元を表示して失敗させる
+    from contextlib import contextmanager
+    from perf import count_queries, format_statements
+
+    @contextmanager
+    def _query_budget(max_queries, label=''):
+        with count_queries(capture_stack=True, database=test_db) as log:
+            yield log
+        if log.count > max_queries:
+            pytest.fail(f"{label} executed {log.count} queries (budget {max_queries}):\n{format_statements(log)}",
+                        pytrace=False)
+    return _query_budget
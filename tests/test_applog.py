@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import pytest
+import applog
+from index import app
+
+def _read(path):
+    applog.flush()
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+@pytest.fixture
+def restore_log(app_log):
+    # テスト内で設定し直したログをテスト用の既定に戻す
+    yield
+    applog.configure(path=app_log, root=app)
+
+@pytest.fixture
+def debug_log(tmp_path, restore_log):
+    path = str(tmp_path / 'app.log')
+    applog.configure(level='DEBUG', path=path, root=app)
+    return path
+
+def test_request_fields(debug_log, auth_client, admin_user):
+    """リクエスト中のログにリクエスト ID・ルート・ユーザー ID・経過時間が付くことを確認"""
+    auth_client.login(admin_user.email)
+    auth_client.get_with_csrf('/admin/clients')
+    entries = _read(debug_log)
+
+    login = [e for e in entries if e['message'] == 'login succeeded']
+    assert len(login) == 1
+    assert login[0]['login_user_id'] == admin_user.id
+    assert login[0]['route'] == 'POST /login'
+    assert login[0]['logger'] == 'maintainview.index'
+    assert login[0]['level'] == 'INFO'
+
+    sessions = [e for e in entries if e['message'].startswith('get_session') and e.get('route') == 'GET /admin/clients']
+    assert sessions and sessions[0]['path'] == '/admin/clients'
+    assert sessions[0]['elapsed_ms'] >= 0
+    assert len({e['request_id'] for e in sessions}) == 1
+    assert sessions[0]['request_id'] != login[0]['request_id']
+
+def test_disabled_level_skips_formatting(tmp_path, restore_log):
+    """無効なレベルのログは引数を文字列にせず、ファイルも作らないことを確認"""
+    class Expensive:
+        calls = 0
+        def __str__(self):
+            Expensive.calls += 1
+            return 'expensive'
+    path = str(tmp_path / 'app.log')
+    applog.configure(level='WARNING', path=path)
+    log = applog.get_logger('test')
+    log.debug("value %s", Expensive())
+    log.info("value %s", Expensive())
+    assert Expensive.calls == 0
+    applog.flush()
+    assert not os.path.exists(path)
+
+    applog.configure(level='OFF', path=path)
+    log.error("value %s", Expensive())
+    assert Expensive.calls == 0
+    assert not applog.enabled(logging.CRITICAL)
+
+def test_batched_write(tmp_path, monkeypatch, restore_log):
+    """emit ではファイルに書かず、書き込みスレッドがまとめて書くことを確認"""
+    import settings
+    monkeypatch.setattr(settings, 'LOG_FLUSH_SECONDS', 30)
+    path = str(tmp_path / 'app.log')
+    logger = applog.configure(level='INFO', path=path)
+    handler = logger.handlers[0]
+    batches = []
+    original = handler._write
+    monkeypatch.setattr(handler, '_write', lambda batch: (batches.append(len(batch)), original(batch)))
+    log = applog.get_logger('test')
+    for i in range(5):
+        log.info("line %d", i, extra={'index': i})
+    # 30 秒待つ設定なので、まだ書かれていない
+    assert not os.path.exists(path)
+    entries = _read(path)
+    assert batches == [5]
+    assert [e['message'] for e in entries] == [f'line {i}' for i in range(5)]
+    assert [e['index'] for e in entries] == list(range(5))
+
+def test_csrf_rejection_logged_without_token(auth_client, admin_user, app_log):
+    """CSRF エラーはトークンの値を含めずに記録・応答することを確認"""
+    auth_client.login(admin_user.email)
+    auth_client.get_with_csrf('/admin/clients/new')
+    res = auth_client.app.post('/admin/clients/new', {'csrf_token': 'forged-token-value', 'name': 'x'}, status=403)
+    assert 'forged-t' not in res.text
+    entries = [e for e in _read(app_log) if e['message'].startswith('CSRF token rejected')]
+    assert entries[-1]['message'] == 'CSRF token rejected: form token present, session token present'
+    assert entries[-1]['level'] == 'WARNING'
+    assert entries[-1]['route'] == 'POST /admin/clients/new'
+    assert entries[-1]['user_id'] == admin_user.id
@@ -63,3 +63,89 @@ def test_client_log_visibility(auth_client, client_factory, client_user_factory)
     res = auth_client.app.get(f'/client/sites/{site.id}/logs')
     assert "Visible Log" in res.text
     assert "Hidden Log" not in res.text
+
+def test_client_file_download_access(auth_client, admin_user, client_factory, client_user_factory, shared_file_factory):
+    """クライアントが自社のファイルのみダウンロードできることを確認"""
+    from utils import generate_file_token
+    client1 = client_factory(name="Client 1")
+    client2 = client_factory(name="Client 2")
+    user1 = client_user_factory(email="user1@test.com", client=client1)
+    site1 = Site.create(client=client1, name="Site 1")
+    site2 = Site.create(client=client2, name="Site 2")
+    req2 = Request.create(client=client2, subject="Other", body="Other", created_by=admin_user)
+
+    own_file = shared_file_factory(admin_user, site=site1, content=b'own')
+    hidden_file = shared_file_factory(admin_user, site=site1, client_visible=False)
+    deleted_file = shared_file_factory(admin_user, site=site1, is_deleted=True)
+    other_site_file = shared_file_factory(admin_user, site=site2)
+    other_request_file = shared_file_factory(admin_user, request_obj=req2)
+
+    auth_client.login(user1.email, 'password')
+
+    res = auth_client.app.get(f'/files/{generate_file_token(own_file.id)}')
+    assert res.status_code == 200
+    assert res.body == b'own'
+
+    auth_client.app.get(f'/files/{generate_file_token(hidden_file.id)}', status=403)
+    auth_client.app.get(f'/files/{generate_file_token(deleted_file.id)}', status=404)
+    auth_client.app.get(f'/files/{generate_file_token(other_site_file.id)}', status=403)
+    auth_client.app.get(f'/files/{generate_file_token(other_request_file.id)}', status=403)
+    auth_client.app.get(f'/files/{generate_file_token(999999)}', status=404)
+
+def test_client_request_access_other_client(auth_client, admin_user, client_factory, client_user_factory):
+    """他社の依頼詳細にアクセスできないことを確認"""
+    client1 = client_factory(name="Client 1")
+    client2 = client_factory(name="Client 2")
+    user1 = client_user_factory(email="user1@test.com", client=client1)
+    req2 = Request.create(client=client2, subject="Other", body="Other", created_by=admin_user)
+
+    auth_client.login(user1.email, 'password')
+    auth_client.app.get(f'/client/requests/{req2.id}', status=403)
+    auth_client.app.get('/client/requests/999999', status=404)
+
+def test_client_site_files_bundle(auth_client, admin_user, client_factory, client_user_factory, shared_file_factory):
+    """サイトの共有ファイルをZIPで一括ダウンロードできることを確認"""
+    import io
+    import zipfile
+    client1 = client_factory(name="Client 1")
+    client2 = client_factory(name="Client 2")
+    user1 = client_user_factory(email="user1@test.com", client=client1)
+    site1 = Site.create(client=client1, name="Site 1")
+    site2 = Site.create(client=client2, name="Site 2")
+
+    shared_file_factory(admin_user, site=site1, filename='memo.txt', content=b'memo' * 100)
+    shared_file_factory(admin_user, site=site1, filename='memo.txt', content=b'second')
+    shared_file_factory(admin_user, site=site1, filename='photo.png', content=b'\x89PNG' * 10)
+    shared_file_factory(admin_user, site=site1, filename='hidden.txt', client_visible=False)
+    shared_file_factory(admin_user, site=site1, filename='deleted.txt', is_deleted=True)
+
+    auth_client.login(user1.email, 'password')
+    res = auth_client.app.get(f'/client/sites/{site1.id}/files/bundle')
+    assert res.content_type == 'application/zip'
+
+    zf = zipfile.ZipFile(io.BytesIO(res.body))
+    assert sorted(zf.namelist()) == ['memo (2).txt', 'memo.txt', 'photo.png']
+    assert zf.read('memo.txt') == b'memo' * 100
+    assert zf.getinfo('memo.txt').compress_type == zipfile.ZIP_DEFLATED
+    assert zf.getinfo('photo.png').compress_type == zipfile.ZIP_STORED
+
+    auth_client.app.get(f'/client/sites/{site2.id}/files/bundle', status=403)
+
+def test_client_request_new_attachment_failure_leaves_nothing(auth_client, client_factory, client_user_factory, upload_dir, monkeypatch):
+    """添付の記録に失敗した場合、依頼も実ファイルも残らないことを確認"""
+    import routes_client
+    client = client_factory()
+    user = client_user_factory(email="user@test.com", client=client)
+    site = Site.create(client=client, name="Site")
+    auth_client.login(user.email, 'password')
+    auth_client.get_with_csrf('/client/requests/new')
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("record failed")
+    monkeypatch.setattr(routes_client, 'create_shared_file_record', fail)
+    with pytest.raises(RuntimeError):
+        auth_client.app.post('/client/requests/new', {
+            'csrf_token': auth_client.csrf_token, 'site_id': site.id, 'subject': 'Failed', 'body': 'Body'
+        }, upload_files=[('file', 'doc.txt', b'data')])
+    assert not Request.filter(subject='Failed').exists()
+    assert list(upload_dir.iterdir()) == []
@@ -0,0 +1,63 @@
+import datetime
+from models import Site, MaintenanceLog, Notice, Request, RequestMessage, AppSetting, SharedFile, client_data_version
+
+def test_client_version_bumped_by_saves(admin_user, client_factory, shared_file_factory):
+    """クライアントに属するデータの保存でそのクライアントのバージョンだけが上がることを確認"""
+    client1 = client_factory(name="Client 1")
+    client2 = client_factory(name="Client 2")
+    other = client_data_version(client2.id)
+
+    site = Site.create(client=client1, name="Site")
+    versions = [client_data_version(client1.id)]
+
+    log = MaintenanceLog.create(site=site, performed_at=datetime.date.today(), category='Update', summary='Log')
+    versions.append(client_data_version(client1.id))
+    log.summary = 'Edited'
+    log.save()
+    versions.append(client_data_version(client1.id))
+
+    Notice.create(site=site, title='Notice', body='Body')
+    versions.append(client_data_version(client1.id))
+    req = Request.create(client=client1, subject='Subject', body='Body', created_by=admin_user)
+    versions.append(client_data_version(client1.id))
+    RequestMessage.create(request=req, author_user=admin_user, author_role='admin', body='Reply')
+    versions.append(client_data_version(client1.id))
+    shared_file_factory(admin_user, request_obj=req)
+    versions.append(client_data_version(client1.id))
+
+    client_versions = [v[0] for v in versions]
+    assert client_versions == sorted(set(client_versions))
+    assert client_data_version(client2.id) == other
+
+def test_moving_site_bumps_both_clients(client_factory):
+    """サイトの所属クライアントを変更すると、変更前後の両方のバージョンが上がることを確認"""
+    client1 = client_factory(name="Client 1")
+    client2 = client_factory(name="Client 2")
+    site = Site.create(client=client1, name="Site")
+    before1 = client_data_version(client1.id)
+    before2 = client_data_version(client2.id)
+
+    site = Site.get_by_id(site.id)
+    site.client = client2
+    site.save()
+    assert client_data_version(client1.id)[0] > before1[0]
+    assert client_data_version(client2.id)[0] > before2[0]
+
+def test_settings_and_bulk_versions(admin_user, client_factory, shared_file_factory):
+    """表示設定の保存で共通のバージョンが、一括削除（ファイル回収）で対象クライアントのバージョンが上がることを確認"""
+    from file_gc import purge_deleted_files
+    client = client_factory()
+    site = Site.create(client=client, name="Site")
+    before = client_data_version(client.id)
+
+    AppSetting.create(key='show_files', value='false')
+    after_settings = client_data_version(client.id)
+    assert after_settings[2] > before[2]
+
+    f = shared_file_factory(admin_user, site=site, is_deleted=True)
+    SharedFile.update(updated_at=datetime.datetime.now() - datetime.timedelta(days=60)).where(SharedFile.id == f.id).execute()
+    after_file = client_data_version(client.id)
+    assert purge_deleted_files(retention_days=30) == (1, len(b'hello'))
+    after_purge = client_data_version(client.id)
+    assert after_purge[0] > after_file[0]
+    assert after_purge[1] == after_file[1]
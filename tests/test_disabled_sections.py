@@ -0,0 +1,64 @@
+import datetime
+import pytest
+from models import Site, MaintenanceLog, Notice, AppSetting
+
+@pytest.fixture
+def executed_sql(test_db, monkeypatch):
+    # 実行された SQL を記録する
+    statements = []
+    original = test_db.execute_sql
+    def execute_sql(sql, params=None, *args, **kwargs):
+        statements.append(sql)
+        return original(sql, params, *args, **kwargs)
+    monkeypatch.setattr(test_db, 'execute_sql', execute_sql)
+    return statements
+
+def _tables(statements):
+    return ' '.join(statements).lower()
+
+@pytest.fixture
+def client_with_data(auth_client, client_factory, client_user_factory, admin_user, shared_file_factory):
+    client = client_factory()
+    user = client_user_factory(email="user@test.com", client=client)
+    site = Site.create(client=client, name="Test Site")
+    MaintenanceLog.create(site=site, performed_at=datetime.date.today(), category='Update', summary='Log')
+    Notice.create(site=site, title='Notice', body='Body')
+    shared_file_factory(admin_user, site=site)
+    auth_client.login(user.email, 'password')
+    return site
+
+def _disable(*keys):
+    for key in keys:
+        AppSetting.create(key=key, value='false')
+
+def test_disabled_sections_issue_no_queries(auth_client, client_with_data, executed_sql):
+    """非表示に設定した欄のクエリ（ログ・注意事項・ファイル）が実行されないことを確認"""
+    site = client_with_data
+    _disable('show_maintenance_log', 'show_notice', 'show_files')
+
+    del executed_sql[:]
+    auth_client.app.get('/client/')
+    auth_client.app.get(f'/client/sites/{site.id}')
+    auth_client.app.get('/client/reports/monthly')
+    sql = _tables(executed_sql)
+    assert '"maintenancelog"' not in sql
+    assert '"notice"' not in sql
+    assert '"sharedfile"' not in sql
+
+def test_top_cards_switch_skips_dashboard_queries(auth_client, client_with_data, executed_sql):
+    """上部カードを非表示にするとダッシュボードの部品クエリが実行されないことを確認"""
+    _disable('show_top_cards')
+
+    del executed_sql[:]
+    auth_client.app.get('/client/')
+    sql = _tables(executed_sql)
+    assert '"maintenancelog"' not in sql
+    assert '"notice"' not in sql
+
+def test_enabled_sections_still_rendered(auth_client, client_with_data, executed_sql):
+    """表示設定が有効な場合は従来どおり各欄が表示されることを確認"""
+    site = client_with_data
+    res = auth_client.app.get(f'/client/sites/{site.id}')
+    assert 'Notice' in res.text
+    assert 'doc.txt' in res.text
+    assert '"notice"' in _tables(executed_sql)
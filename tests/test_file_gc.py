@@ -0,0 +1,63 @@
+import datetime
+import os
+import time
+import settings
+from models import Site, SharedFile, Request, RequestMessage, client_data_version
+from file_gc import collect_garbage
+
+def _age(shared_file, days):
+    SharedFile.update(updated_at=datetime.datetime.now() - datetime.timedelta(days=days)).where(SharedFile.id == shared_file.id).execute()
+
+def test_gc_purges_old_deleted_files(admin_user, client_factory, shared_file_factory, upload_dir, tmp_path, monkeypatch):
+    """保持期間を過ぎた論理削除ファイルのみが実ファイルごと削除されることを確認"""
+    monkeypatch.setattr(settings, 'UPLOAD_STAGING_DIR', str(tmp_path / 'staging'))
+    site = Site.create(client=client_factory(), name="Site")
+    req = Request.create(client=site.client, subject="S", body="B", created_by=admin_user)
+    old_deleted = shared_file_factory(admin_user, request_obj=req, content=b'x' * 100, is_deleted=True)
+    msg = RequestMessage.create(request=req, author_user=admin_user, author_role='admin', body='b', shared_file=old_deleted)
+    recent_deleted = shared_file_factory(admin_user, site=site, is_deleted=True)
+    alive = shared_file_factory(admin_user, site=site)
+    _age(old_deleted, 40)
+    _age(alive, 40)
+    other_client = client_factory(name="Other")
+    before = client_data_version(site.client_id)
+    other_before = client_data_version(other_client.id)
+
+    report = collect_garbage(retention_days=30, grace_seconds=0)
+
+    # 削除したファイルのクライアントのバージョンだけが上がる
+    after = client_data_version(site.client_id)
+    assert after[0] == before[0] + 1
+    assert after[1:] == before[1:]
+    assert client_data_version(other_client.id) == other_before
+
+    assert report['purged_files'] == 1
+    assert report['reclaimed_bytes'] == 100
+    assert not SharedFile.filter(id=old_deleted.id).exists()
+    assert not os.path.exists(os.path.join(str(upload_dir), os.path.dirname(old_deleted.stored_path)))
+    assert RequestMessage.get_by_id(msg.id).shared_file is None
+    assert SharedFile.filter(id=recent_deleted.id).exists()
+    assert os.path.exists(os.path.join(str(upload_dir), alive.stored_path))
+
+def test_gc_removes_orphans_after_grace(admin_user, client_factory, shared_file_factory, upload_dir, tmp_path, monkeypatch):
+    """参照されていないアップロードディレクトリが猶予期間後にのみ削除されることを確認"""
+    monkeypatch.setattr(settings, 'UPLOAD_STAGING_DIR', str(tmp_path / 'staging'))
+    site = Site.create(client=client_factory(), name="Site")
+    alive = shared_file_factory(admin_user, site=site)
+    orphan = upload_dir / 'orphan-dir'
+    orphan.mkdir()
+    (orphan / 'left.txt').write_bytes(b'y' * 50)
+
+    # アップロード直後（猶予期間内）は削除しない
+    report = collect_garbage(retention_days=30, grace_seconds=3600)
+    assert report['orphan_dirs'] == 0
+    assert orphan.exists()
+
+    old = time.time() - 7200
+    os.utime(str(orphan), (old, old))
+    os.utime(os.path.join(str(upload_dir), os.path.dirname(alive.stored_path)), (old, old))
+    report = collect_garbage(retention_days=30, grace_seconds=3600)
+    assert report['orphan_dirs'] == 1
+    assert report['reclaimed_bytes'] == 50
+    assert not orphan.exists()
+    assert os.path.exists(os.path.join(str(upload_dir), alive.stored_path))
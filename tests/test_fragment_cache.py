@@ -0,0 +1,90 @@
+import datetime
+import fragment_cache
+from models import Site, Notice, MaintenanceLog
+
+def _admin_cache_version():
+    from models import global_data_version
+    return (global_data_version(), datetime.date.today().isoformat())
+
+def test_lru_ttl_and_shared_tier(monkeypatch):
+    """件数上限・有効期限・プロセス間共有（SQLite）が機能することを確認"""
+    import settings
+    monkeypatch.setattr(settings, 'FRAGMENT_CACHE_MAX_ENTRIES', 2)
+    calls = []
+    def render():
+        calls.append(1)
+        return '<p>widget</p>'
+
+    assert fragment_cache.cached_fragment('w', 'client:1', 1, render) == '<p>widget</p>'
+    assert fragment_cache.cached_fragment('w', 'client:1', 1, render) == '<p>widget</p>'
+    assert len(calls) == 1
+
+    # 別プロセス相当（プロセス内の LRU が空）でも共有キャッシュから取得できる
+    fragment_cache._memory.clear()
+    assert fragment_cache.get('w', 'client:1', 1) == '<p>widget</p>'
+
+    # バージョンが変われば再描画
+    fragment_cache.cached_fragment('w', 'client:1', 2, render)
+    assert len(calls) == 2
+    fragment_cache.put('a', 's', 1, 'A')
+    fragment_cache.put('b', 's', 1, 'B')
+    assert len(fragment_cache._memory) == 2
+
+    # 期限切れは返さない
+    fragment_cache.put('t', 's', 1, 'T', ttl=-1)
+    assert fragment_cache.get('t', 's', 1) is None
+
+    fragment_cache.invalidate(widget='w')
+    assert fragment_cache.get('w', 'client:1', 2) is None
+    assert fragment_cache.get('a', 's', 1) == 'A'
+
+def test_template_cache_tag(monkeypatch):
+    """{% cache %} タグはキャッシュがあれば中身を評価しないことを確認"""
+    from templating import get_environment
+    calls = []
+    def load():
+        calls.append(1)
+        return 'body'
+    tpl = get_environment().from_string("{% cache 'tag', scope, version %}[{{ load() }}]{% endcache %}")
+    assert tpl.render(scope='admin', version=1, load=load) == '[body]'
+    assert tpl.render(scope='admin', version=1, load=load) == '[body]'
+    assert len(calls) == 1
+    tpl.render(scope='admin', version=2, load=load)
+    assert len(calls) == 2
+
+def test_client_dashboard_uses_cached_widgets(auth_client, client_factory, client_user_factory, monkeypatch):
+    """2回目のダッシュボード表示ではアラートを再計算せず、データ更新後は反映されることを確認"""
+    import routes_client
+    client = client_factory()
+    user = client_user_factory(email="user@test.com", client=client)
+    site = Site.create(client=client, name="Test Site",
+                       ssl_expire_date=datetime.date.today() + datetime.timedelta(days=3))
+    auth_client.login(user.email, 'password')
+
+    calls = []
+    original = routes_client._dashboard_alerts
+    monkeypatch.setattr(routes_client, '_dashboard_alerts', lambda client_id: calls.append(client_id) or original(client_id))
+
+    res = auth_client.app.get('/client/')
+    assert 'Test Site' in res.text
+    res = auth_client.app.get('/client/')
+    assert 'Test Site' in res.text
+    assert len(calls) == 1
+
+    Notice.create(site=site, title='New notice', body='Body')
+    res = auth_client.app.get('/client/')
+    assert 'New notice' in res.text
+    assert len(calls) == 2
+
+def test_admin_dashboard_uses_cached_widgets(auth_client, admin_user, client_factory):
+    """管理者ダッシュボードの直近ログがキャッシュされ、ログ追加で更新されることを確認"""
+    client = client_factory()
+    site = Site.create(client=client, name="Test Site")
+    MaintenanceLog.create(site=site, performed_at=datetime.date.today(), category='Update', summary='First log')
+    auth_client.login(admin_user.email, 'password')
+
+    assert 'First log' in auth_client.app.get('/admin/').text
+    assert fragment_cache.get('admin_dashboard_recent_logs', 'admin', _admin_cache_version()) is not None
+
+    MaintenanceLog.create(site=site, performed_at=datetime.date.today(), category='Update', summary='Second log')
+    assert 'Second log' in auth_client.app.get('/admin/').text
@@ -0,0 +1,51 @@
+import pytest
+from models import Site, Notice, AppSetting
+
+@pytest.fixture
+def client_login(auth_client, client_factory, client_user_factory):
+    client = client_factory()
+    user = client_user_factory(email="user@test.com", client=client)
+    site = Site.create(client=client, name="Test Site")
+    auth_client.login(user.email, 'password')
+    return client, site
+
+@pytest.mark.parametrize('path', ['/client/', '/client/sites/{site_id}', '/client/reports/monthly'])
+def test_client_pages_return_304_when_unchanged(auth_client, client_login, path):
+    """データに変化がなければ If-None-Match に 304 を返すことを確認"""
+    client, site = client_login
+    url = path.format(site_id=site.id)
+    res = auth_client.app.get(url)
+    etag = res.headers['ETag']
+    assert etag.startswith('W/"')
+
+    res = auth_client.app.get(url, headers={'If-None-Match': etag}, status=304)
+    assert res.body == b''
+    assert res.headers['ETag'] == etag
+
+def test_client_page_etag_changes_on_update(auth_client, client_login):
+    """データや表示設定が変わると ETag が変わり、再描画されることを確認"""
+    client, site = client_login
+    etag = auth_client.app.get('/client/').headers['ETag']
+
+    Notice.create(site=site, title='Maintenance window', body='Tonight')
+    res = auth_client.app.get('/client/', headers={'If-None-Match': etag}, status=200)
+    assert 'Maintenance window' in res.text
+    etag2 = res.headers['ETag']
+    assert etag2 != etag
+
+    AppSetting.create(key='label_dashboard', value='ホーム')
+    res = auth_client.app.get('/client/', headers={'If-None-Match': etag2}, status=200)
+    assert res.headers['ETag'] != etag2
+
+    # 月の指定が違えば別の検証子になる
+    auth_client.app.get('/client/reports/monthly?month=2026-01', headers={'If-None-Match': etag2}, status=200)
+
+def test_client_etag_is_per_user(auth_client, client_login, client_user_factory):
+    """別のユーザーには前のユーザーの ETag で 304 を返さないことを確認"""
+    client, site = client_login
+    etag = auth_client.app.get(f'/client/sites/{site.id}').headers['ETag']
+
+    other = client_user_factory(email="other@test.com", client=client)
+    auth_client.app.reset()
+    auth_client.login(other.email, 'password')
+    auth_client.app.get(f'/client/sites/{site.id}', headers={'If-None-Match': etag}, status=200)
@@ -0,0 +1,102 @@
+import re
+import pytest
+from webtest import TestApp
+from conftest import AuthClient
+from index import app
+from models import Client, Site, AppSetting
+from profiling import ProfilingMiddleware
+import metrics
+
+def _value(text, name, **labels):
+    # 出力から指定したラベルを含む行の値を読む
+    for line in text.splitlines():
+        if line.startswith(name + '{') and all(f'{k}="{v}"' in line for k, v in labels.items()):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+def _profiled_client(email):
+    auth = AuthClient(TestApp(ProfilingMiddleware(app, root=app, log_path=''), extra_environ={'REMOTE_ADDR': '127.0.0.1'}))
+    auth.login(email)
+    return auth
+
+@pytest.fixture
+def metrics_client(admin_user):
+    return _profiled_client(admin_user.email)
+
+def test_request_metrics(metrics_client):
+    """ルート・ステータス毎の件数、所要時間のヒストグラム、SQL の回数が出力されることを確認"""
+    client = Client.create(name="Metrics", display_name="Metrics")
+    site = Site.create(client=client, name="Metrics Site")
+    metrics_client.app.get(f'/admin/sites/{site.id}')
+    metrics_client.app.get(f'/admin/sites/{site.id}')
+    metrics_client.app.get('/admin/sites', status=200)
+
+    res = metrics_client.app.get('/metrics')
+    assert res.content_type == 'text/plain'
+    text = res.text
+    assert _value(text, 'mv_http_requests_total', method='GET', route='/admin/sites/<id:int>', status='200') == 2
+    assert _value(text, 'mv_http_requests_total', method='GET', route='/admin/sites', status='200') == 1
+    assert _value(text, 'mv_http_request_duration_seconds_count', method='GET', route='/admin/sites/<id:int>') == 2
+    assert _value(text, 'mv_http_request_duration_seconds_bucket', method='GET', route='/admin/sites/<id:int>', le='+Inf') == 2
+    assert _value(text, 'mv_db_queries_total', method='GET', route='/admin/sites/<id:int>') > 0
+    assert '# TYPE mv_http_request_duration_seconds histogram' in text
+    # バケットは le の昇順に全て出力される
+    buckets = re.findall(r'mv_http_request_duration_seconds_bucket\{le="([^"]+)",method="GET",route="/admin/sites/<id:int>"\} (\d+)', text)
+    assert [le for le, _ in buckets] == [metrics._format_value(le) for le in metrics.DURATION_BUCKETS] + ['+Inf']
+    counts = [int(c) for _, c in buckets]
+    assert counts == sorted(counts)
+
+def test_settings_cached_within_request(client_user_factory):
+    """表示設定・ラベルが同じリクエスト内で再利用され、ヒット率として出力されることを確認"""
+    client = Client.create(name="Metrics", display_name="Metrics")
+    site = Site.create(client=client, name="Metrics Site")
+    client_user_factory(email="metrics@test.com", client=client)
+    auth = _profiled_client("metrics@test.com")
+    metrics.reset()
+    # ルートとテンプレートの両方で参照される
+    auth.app.get(f'/client/sites/{site.id}/logs')
+    text = metrics.render()
+    assert _value(text, 'mv_cache_requests_total', cache='settings', result='miss') == 1
+    assert _value(text, 'mv_cache_requests_total', cache='settings', result='hit') >= 1
+
+def test_settings_cache_invalidated_by_change():
+    """同じリクエスト内でも設定を変更した後は読み込み直すことを確認"""
+    from bottle import request
+    from utils import get_app_settings
+    request.bind({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'})
+    assert get_app_settings()['show_notice'] is True
+    AppSetting.create(key='show_notice', value='false')
+    assert get_app_settings()['show_notice'] is False
+
+def test_aggregated_across_processes():
+    """各プロセスの増分が共有ファイルで合計されることを確認"""
+    metrics.inc('mv_upload_bytes_total', 100)
+    assert metrics.flush()
+    # 別プロセス相当（プロセス内の値を破棄して再接続）
+    metrics.reset()
+    metrics.inc('mv_upload_bytes_total', 50)
+    assert 'mv_upload_bytes_total 150\n' in metrics.render()
+
+def test_download_bytes(metrics_client, shared_file_factory, admin_user):
+    """ファイルのダウンロード量が集計されることを確認"""
+    from utils import generate_file_token
+    client = Client.create(name="Metrics", display_name="Metrics")
+    site = Site.create(client=client, name="Metrics Site")
+    shared = shared_file_factory(admin_user, site=site, content=b'x' * 1234)
+    metrics_client.app.get(f'/files/{generate_file_token(shared.id)}')
+    assert 'mv_download_bytes_total 1234' in metrics.render()
+
+def test_metrics_access(test_app, monkeypatch):
+    """トークン未設定時はローカルホストのみ、設定時はトークンが必要なことを確認"""
+    import settings
+    test_app.get('/metrics', extra_environ={'REMOTE_ADDR': '127.0.0.1'}, status=200)
+    test_app.get('/metrics', extra_environ={'REMOTE_ADDR': '192.0.2.1'}, status=403)
+    monkeypatch.setattr(settings, 'METRICS_TOKEN', 'secret-token')
+    test_app.get('/metrics', extra_environ={'REMOTE_ADDR': '127.0.0.1'}, status=403)
+    test_app.get('/metrics', headers={'Authorization': 'Bearer secret-token'},
+                 extra_environ={'REMOTE_ADDR': '192.0.2.1'}, status=200)
+
+def test_metrics_ignores_forwarded_for(test_app):
+    """X-Forwarded-For でローカルホストを装っても取得できないことを確認"""
+    test_app.get('/metrics', headers={'X-Forwarded-For': '127.0.0.1'},
+                 extra_environ={'REMOTE_ADDR': '203.0.113.5'}, status=403)
@@ -0,0 +1,66 @@
+import gzip
+from webob import Request as WebObRequest
+from middleware import CompressionMiddleware
+
+# webtest は gzip 本文を自動で展開してしまうため、WebOb で直接呼び出して生の応答を確認する
+def _call(app, path='/', accept='gzip'):
+    req = WebObRequest.blank(path, headers={'Accept-Encoding': accept})
+    status, headers, app_iter = req.call_application(app)
+    body = b''.join(app_iter)
+    if hasattr(app_iter, 'close'):
+        app_iter.close()
+    return status, dict(headers), body
+
+def _app(body_chunks, content_type='text/html; charset=UTF-8', length=True):
+    def app(environ, start_response):
+        headers = [('Content-Type', content_type)]
+        if length:
+            headers.append(('Content-Length', str(sum(len(c) for c in body_chunks))))
+        start_response('200 OK', headers)
+        return iter(body_chunks)
+    return app
+
+def test_compresses_large_html():
+    """しきい値を超える HTML が gzip 圧縮されることを確認"""
+    body = b'<tr><td>row</td></tr>' * 500
+    status, headers, res_body = _call(CompressionMiddleware(_app([body]), min_size=1024, level=6), accept='gzip, deflate')
+    assert headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in headers['Vary']
+    assert 'Content-Length' not in headers
+    assert len(res_body) < len(body)
+    assert gzip.decompress(res_body) == body
+
+def test_compresses_streamed_body():
+    """Content-Length のないストリーミング本文も圧縮されることを確認"""
+    chunks = [b'<p>chunk %d</p>' % i * 50 for i in range(20)]
+    status, headers, res_body = _call(CompressionMiddleware(_app(chunks, length=False), min_size=1024))
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(res_body) == b''.join(chunks)
+
+def test_skips_small_unaccepted_and_binary():
+    """小さい本文・gzip 非対応クライアント・対象外の形式は圧縮しないことを確認"""
+    status, headers, res_body = _call(CompressionMiddleware(_app([b'<p>hi</p>']), min_size=1024))
+    assert 'Content-Encoding' not in headers
+
+    body = b'x' * 5000
+    status, headers, res_body = _call(CompressionMiddleware(_app([body]), min_size=1024), accept='identity, gzip;q=0')
+    assert 'Content-Encoding' not in headers
+    assert res_body == body
+
+    status, headers, res_body = _call(CompressionMiddleware(_app([body], content_type='image/png'), min_size=1024))
+    assert 'Content-Encoding' not in headers
+
+def test_skips_file_downloads():
+    """/files/ 配下のダウンロードは圧縮しないことを確認"""
+    body = b'a,b,c\n' * 1000
+    app = CompressionMiddleware(_app([body], content_type='text/csv'), min_size=1024)
+    assert 'Content-Encoding' not in _call(app, '/files/token')[1]
+    assert _call(app, '/report.csv')[1]['Content-Encoding'] == 'gzip'
+
+def test_application_pages_are_compressed(admin_user):
+    """アプリ本体の画面が圧縮されて返ることを確認"""
+    from index import app
+    status, headers, body = _call(CompressionMiddleware(app, min_size=512), '/login')
+    assert status.startswith('200')
+    assert headers['Content-Encoding'] == 'gzip'
+    assert 'csrf_token' in gzip.decompress(body).decode()
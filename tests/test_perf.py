@@ -0,0 +1,18 @@
+from models import Client
+from perf import count_queries
+
+def test_count_queries_records_statements_in_scope(test_db, client_factory):
+    """範囲内で実行された SQL のみが記録され、入れ子の範囲では両方に記録されることを確認"""
+    client_factory("Perf Client")
+    with count_queries() as outer:
+        Client.select().count()
+        with count_queries(capture_stack=True) as inner:
+            list(Client.select())
+    Client.select().count()
+
+    assert outer.count == 2
+    assert inner.count == 1
+    assert 'FROM "client"' in inner.statements[0][0]
+    # 呼び出し元のスタックは capture_stack=True の場合のみ
+    assert inner.statements[0][3] is not None
+    assert outer.statements[1][3] is None
@@ -0,0 +1,116 @@
+import os
+import pstats
+from webtest import TestApp
+from conftest import AuthClient
+from index import app
+from models import Client, Site
+from profiling import ProfilingMiddleware
+import profile_capture
+
+def _profiled_client(email):
+    auth = AuthClient(TestApp(ProfilingMiddleware(app, root=app, log_path='')))
+    auth.login(email)
+    return auth
+
+def test_signed_url_captures_profile(admin_user):
+    """署名付き URL のリクエストが cProfile 付きで処理され、保存されることを確認"""
+    client = Client.create(name="Prof", display_name="Prof")
+    site = Site.create(client=client, name="Prof Site")
+    auth = _profiled_client(admin_user.email)
+    auth.app.get(f'/admin/sites/{site.id}')
+    assert profile_capture.list_profiles() == []
+
+    url = profile_capture.signed_url(f'/admin/sites/{site.id}?tab=logs')
+    assert url.startswith(f'/admin/sites/{site.id}?tab=logs&_profile=')
+    auth.app.get(url)
+    profiles = profile_capture.list_profiles()
+    assert len(profiles) == 1
+    profile = profiles[0]
+    assert profile['route'] == 'GET /admin/sites/<id:int>'
+    assert profile['path'] == f'/admin/sites/{site.id}'
+    assert profile['status'] == 200
+    assert profile['top'][0]['cumtime_ms'] >= profile['top'][-1]['cumtime_ms']
+    assert any(row['function'].startswith('auth.py:') for row in profile_capture.load_stats(profile['name']))
+    # pstats でそのまま読める
+    stats = pstats.Stats(profile_capture.profile_path(profile['name']))
+    assert stats.total_calls > 0
+
+def test_invalid_token_not_captured(admin_user):
+    """改ざん・別のパス用のトークンでは計測しないことを確認"""
+    auth = _profiled_client(admin_user.email)
+    token = profile_capture.make_token('/admin/clients')
+    auth.app.get('/admin/sites', {'_profile': token})
+    auth.app.get('/admin/clients', {'_profile': token + 'x'})
+    assert profile_capture.list_profiles() == []
+    auth.app.get('/admin/clients', {'_profile': token})
+    assert len(profile_capture.list_profiles()) == 1
+
+def test_armed_route_profiled_n_times(admin_user):
+    """指定したルートが次の N 回だけ計測されることを確認"""
+    client = Client.create(name="Prof", display_name="Prof")
+    site = Site.create(client=client, name="Prof Site")
+    auth = _profiled_client(admin_user.email)
+    profile_capture.arm('GET', '/admin/sites/<id:int>', 2)
+    auth.app.get('/admin/sites')
+    for _ in range(3):
+        auth.app.get(f'/admin/sites/{site.id}')
+    profiles = profile_capture.list_profiles()
+    assert [p['route'] for p in profiles] == ['GET /admin/sites/<id:int>'] * 2
+    # 使い切ると指定は削除される
+    assert profile_capture.armed_routes() == []
+
+def test_admin_profiles_pages(auth_client, admin_user):
+    """管理画面からルートを指定し、一覧・詳細・ダウンロードができることを確認"""
+    auth_client.login(admin_user.email)
+    auth_client.get_with_csrf('/admin/profiles')
+    res = auth_client.app.post('/admin/profiles', {'csrf_token': auth_client.csrf_token, 'action': 'arm',
+                                                   'route': 'GET /admin/clients', 'count': '3'}).follow()
+    assert '残り 3 回' in res.text
+    assert profile_capture.armed_routes() == [{'method': 'GET', 'rule': '/admin/clients', 'remaining': 3}]
+    # 存在しないルートは指定できない
+    auth_client.app.post('/admin/profiles', {'csrf_token': auth_client.csrf_token, 'action': 'arm',
+                                             'route': 'GET /nowhere', 'count': '3'})
+    assert len(profile_capture.armed_routes()) == 1
+
+    res = auth_client.app.post('/admin/profiles', {'csrf_token': auth_client.csrf_token, 'action': 'sign',
+                                                   'url': '/admin/clients'})
+    assert '/admin/clients?_profile=' in res.text
+
+    profiled = _profiled_client(admin_user.email)
+    profiled.app.get('/admin/clients')
+    name = profile_capture.list_profiles()[0]['name']
+    res = auth_client.app.get('/admin/profiles')
+    assert f'/admin/profiles/{name}' in res.text
+    res = auth_client.app.get(f'/admin/profiles/{name}')
+    # 画面のルートは login_required を経由する
+    assert 'auth.py:' in res.text
+    res = auth_client.app.get(f'/admin/profiles/{name}', {'sort': 'tottime'})
+    assert '<strong>関数内の時間</strong>' in res.text
+    res = auth_client.app.get(f'/admin/profiles/{name}/download')
+    assert res.headers['Content-Disposition'] == f'attachment; filename="{name}.prof"'
+    assert res.body == open(profile_capture.profile_path(name), 'rb').read()
+
+    auth_client.app.post('/admin/profiles', {'csrf_token': auth_client.csrf_token, 'action': 'delete', 'name': name})
+    assert profile_capture.list_profiles() == []
+
+def test_profile_name_validated(auth_client, admin_user, profile_dir):
+    """保存ディレクトリ外のファイルを指定できないことを確認"""
+    auth_client.login(admin_user.email)
+    os.makedirs(profile_dir, exist_ok=True)
+    assert profile_capture.profile_path('../settings') is None
+    auth_client.app.get('/admin/profiles/..%2Fsettings/download', status=404)
+    auth_client.app.get('/admin/profiles/armed', status=404)
+
+def test_profiles_pruned(monkeypatch):
+    """保存件数の上限を超えると古いものから削除されることを確認"""
+    import cProfile
+    import settings
+    monkeypatch.setattr(settings, 'PROFILE_KEEP', 2)
+    names = []
+    for i in range(3):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        sum(range(100))
+        profiler.disable()
+        names.append(profile_capture.save(profiler, 'GET /x', 'GET', f'/x/{i}', 200, 1.0))
+    assert [p['name'] for p in profile_capture.list_profiles()] == names[:0:-1]
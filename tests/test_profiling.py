@@ -0,0 +1,99 @@
+import datetime
+import pytest
+from webtest import TestApp
+from conftest import AuthClient
+from index import app
+from models import Client, Site, MaintenanceLog, Request
+import profiling
+
+@pytest.fixture
+def slow_log(tmp_path, monkeypatch):
+    import settings
+    path = str(tmp_path / 'slow_requests.log')
+    monkeypatch.setattr(settings, 'SLOW_LOG_PATH', path)
+    return path
+
+def _profiled_client(log_path, threshold_ms=0):
+    return AuthClient(TestApp(profiling.ProfilingMiddleware(app, root=app, threshold_ms=threshold_ms, log_path=log_path)))
+
+def test_slow_request_logged_with_sql(slow_log, admin_user, client_user_factory):
+    """しきい値を超えたリクエストがルート名・SQL・テンプレート時間・応答サイズ付きで記録されることを確認"""
+    client = Client.create(name="Perf", display_name="Perf")
+    user = client_user_factory(email="perf@test.com", client=client)
+    req = Request.create(client=client, subject="Slow", body="Body", created_by=user)
+    auth = _profiled_client(slow_log)
+    auth.login(admin_user.email)
+
+    res = auth.app.get(f'/admin/requests/{req.id}')
+    entry = profiling.read_entries(slow_log)[-1]
+    assert entry['route'] == 'GET /admin/requests/<id:int>'
+    assert entry['path'] == f'/admin/requests/{req.id}'
+    assert entry['status'] == 200
+    assert entry['queries'] == len(entry['sql']) > 0
+    assert any('"request"' in s['sql'] for s in entry['sql'])
+    assert entry['template_ms'] > 0
+    assert entry['bytes'] == len(res.body)
+    # 計測はリクエスト毎に終了している
+    assert profiling.current() is None
+
+def test_streamed_page_measured_until_close(slow_log, admin_user):
+    """ストリーミングで描画する画面も本文の送信完了までを計測することを確認"""
+    client = Client.create(name="Perf", display_name="Perf")
+    site = Site.create(client=client, name="Perf Site")
+    for i in range(5):
+        MaintenanceLog.create(site=site, performed_at=datetime.date.today(), category='Update', summary=f'Log {i}')
+    auth = _profiled_client(slow_log)
+    auth.login(admin_user.email)
+
+    res = auth.app.get(f'/admin/sites/{site.id}/logs')
+    entry = profiling.read_entries(slow_log)[-1]
+    assert entry['route'] == 'GET /admin/sites/<id:int>/logs'
+    assert entry['bytes'] == len(res.body)
+    assert entry['template_ms'] > 0
+    assert any('"maintenancelog"' in s['sql'] for s in entry['sql'])
+
+def test_fast_requests_not_logged(slow_log):
+    """しきい値未満のリクエストは記録しないことを確認"""
+    auth = _profiled_client(slow_log, threshold_ms=60 * 1000)
+    auth.app.get('/login')
+    assert profiling.read_entries(slow_log) == []
+
+def test_slow_log_rotation(slow_log, monkeypatch):
+    """ログが上限を超えると退避され、集計には退避分も含まれることを確認"""
+    import os
+    import settings
+    monkeypatch.setattr(settings, 'SLOW_LOG_MAX_BYTES', 300)
+    monkeypatch.setattr(settings, 'SLOW_LOG_BACKUPS', 2)
+    for i in range(10):
+        profiling.append_entry(slow_log, {'route': 'GET /x', 'total_ms': float(i), 'sql_ms': 0, 'queries': 1,
+                                          'template_ms': 0, 'time': f'2026-01-01T00:00:{i:02d}', 'pad': 'x' * 50})
+    assert os.path.exists(slow_log + '.1')
+    assert os.path.exists(slow_log + '.2')
+    assert not os.path.exists(slow_log + '.3')
+    entries = profiling.read_entries(slow_log)
+    assert [e['total_ms'] for e in entries] == sorted(e['total_ms'] for e in entries)
+    assert entries[-1]['total_ms'] == 9.0
+    summary = profiling.summarize(entries)
+    assert summary[0]['route'] == 'GET /x'
+    assert summary[0]['max_ms'] == 9.0
+    assert summary[0]['count'] == len(entries) < 10
+
+def test_admin_perf_page(slow_log, auth_client, admin_user):
+    """管理画面で遅いリクエストが画面別に表示されることを確認"""
+    profiling.append_entry(slow_log, {'route': 'GET /client/reports/monthly', 'method': 'GET', 'path': '/client/reports/monthly',
+                                      'status': 200, 'total_ms': 812.5, 'sql_ms': 640.0, 'queries': 12, 'template_ms': 150.0,
+                                      'bytes': 2048, 'time': '2026-01-01T00:00:00',
+                                      'sql': [{'sql': 'SELECT "t1"."id" FROM "maintenancelog" AS "t1"', 'ms': 600.0}],
+                                      'sql_truncated': 0})
+    auth_client.login(admin_user.email)
+    res = auth_client.app.get('/admin/perf')
+    assert 'GET /client/reports/monthly' in res.text
+    assert '812.5' in res.text
+    assert 'FROM &#34;maintenancelog&#34;' in res.text
+
+    # 画面で絞り込むと、その画面の記録のみ表示する
+    res = auth_client.app.get('/admin/perf', {'route': 'GET /client/reports/monthly'})
+    assert '最近の遅いリクエスト' in res.text
+    res = auth_client.app.get('/admin/perf', {'route': '<script>'})
+    assert '最近の遅いリクエスト' not in res.text
+    assert '<script>' not in res.text.split('</nav>')[-1]
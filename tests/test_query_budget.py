@@ -0,0 +1,198 @@
+import cProfile
+import datetime
+import re
+import pytest
+import profile_capture
+from models import Client, Site, MaintenanceLog, Notice, LogTemplate, Request, RequestMessage, SharedFile
+
+# 画面毎の SQL 実行回数の上限
+# データ件数（small / large）が違っても同じ上限で確認するため、テンプレートで行毎に関連を読み込む
+# （log.site など）変更をすると large 側で上限を超えて検出できる。失敗時は SQL と呼び出し元の行を出力する。
+# 上限を変える場合は、増えた理由（表示項目の追加など）を確認してから更新すること。
+
+SIZES = {
+    # クライアント数, クライアント毎のサイト数, サイト毎のログ・注意事項・ファイル数, クライアント毎の依頼数, 依頼毎のメッセージ数
+    'small': dict(clients=1, sites=1, items=2, requests=1, messages=1),
+    'large': dict(clients=3, sites=3, items=8, requests=4, messages=5),
+}
+
+# (ユーザー種別, メソッド, URL, 上限)
+ROUTES = [
+    # routes_admin.py
+    ('admin', 'GET', '/admin/', 7),
+    ('admin', 'GET', '/admin/clients', 5),
+    ('admin', 'GET', '/admin/clients/new', 4),
+    ('admin', 'GET', '/admin/clients/{client}', 5),
+    ('admin', 'GET', '/admin/clients/{client}/users', 6),
+    ('admin', 'POST', '/admin/clients/{client}/users/new', 3),
+    ('admin', 'GET', '/admin/sites', 6),
+    ('admin', 'GET', '/admin/sites/new', 5),
+    ('admin', 'GET', '/admin/sites/{site}', 7),
+    ('admin', 'GET', '/admin/sites/{site}/logs', 6),
+    ('admin', 'GET', '/admin/sites/{site}/logs/new', 6),
+    ('admin', 'GET', '/admin/logs/{log}/edit', 7),
+    ('admin', 'GET', '/admin/log_templates', 5),
+    ('admin', 'GET', '/admin/log_templates/new', 4),
+    ('admin', 'GET', '/admin/log_templates/{template}', 5),
+    ('admin', 'POST', '/admin/log_templates/{template}/delete', 3),
+    ('admin', 'GET', '/admin/reports/monthly/{client}', 8),
+    ('admin', 'GET', '/admin/reports/monthly/{client}/print', 8),
+    ('admin', 'GET', '/admin/settings', 4),
+    ('admin', 'GET', '/admin/sites/{site}/notices', 6),
+    ('admin', 'GET', '/admin/sites/{site}/files', 6),
+    ('admin', 'POST', '/admin/files/{file}/edit', 6),
+    ('admin', 'POST', '/admin/files/{file}/delete', 10),
+    ('admin', 'POST', '/admin/files/{file}/restore', 8),
+    ('admin', 'GET', '/admin/storage', 6),
+    ('admin', 'GET', '/admin/perf', 4),
+    ('admin', 'GET', '/admin/profiles', 4),
+    ('admin', 'GET', '/admin/profiles/{profile}', 4),
+    ('admin', 'GET', '/admin/profiles/{profile}/download', 1),
+    ('admin', 'GET', '/admin/sites/{site}/notices/new', 5),
+    ('admin', 'GET', '/admin/notices/{notice}/edit', 6),
+    ('admin', 'GET', '/admin/requests', 6),
+    ('admin', 'GET', '/admin/requests/{request}', 9),
+    ('admin', 'GET', '/admin/requests/{request}/create_log', 8),
+    # GET / POST 両方のルートの POST（登録・更新・返信・アップロード）
+    ('admin', 'POST', '/admin/clients/new', 3),
+    ('admin', 'POST', '/admin/clients/{client}', 4),
+    ('admin', 'POST', '/admin/sites/new', 3),
+    ('admin', 'POST', '/admin/sites/{site}', 4),
+    ('admin', 'POST', '/admin/sites/{site}/logs/new', 5),
+    ('admin', 'POST', '/admin/logs/{log}/edit', 6),
+    ('admin', 'POST', '/admin/log_templates/new', 2),
+    ('admin', 'POST', '/admin/log_templates/{template}', 3),
+    # 設定項目毎に get_or_create するため項目数に比例する（データ件数には依存しない）
+    ('admin', 'POST', '/admin/settings', 51),
+    ('admin', 'POST', '/admin/sites/{site}/files', 8),
+    ('admin', 'POST', '/admin/storage', 4),
+    ('admin', 'POST', '/admin/profiles', 1),
+    ('admin', 'POST', '/admin/sites/{site}/notices/new', 5),
+    ('admin', 'POST', '/admin/notices/{notice}/edit', 6),
+    ('admin', 'POST', '/admin/requests/{request}', 13),
+    # routes_client.py
+    ('client', 'GET', '/client/', 10),
+    ('client', 'GET', '/client/sites', 6),
+    ('client', 'GET', '/client/sites/{site}', 8),
+    ('client', 'GET', '/client/sites/{site}/files', 6),
+    ('client', 'GET', '/client/sites/{site}/files/bundle', 4),
+    ('client', 'GET', '/client/sites/{site}/logs', 6),
+    ('client', 'GET', '/client/logs', 6),
+    ('client', 'GET', '/client/reports/monthly', 9),
+    ('client', 'GET', '/client/reports/monthly/print', 9),
+    ('client', 'GET', '/client/requests', 5),
+    ('client', 'GET', '/client/requests/new', 5),
+    ('client', 'GET', '/client/requests/{request}', 9),
+    ('client', 'GET', '/client/requests/{request}/files/bundle', 4),
+    # 添付の容量確認を本文の保存前に行う。新規依頼は添付を保存できない場合に依頼も残さないよう1トランザクションで作成する
+    ('client', 'POST', '/client/requests/new', 17),
+    ('client', 'POST', '/client/requests/{request}', 15),
+]
+
+# POST で送る値
+_LOG_FORM = {'performed_at': '2026-01-15', 'category': 'Update', 'summary': 'Budget', 'details': 'Details',
+             'is_visible_to_client': 'on'}
+_TEMPLATE_FORM = {'name': 'Budget Template', 'category': 'Update', 'summary': 'Summary', 'is_active': 'on'}
+_NOTICE_FORM = {'title': 'Budget Notice', 'body': 'Body', 'is_visible_to_client': 'on'}
+POST_PARAMS = {
+    '/admin/clients/{client}/users/new': {'email': 'budget@test.com', 'password': 'password'},
+    '/admin/files/{file}/edit': {'title': 'Renamed', 'client_visible': 'on'},
+    '/admin/clients/new': {'name': 'Budget New', 'display_name': 'Budget New', 'is_active': 'on'},
+    '/admin/clients/{client}': {'name': 'Budget Edit', 'display_name': 'Budget Edit', 'is_active': 'on'},
+    '/admin/sites/new': {'client_id': '{client}', 'name': 'Budget Site', 'url': 'https://example.com', 'is_active': 'on'},
+    '/admin/sites/{site}': {'name': 'Budget Site', 'url': 'https://example.com', 'is_active': 'on'},
+    '/admin/sites/{site}/logs/new': _LOG_FORM,
+    '/admin/logs/{log}/edit': _LOG_FORM,
+    '/admin/log_templates/new': _TEMPLATE_FORM,
+    '/admin/log_templates/{template}': _TEMPLATE_FORM,
+    '/admin/settings': {'show_logs': 'on', 'show_requests': 'on'},
+    '/admin/sites/{site}/files': {'title': 'Budget File', 'client_visible': 'on'},
+    '/admin/storage': {'action': 'update_quota', 'client_id': '{client}', 'quota_mb': '100'},
+    '/admin/profiles': {'action': 'arm', 'route': 'GET /admin/sites', 'count': '1'},
+    '/admin/sites/{site}/notices/new': _NOTICE_FORM,
+    '/admin/notices/{notice}/edit': _NOTICE_FORM,
+    '/admin/requests/{request}': {'action': 'add_message', 'body': 'Budget reply'},
+    '/client/requests/new': {'site_id': '{site}', 'subject': 'Budget', 'body': 'Body', 'priority': 'normal'},
+    '/client/requests/{request}': {'body': 'Budget reply'},
+}
+
+# 添付ファイル（アップロード・添付付きの返信）
+POST_FILES = {
+    '/admin/sites/{site}/files': [('file', 'budget.txt', b'budget')],
+    '/admin/requests/{request}': [('file', 'budget.txt', b'budget')],
+    '/client/requests/new': [('file', 'budget.txt', b'budget')],
+    '/client/requests/{request}': [('file', 'budget.txt', b'budget')],
+}
+
+def _populate(size, admin_user, client_user_factory, shared_file_factory):
+    # 最初のクライアントの各データの id を返す
+    spec = SIZES[size]
+    today = datetime.date.today()
+    ids = {}
+    for c in range(spec['clients']):
+        client = Client.create(name=f"Budget {c}", display_name=f"Budget {c}")
+        user = client_user_factory(email=f"budget{c}@test.com", client=client)
+        for s in range(spec['sites']):
+            site = Site.create(client=client, name=f"Site {c}-{s}",
+                               domain_expire_date=today + datetime.timedelta(days=10),
+                               ssl_expire_date=today + datetime.timedelta(days=5))
+            for i in range(spec['items']):
+                log = MaintenanceLog.create(site=site, performed_at=today, category='Update', summary=f'Log {i}',
+                                            is_important=i % 2 == 0)
+                notice = Notice.create(site=site, title=f'Notice {i}', body='Body')
+                shared = shared_file_factory(admin_user, site=site, filename=f'doc{i}.txt')
+            ids.setdefault('site', site.id)
+            ids.setdefault('log', log.id)
+            ids.setdefault('notice', notice.id)
+            ids.setdefault('file', shared.id)
+        for r in range(spec['requests']):
+            req = Request.create(client=client, site=site, subject=f'Request {r}', body='Body', created_by=user)
+            shared_file_factory(user, request_obj=req, filename='attachment.txt')
+            for m in range(spec['messages']):
+                author, role = (user, 'client') if m % 2 == 0 else (admin_user, 'admin')
+                # 添付付きのメッセージも混ぜる
+                attached = shared_file_factory(author, request_obj=req, filename=f'reply{m}.txt') if m % 2 else None
+                RequestMessage.create(request=req, author_user=author, author_role=role, body=f'Message {m}',
+                                      shared_file=attached)
+            ids.setdefault('request', req.id)
+        ids.setdefault('client', client.id)
+        ids.setdefault('client_email', user.email)
+    for t in range(spec['items']):
+        template = LogTemplate.create(name=f'Template {t}', category='Update', summary='Summary')
+        ids.setdefault('template', template.id)
+    # cProfile の計測結果（データベースには保存しないため件数は一定）
+    profiler = cProfile.Profile()
+    profiler.enable()
+    profiler.disable()
+    ids['profile'] = profile_capture.save(profiler, 'GET /admin/sites', 'GET', '/admin/sites', 200, 1.0)
+    return ids
+
+def _csrf_token(app, role):
+    res = app.get('/admin/clients/new' if role == 'admin' else '/client/requests/new')
+    return re.search(r'name="csrf_token" value="([^"]+)"', res.text).group(1)
+
+@pytest.mark.parametrize('size', sorted(SIZES))
+@pytest.mark.parametrize('role, method, url, budget', ROUTES, ids=[f"{r[1]} {r[2]}" for r in ROUTES])
+def test_route_query_budget(role, method, url, budget, size, auth_client, admin_user, client_user_factory,
+                            shared_file_factory, query_budget):
+    """画面毎の SQL 実行回数が上限以内であることを確認"""
+    ids = _populate(size, admin_user, client_user_factory, shared_file_factory)
+    if role == 'admin':
+        auth_client.login(admin_user.email, 'password')
+    else:
+        auth_client.login(ids['client_email'], 'password')
+    path = url.format(**ids)
+    app = auth_client.app
+
+    if method == 'POST':
+        params = {key: value.format(**ids) for key, value in POST_PARAMS.get(url, {}).items()}
+        params['csrf_token'] = _csrf_token(app, role)
+        with query_budget(budget, f"POST {path} ({size})"):
+            res = app.post(path, params, upload_files=POST_FILES.get(url))
+        if url in POST_FILES:
+            # 添付が保存されずに処理だけ成功した場合を見逃さない
+            assert SharedFile.select().where(SharedFile.original_filename == 'budget.txt').exists()
+    else:
+        with query_budget(budget, f"GET {path} ({size})"):
+            res = app.get(path)
+    assert res.status_int in (200, 302, 303)
@@ -0,0 +1,54 @@
+import datetime
+from models import Site, MaintenanceLog, Request
+from read_models import request_rows, log_rows, RequestRow
+
+def test_request_rows_include_client_and_optional_site(client_factory, client_user_factory):
+    """依頼の行にクライアント名・サイト名が含まれ、サイト未指定（全体）の依頼も取得できることを確認"""
+    client = client_factory("Row Client")
+    user = client_user_factory(email="rows@test.com", client=client)
+    site = Site.create(client=client, name="Row Site")
+    Request.create(client=client, site=None, subject="Global", body="b", created_by=user)
+    Request.create(client=client, site=site, subject="With site", body="b", created_by=user)
+
+    rows = list(request_rows(Request.client == client, order_by=Request.id.desc()))
+    assert [r.subject for r in rows] == ["With site", "Global"]
+    assert isinstance(rows[0], RequestRow)
+    assert rows[0].client.display_name == "Row Client"
+    assert rows[0].site.name == "Row Site"
+    assert rows[1].site is None
+
+def test_report_queries_do_not_grow_with_logs(auth_client, client_factory, client_user_factory, test_db, monkeypatch):
+    """月次レポートのクエリ数がログの件数に比例しない（行毎にサイトを読み込まない）ことを確認"""
+    client = client_factory()
+    user = client_user_factory(email="report@test.com", client=client)
+    sites = [Site.create(client=client, name=f"Site {i}") for i in range(3)]
+    auth_client.login(user.email, 'password')
+
+    statements = []
+    original = test_db.execute_sql
+    def execute_sql(sql, params=None, *args, **kwargs):
+        statements.append(sql)
+        return original(sql, params, *args, **kwargs)
+    monkeypatch.setattr(test_db, 'execute_sql', execute_sql)
+
+    counts = []
+    for total in (3, 30):
+        MaintenanceLog.delete().execute()
+        for i in range(total):
+            MaintenanceLog.create(site=sites[i % 3], performed_at=datetime.date.today(),
+                                  category='Update', summary=f'Report log {i}')
+        del statements[:]
+        res = auth_client.app.get('/client/reports/monthly')
+        assert res.text.count('Report log') >= total
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+
+def test_log_rows_iterator_streams_without_caching(client_factory):
+    """StreamRows 用の iterator() は結果を保持せず、通常の反復は1回だけ実行されることを確認"""
+    site = Site.create(client=client_factory(), name="Iter Site")
+    MaintenanceLog.create(site=site, performed_at=datetime.date.today(), category='Update', summary='One')
+    rows = log_rows(MaintenanceLog.site == site)
+    assert [r.site.name for r in rows.iterator()] == ["Iter Site"]
+    assert rows._rows is None
+    assert rows.exists()
+    assert len(rows) == 1 and rows._rows is not None
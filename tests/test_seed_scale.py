@@ -0,0 +1,31 @@
+import datetime
+import sqlite3
+from models import set_db
+import seed_scale
+
+def _dump(path):
+    conn = sqlite3.connect(path)
+    try:
+        # データバージョンは生成時刻を含むため比較しない
+        return [line for line in conn.iterdump() if 'dataversion' not in line]
+    finally:
+        conn.close()
+
+def test_generate_is_deterministic_and_scaled(tmp_path, test_db):
+    """指定した規模で生成され、同じシード・基準日なら同じ内容になることを確認"""
+    options = dict(clients=3, sites=2, logs=10, requests=4, messages=2, files=3,
+                   seed=5, base_date=datetime.date(2026, 1, 1))
+    try:
+        counts = seed_scale.generate(str(tmp_path / 'a.db'), **options)
+        seed_scale.generate(str(tmp_path / 'b.db'), **options)
+    finally:
+        set_db(test_db)
+
+    assert counts['Client'] == 3
+    assert counts['User'] == 4
+    assert counts['Site'] == 6
+    assert counts['MaintenanceLog'] == 60
+    assert counts['Request'] == 12
+    assert counts['RequestMessage'] == 24
+    assert counts['SharedFile'] == 18
+    assert _dump(tmp_path / 'a.db') == _dump(tmp_path / 'b.db')
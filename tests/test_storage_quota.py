@@ -0,0 +1,109 @@
+import settings
+from models import Site, Request, RequestMessage, SharedFile, ClientStorageUsage
+from storage_quota import get_usage, recalculate_usage
+
+def _usage(client):
+    row = ClientStorageUsage.get_or_none(ClientStorageUsage.client == client.id)
+    return (row.used_bytes, row.file_count) if row else (0, 0)
+
+def test_usage_tracks_upload_delete_restore(auth_client, admin_user, client_factory, upload_dir):
+    """アップロード・削除・復元に合わせて使用量が差分更新されることを確認"""
+    client = client_factory()
+    site = Site.create(client=client, name="Site")
+    auth_client.login(admin_user.email, 'password')
+    auth_client.get_with_csrf('/admin/storage')
+
+    auth_client.app.post(f'/admin/sites/{site.id}/files', {
+        'csrf_token': auth_client.csrf_token, 'title': 'Doc', 'client_visible': 'on'
+    }, upload_files=[('file', 'doc.txt', b'a' * 1000)])
+    assert _usage(client) == (1000, 1)
+
+    f = SharedFile.get(SharedFile.site == site)
+    auth_client.app.post(f'/admin/files/{f.id}/delete', {'csrf_token': auth_client.csrf_token})
+    assert _usage(client) == (0, 0)
+    # 削除済みを再度削除しても二重に減らさない
+    auth_client.app.post(f'/admin/files/{f.id}/delete', {'csrf_token': auth_client.csrf_token})
+    assert _usage(client) == (0, 0)
+
+    auth_client.app.post(f'/admin/files/{f.id}/restore', {'csrf_token': auth_client.csrf_token})
+    assert _usage(client) == (1000, 1)
+
+    res = auth_client.app.get('/admin/storage')
+    assert client.display_name in res.text
+
+def test_client_upload_rejected_over_quota(auth_client, client_factory, client_user_factory, upload_dir, monkeypatch):
+    """容量上限を超える添付が本文の処理前に拒否されることを確認"""
+    monkeypatch.setattr(settings, 'CLIENT_STORAGE_QUOTA_BYTES', 100 * 1024)
+    client = client_factory()
+    user = client_user_factory(email="user@test.com", client=client)
+    site = Site.create(client=client, name="Site")
+    auth_client.login(user.email, 'password')
+    auth_client.get_with_csrf('/client/requests/new')
+
+    auth_client.app.post('/client/requests/new', {
+        'csrf_token': auth_client.csrf_token, 'site_id': site.id, 'subject': 'Big', 'body': 'Big'
+    }, upload_files=[('file', 'big.txt', b'a' * 200 * 1024)], status=413)
+    assert not Request.filter(subject='Big').exists()
+
+    res = auth_client.app.post('/client/requests/new', {
+        'csrf_token': auth_client.csrf_token, 'site_id': site.id, 'subject': 'Small', 'body': 'Small'
+    }, upload_files=[('file', 'small.txt', b'a' * 1024)])
+    assert res.status_code == 302
+    assert _usage(client) == (1024, 1)
+    assert get_usage(client.id) == (1024, 100 * 1024)
+
+def test_small_attachment_over_remaining_quota_rejected(auth_client, client_factory, client_user_factory, upload_dir, monkeypatch):
+    """フォームの余裕分より小さい添付でも、残り容量を超えれば依頼・返信を作成せずに拒否されることを確認"""
+    monkeypatch.setattr(settings, 'CLIENT_STORAGE_QUOTA_BYTES', 100 * 1024)
+    client = client_factory()
+    user = client_user_factory(email="user@test.com", client=client)
+    site = Site.create(client=client, name="Site")
+    auth_client.login(user.email, 'password')
+    auth_client.get_with_csrf('/client/requests/new')
+
+    res = auth_client.app.post('/client/requests/new', {
+        'csrf_token': auth_client.csrf_token, 'site_id': site.id, 'subject': 'First', 'body': 'First'
+    }, upload_files=[('file', 'first.txt', b'a' * 60 * 1024)])
+    assert res.status_code == 302
+    req = Request.get(Request.subject == 'First')
+
+    # 残り 40KB に対して 50KB（Content-Length は余裕分の 64KB 未満）
+    auth_client.app.post('/client/requests/new', {
+        'csrf_token': auth_client.csrf_token, 'site_id': site.id, 'subject': 'Second', 'body': 'Second'
+    }, upload_files=[('file', 'second.txt', b'a' * 50 * 1024)], status=413)
+    assert not Request.filter(subject='Second').exists()
+
+    auth_client.app.post(f'/client/requests/{req.id}', {
+        'csrf_token': auth_client.csrf_token, 'body': 'Reply'
+    }, upload_files=[('file', 'reply.txt', b'a' * 50 * 1024)], status=413)
+    assert not RequestMessage.filter(request=req).exists()
+    assert _usage(client) == (60 * 1024, 1)
+
+def test_recalculate_usage(admin_user, client_factory, shared_file_factory):
+    """既存ファイルから使用量を再集計できることを確認"""
+    client = client_factory()
+    site = Site.create(client=client, name="Site")
+    req = Request.create(client=client, subject="S", body="B", created_by=admin_user)
+    shared_file_factory(admin_user, site=site, content=b'a' * 10)
+    shared_file_factory(admin_user, request_obj=req, content=b'a' * 20)
+    shared_file_factory(admin_user, site=site, content=b'a' * 40, is_deleted=True)
+
+    recalculate_usage()
+    assert _usage(client) == (30, 2)
+
+def test_update_quota_validates_input(auth_client, admin_user, client_factory):
+    """容量上限の更新で不正な値は 500 にせず、メッセージを表示して戻ることを確認"""
+    client = client_factory()
+    auth_client.login(admin_user.email, 'password')
+    auth_client.get_with_csrf('/admin/storage')
+    for form in ({}, {'client_id': 'abc', 'quota_mb': '10'}, {'client_id': str(client.id), 'quota_mb': 'many'},
+                 {'client_id': str(client.id), 'quota_mb': '-1'}, {'client_id': '999999', 'quota_mb': '10'}):
+        res = auth_client.app.post('/admin/storage', dict(form, action='update_quota', csrf_token=auth_client.csrf_token))
+        assert res.status_int == 302
+        assert res.headers['Location'].endswith('/admin/storage')
+        assert any('flash_cat=danger' in v for k, v in res.headerlist if k == 'Set-Cookie')
+    assert ClientStorageUsage.get_or_none(ClientStorageUsage.client == client.id) is None
+
+    auth_client.app.post('/admin/storage', {'action': 'update_quota', 'client_id': str(client.id), 'quota_mb': '1.5',
+                                            'csrf_token': auth_client.csrf_token})
+    assert ClientStorageUsage.get(ClientStorageUsage.client == client.id).quota_bytes == int(1.5 * 1024 * 1024)
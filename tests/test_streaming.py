@@ -0,0 +1,80 @@
+import datetime
+import gzip
+from webob import Request as WebObRequest
+import templating
+from models import Site, MaintenanceLog
+from middleware import CompressionMiddleware
+
+def _create_logs(site, count):
+    for i in range(count):
+        MaintenanceLog.create(site=site, performed_at=datetime.date.today(), category='Update',
+                              summary=f'Streamed log {i:04d}', details='x' * 100)
+
+def _raw_get(app, path, cookies):
+    # webtest は本文を結合・展開してしまうため、WebOb で呼び出してチャンク単位で受け取る
+    req = WebObRequest.blank(path, headers={
+        'Accept-Encoding': 'gzip',
+        'Cookie': '; '.join(f'{k}={v}' for k, v in cookies.items())
+    })
+    status, headers, app_iter = req.call_application(app)
+    chunks = list(app_iter)
+    if hasattr(app_iter, 'close'):
+        app_iter.close()
+    return status, dict(headers), chunks
+
+def test_stream_yields_head_first_and_resolves_lazy_values():
+    """最初のチャンクで head を送り、遅延値は描画前に解決されることを確認"""
+    calls = []
+    def token():
+        calls.append(1)
+        return 'tok'
+    parts = templating.jinja2_stream('login.html', {
+        'error': None, 'csrf_token': templating.lazy(token), 'current_user': None, 'read_only_mode': False
+    })
+    # ジェネレータを回す前に解決済み
+    assert calls == [1]
+    chunks = list(parts)
+    assert chunks[0].lstrip().startswith('<!DOCTYPE html>')
+    assert 'tok' in ''.join(chunks)
+
+def test_admin_site_logs_streamed_and_compressed(auth_client, admin_user, client_factory):
+    """長いログ一覧が複数チャンクで送られ、圧縮しても内容が欠けないことを確認"""
+    from index import app
+    site = Site.create(client=client_factory(), name="Long Site")
+    _create_logs(site, 300)
+    auth_client.login(admin_user.email, 'password')
+
+    status, headers, chunks = _raw_get(app, f'/admin/sites/{site.id}/logs', auth_client.app.cookies)
+    assert status.startswith('200')
+    assert len(chunks) > 2
+    html = b''.join(chunks).decode('utf-8')
+    assert html.count('Streamed log') == 300
+    assert html.rstrip().endswith('</html>')
+
+    status, headers, chunks = _raw_get(CompressionMiddleware(app), f'/admin/sites/{site.id}/logs', auth_client.app.cookies)
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(b''.join(chunks)).decode('utf-8').count('Streamed log') == 300
+
+def test_client_logs_streaming_can_be_disabled(auth_client, client_factory, client_user_factory, monkeypatch):
+    """クライアントのログ一覧はストリーミングの有無で同じ内容になることを確認"""
+    import settings
+    client = client_factory()
+    user = client_user_factory(email="user@test.com", client=client)
+    site = Site.create(client=client, name="Client Site")
+    _create_logs(site, 20)
+    auth_client.login(user.email, 'password')
+
+    streamed = auth_client.app.get('/client/logs').text
+    assert streamed.count('Streamed log') == 20
+    assert 'サイト: Client Site' in streamed
+
+    monkeypatch.setattr(settings, 'TEMPLATE_STREAMING', False)
+    rendered = auth_client.app.get('/client/logs').text
+    assert rendered == streamed
+
+def test_empty_list_streamed(auth_client, client_factory, client_user_factory):
+    """ログが無い場合も空表示になることを確認"""
+    client = client_factory()
+    user = client_user_factory(email="user@test.com", client=client)
+    auth_client.login(user.email, 'password')
+    assert '指定された期間のログはありません。' in auth_client.app.get('/client/logs').text
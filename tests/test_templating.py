@@ -0,0 +1,87 @@
+import os
+import templating
+
+def test_bytecode_cache_written_and_reused(template_cache_dir):
+    """コンパイル済みテンプレートがキャッシュに保存され、新しい Environment から再利用されることを確認"""
+    templating.reset_environment()
+    templating.jinja2_template('login.html', {'error': None, 'csrf_token': 'x', 'current_user': None})
+    cached = os.listdir(template_cache_dir)
+    assert any(name.endswith('.cache') for name in cached)
+
+    # 新しいプロセス相当（Environment を作り直す）でもキャッシュファイルは増えない
+    templating.reset_environment()
+    html = templating.jinja2_template('login.html', {'error': None, 'csrf_token': 'x', 'current_user': None})
+    assert 'csrf_token' in html
+    assert sorted(os.listdir(template_cache_dir)) == sorted(cached)
+
+def test_precompiled_templates_are_loaded(tmp_path, monkeypatch):
+    """事前コンパイルしたテンプレートがモジュールとして読み込まれることを確認"""
+    import settings
+    target = tmp_path / 'compiled_templates'
+    count = templating.compile_all_templates(str(target))
+    assert count > 0
+    assert any(name.endswith('.py') for name in os.listdir(str(target)))
+
+    monkeypatch.setattr(settings, 'PRECOMPILED_TEMPLATE_DIR', str(target))
+    monkeypatch.setattr(settings, 'USE_PRECOMPILED_TEMPLATES', True)
+    templating.reset_environment()
+    try:
+        env = templating.get_environment()
+        tpl = env.get_template('login.html')
+        # ソースからではなくコンパイル済みモジュールから読み込まれている
+        assert tpl.filename.startswith(str(target))
+        assert 'csrf_token' in tpl.render(error=None, csrf_token='x', current_user=None)
+    finally:
+        templating.reset_environment()
+
+def test_compile_fails_on_syntax_error(tmp_path):
+    """構文エラーがある場合にビルドが失敗し、既存の出力を変更しないことを確認"""
+    import pytest
+    from jinja2 import Environment, DictLoader, TemplateSyntaxError
+    target = tmp_path / 'compiled_templates'
+    target.mkdir()
+    (target / 'keep.py').write_text('# previous build')
+
+    env = Environment(loader=DictLoader({'ok.html': 'ok', 'bad.html': '{% if %}'}))
+    with pytest.raises(TemplateSyntaxError):
+        templating.compile_all_templates(str(target), environment=env)
+    assert os.listdir(str(target)) == ['keep.py']
+
+def test_lazy_context_values(monkeypatch):
+    """遅延値はテンプレートが参照したときだけ、1回だけ計算されることを確認"""
+    import settings
+    monkeypatch.setattr(settings, 'TEMPLATE_CONTEXT_STATS', True)
+    templating.reset_context_usage()
+    calls = []
+    def expensive(name):
+        def _compute():
+            calls.append(name)
+            return name.upper()
+        return templating.lazy(_compute)
+
+    tpl = templating.get_environment().from_string("{{ used }}{{ used }}")
+    assert tpl.render(used=expensive('used'), unused=expensive('unused')) == 'USEDUSED'
+    assert calls == ['used']
+
+    report = templating.context_usage_report()[None]
+    assert report == {'renders': 1, 'used': ['used'], 'unused': ['unused']}
+    templating.reset_context_usage()
+
+def test_print_report_skips_unused_common_context(auth_client, client_factory, client_user_factory, monkeypatch):
+    """印刷用レポートでは参照されない CSRF トークンが計算されず、unused として記録されることを確認"""
+    import settings
+    client = client_factory()
+    user = client_user_factory(email="user@test.com", client=client)
+    auth_client.login(user.email, 'password')
+
+    monkeypatch.setattr(settings, 'TEMPLATE_CONTEXT_STATS', True)
+    templating.reset_context_usage()
+    res = auth_client.app.get('/client/reports/monthly/print')
+    # ログイン直後はセッションに CSRF トークンがないが、このページでは発行されない
+    assert 'Set-Cookie' not in res.headers
+
+    report = templating.context_usage_report()['client/report_monthly.html']
+    assert report['renders'] == 1
+    assert 'logs' in report['used']
+    assert 'csrf_token' in report['unused']
+    templating.reset_context_usage()
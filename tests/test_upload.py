@@ -0,0 +1,131 @@
+import hashlib
+import os
+import time
+import pytest
+import settings
+from models import Site, Request, SharedFile
+
+@pytest.fixture
+def staging_dir(tmp_path, monkeypatch, upload_dir):
+    path = tmp_path / 'staging'
+    monkeypatch.setattr(settings, 'UPLOAD_STAGING_DIR', str(path))
+    monkeypatch.setattr(settings, 'UPLOAD_CHUNK_BYTES', 8)
+    return path
+
+def _put_chunk(auth_client, upload_id, index, data, sha=None, status=200):
+    return auth_client.app.put(
+        f'/uploads/{upload_id}/chunks/{index}', data,
+        headers={
+            'X-CSRF-Token': auth_client.csrf_token,
+            'X-Chunk-SHA256': sha or hashlib.sha256(data).hexdigest(),
+            'Content-Type': 'application/octet-stream'
+        },
+        status=status
+    )
+
+def test_chunked_upload_resume_and_finalize(auth_client, admin_user, client_factory, staging_dir, upload_dir):
+    """分割アップロードが再送・再開を許容し、完了時に SharedFile を作成することを確認"""
+    site = Site.create(client=client_factory(), name="Site")
+    content = b'0123456789abcdefghij'
+    auth_client.login(admin_user.email, 'password')
+    auth_client.get_with_csrf('/admin/clients/new')
+
+    res = auth_client.app.post_json('/uploads', {
+        'filename': 'report.txt',
+        'size': len(content),
+        'site_id': site.id,
+        'sha256': hashlib.sha256(content).hexdigest()
+    }, headers={'X-CSRF-Token': auth_client.csrf_token}, status=201)
+    upload_id = res.json['upload_id']
+    assert res.json['next_chunk'] == 0
+
+    _put_chunk(auth_client, upload_id, 0, content[0:8])
+    # 応答を受け取れなかった場合の再送は成功扱い
+    _put_chunk(auth_client, upload_id, 0, content[0:8])
+    # ハッシュ不一致は拒否され、受信位置は進まない
+    _put_chunk(auth_client, upload_id, 1, content[8:16], sha='0' * 64, status=400)
+    # 空のチャンクは拒否され、受信位置は進まない
+    _put_chunk(auth_client, upload_id, 1, b'', status=400)
+    # ヘッダーのトークンがないチャンクは本文をフォームとして読まずに拒否
+    body = f'csrf_token={auth_client.csrf_token}'.encode()
+    auth_client.app.put(f'/uploads/{upload_id}/chunks/1', body, headers={
+        'X-Chunk-SHA256': hashlib.sha256(body).hexdigest(),
+        'Content-Type': 'application/octet-stream'
+    }, status=403)
+    # 飛ばしたチャンクは拒否
+    res = _put_chunk(auth_client, upload_id, 2, content[16:], status=409)
+    assert res.json['next_chunk'] == 1
+
+    # 状態取得で再開位置がわかる
+    res = auth_client.app.get(f'/uploads/{upload_id}')
+    assert res.json['next_chunk'] == 1
+    assert res.json['received_bytes'] == 8
+
+    # 未完了のままでは確定できない
+    auth_client.app.post(f'/uploads/{upload_id}/finalize', headers={'X-CSRF-Token': auth_client.csrf_token}, status=409)
+
+    _put_chunk(auth_client, upload_id, 1, content[8:16])
+    _put_chunk(auth_client, upload_id, 2, content[16:])
+    res = auth_client.app.post(f'/uploads/{upload_id}/finalize', headers={'X-CSRF-Token': auth_client.csrf_token})
+
+    f = SharedFile.get_by_id(res.json['file_id'])
+    assert f.site.id == site.id
+    assert f.size_bytes == len(content)
+    with open(os.path.join(str(upload_dir), f.stored_path), 'rb') as fp:
+        assert fp.read() == content
+    assert not (staging_dir / upload_id).exists()
+    # 再試行などで2回目の確定が届いても 500 にせず、ファイルも重複して作らない
+    auth_client.app.post(f'/uploads/{upload_id}/finalize', headers={'X-CSRF-Token': auth_client.csrf_token}, status=404)
+    assert SharedFile.select().where(SharedFile.site == site).count() == 1
+
+def test_chunked_upload_permissions(auth_client, admin_user, client_factory, client_user_factory, staging_dir):
+    """クライアントは自社の依頼にのみ分割アップロードでき、サイトには添付できないことを確認"""
+    client1 = client_factory(name="Client 1")
+    client2 = client_factory(name="Client 2")
+    user1 = client_user_factory(email="user1@test.com", client=client1)
+    site1 = Site.create(client=client1, name="Site 1")
+    own_req = Request.create(client=client1, subject="Own", body="Own", created_by=user1)
+    other_req = Request.create(client=client2, subject="Other", body="Other", created_by=admin_user)
+
+    auth_client.login(user1.email, 'password')
+    auth_client.get_with_csrf('/client/requests/new')
+    headers = {'X-CSRF-Token': auth_client.csrf_token}
+    auth_client.app.post_json('/uploads', {'filename': 'a.txt', 'size': 1, 'request_id': own_req.id}, headers=headers, status=201)
+    auth_client.app.post_json('/uploads', {'filename': 'a.txt', 'size': 1, 'request_id': other_req.id}, headers=headers, status=403)
+    auth_client.app.post_json('/uploads', {'filename': 'a.txt', 'size': 1, 'site_id': site1.id}, headers=headers, status=403)
+    auth_client.app.post_json('/uploads', {'filename': 'a.exe', 'size': 1, 'request_id': own_req.id}, headers=headers, status=400)
+
+def test_chunked_upload_expired_staging_is_purged(admin_user, staging_dir):
+    """放置されたステージングデータが期限切れで削除されることを確認"""
+    from chunked_upload import create_upload, purge_expired_uploads
+    meta, error = create_upload(admin_user, 'a.txt', 10, site_id=1)
+    assert error is None
+    assert purge_expired_uploads() == 0
+    assert purge_expired_uploads(now=time.time() + settings.UPLOAD_STAGING_EXPIRE_SECONDS + 1) == 1
+    assert not (staging_dir / meta['upload_id']).exists()
+
+def test_chunked_upload_lock_serializes_requests(admin_user, staging_dir):
+    """同じアップロードへの処理はロックで直列化され、待っている間に確定・中止されたものは None になることを確認"""
+    import threading
+    from chunked_upload import create_upload, locked_upload, discard_upload
+    meta, error = create_upload(admin_user, 'a.txt', 10, site_id=1)
+    upload_id = meta['upload_id']
+    seen = []
+
+    def _second():
+        with locked_upload(upload_id) as locked:
+            seen.append(locked)
+
+    with locked_upload(upload_id) as locked:
+        assert locked['upload_id'] == upload_id
+        thread = threading.Thread(target=_second)
+        thread.start()
+        thread.join(0.2)
+        # ロックを解放するまで待たされる
+        assert thread.is_alive() and seen == []
+        discard_upload(locked)
+    thread.join(5)
+    assert seen == [None]
+    # 削除後は待たずに None
+    with locked_upload(upload_id) as locked:
+        assert locked is None
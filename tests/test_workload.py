@@ -0,0 +1,86 @@
+import pytest
+from webtest import TestApp
+from conftest import AuthClient
+from index import app
+from models import Client, Site
+from profiling import ProfilingMiddleware
+import workload
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    import settings
+    path = str(tmp_path / 'workload.jsonl')
+    monkeypatch.setattr(settings, 'WORKLOAD_CAPTURE_ENABLED', True)
+    monkeypatch.setattr(settings, 'WORKLOAD_CAPTURE_PATH', path)
+    return path
+
+def _profiled_client():
+    return AuthClient(TestApp(ProfilingMiddleware(app, root=app, log_path='')))
+
+def test_capture_sanitized(capture, admin_user):
+    """ルート・引数・クエリの形・ロール・所要時間が記録され、入力値は記録されないことを確認"""
+    client = Client.create(name="Workload", display_name="Workload")
+    site = Site.create(client=client, name="Workload Site")
+    auth = _profiled_client()
+    auth.login(admin_user.email)
+    auth.app.get(f'/admin/sites/{site.id}/logs', {'q': 'Secret Search Term', 'month': '2026-01', 'status': 'new'})
+    auth.get_with_csrf('/admin/clients/new')
+    auth.app.post('/admin/clients/new', {'csrf_token': auth.csrf_token, 'name': 'Confidential Name', 'display_name': 'CN'})
+
+    with open(capture, encoding='utf-8') as f:
+        raw = f.read()
+    for secret in (admin_user.email, 'Secret Search Term', 'Confidential Name', auth.csrf_token):
+        assert secret not in raw
+    entries = workload.read(capture)
+    login = next(e for e in entries if e['route'] == '/login' and e['method'] == 'POST')
+    # フォームは項目名と長さのみ
+    assert login['form'] == {'fields': {'email': len(admin_user.email), 'password': len('password')}}
+
+    logs = next(e for e in entries if e['route'] == '/admin/sites/<id:int>/logs')
+    assert logs['args'] == {'id': site.id}
+    assert logs['query'] == [['q', {'len': 18}], ['month', {'value': '2026-01'}], ['status', {'value': 'new'}]]
+    assert logs['role'] == 'admin'
+    assert logs['user_id'] == admin_user.id
+    assert logs['status'] == 200
+    assert logs['total_ms'] > 0
+    assert logs['queries'] > 0
+    assert 'form' not in logs
+
+    created = next(e for e in entries if e['route'] == '/admin/clients/new' and e['method'] == 'POST')
+    assert created['form'] == {'fields': {'name': 17, 'display_name': 2}}
+    assert created['status'] == 302
+
+def test_capture_disabled(tmp_path, monkeypatch, admin_user):
+    """無効な場合は記録しないことを確認"""
+    import os
+    import settings
+    path = str(tmp_path / 'workload.jsonl')
+    monkeypatch.setattr(settings, 'WORKLOAD_CAPTURE_PATH', path)
+    monkeypatch.setattr(settings, 'WORKLOAD_CAPTURE_ENABLED', False)
+    _profiled_client().app.get('/login')
+    assert not os.path.exists(path)
+
+def test_search_terms_not_kept():
+    """検索語は英字・数字だけでも値を残さず、選択肢・ID の項目のみ値を残すことを確認"""
+    shape = workload.query_shape('q=tanaka&q=yamada_taro&q=090123456&status=new&client_id=12&sort=name')
+    assert shape == [['q', {'len': 6}], ['q', {'len': 11}], ['q', {'len': 9}],
+                     ['status', {'value': 'new'}], ['client_id', {'value': '12'}], ['sort', {'value': 'name'}]]
+    # 値を残す項目でも形が合わないものは長さだけ
+    assert workload.query_shape('status=Free Text') == [['status', {'len': 9}]]
+
+def test_replay_url():
+    """記録から再現する URL を組み立てられること、値のない引数は再現しないことを確認"""
+    entry = {'route': '/admin/sites/<id:int>/logs', 'args': {'id': 3},
+             'query': [['q', {'len': 3}], ['month', {'value': '2026-01'}]]}
+    assert workload.replay_url(entry) == '/admin/sites/3/logs?q=xxx&month=2026-01'
+    assert workload.replay_url({'route': '/files/<token>', 'args': {'token': {'len': 40}}, 'query': []}) is None
+    assert workload.replay_url({'route': '(unmatched)', 'args': {}, 'query': []}) is None
+
+def test_read_skips_partial_line(tmp_path):
+    """書き込み途中の行を読み飛ばし、時刻順に並べることを確認"""
+    path = str(tmp_path / 'workload.jsonl')
+    workload.append({'t': 2.0, 'route': '/b'}, path)
+    workload.append({'t': 1.0, 'route': '/a'}, path)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"t": 3.0, "rou')
+    assert [e['route'] for e in workload.read(path)] == ['/a', '/b']
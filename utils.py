@@ -63,7 +63,33 @@ def get_prev_next_month(year_month):
     
     return prev_month, next_month
 
+def _request_cached(name, load):
+    # 同じリクエストの中では1回だけ読み込む（ルートとテンプレートの両方から参照されるため）
+    # 設定を変更した場合（models.settings_change_count が変わった場合）は読み込み直す
+    from bottle import request
+    import metrics
+    import models
+    try:
+        cache = request.environ.setdefault('maintainview.request_cache', {})
+    except RuntimeError:
+        # リクエストの外（スクリプトなど）
+        return load()
+    entry = cache.get(name)
+    if entry is not None and entry[0] == models.settings_change_count:
+        metrics.cache_event(name, True)
+        return dict(entry[1])
+    metrics.cache_event(name, False)
+    value = load()
+    cache[name] = (models.settings_change_count, value)
+    return dict(value)
+
 def get_display_labels():
+    return _request_cached('labels', _load_display_labels)
+
+def get_app_settings():
+    return _request_cached('settings', _load_app_settings)
+
+def _load_display_labels():
     from models import DisplayLabel, AppSetting
     from settings import DEFAULT_LABELS
     
@@ -87,7 +113,7 @@ def get_display_labels():
         
     return labels
 
-def get_app_settings():
+def _load_app_settings():
     from models import AppSetting
     from settings import DEFAULT_SETTINGS
     
@@ -118,9 +144,31 @@ def verify_file_token(token):
         return None
 
 def save_uploaded_file(upload, user, site=None, request_obj=None, title=None, description=None, category=None, client_visible=True):
+    from storage_quota import file_client_id
+    stored, error = store_uploaded_file(upload, user, file_client_id(site, request_obj))
+    if error:
+        return None, error
+    save_path, size = stored
+    shared_file = create_shared_file_record(
+        save_path,
+        upload.filename,
+        size,
+        user,
+        site=site,
+        request_obj=request_obj,
+        title=title,
+        description=description,
+        category=category,
+        content_type=upload.content_type,
+        client_visible=client_visible
+    )
+    return shared_file, None
+
+def store_uploaded_file(upload, user, client_id=None):
+    # 検証して実ファイルだけを UPLOAD_DIR/<uuid>/ に保存し、((保存先, サイズ), None) を返す
+    # SharedFile はまだ作らない（書き込み中にデータベースのロックを持たないよう、トランザクションの前に呼ぶ）
     import os
     import uuid
-    from models import SharedFile
     from settings import UPLOAD_DIR, MAX_UPLOAD_BYTES, ALLOWED_EXTENSIONS
     
     if not upload or not upload.filename:
@@ -136,6 +184,13 @@ def save_uploaded_file(upload, user, site=None, request_obj=None, title=None, de
     upload.file.seek(0)
     if size > MAX_UPLOAD_BYTES:
         return None, f"ファイルサイズが大きすぎます (最大 {MAX_UPLOAD_BYTES/1024/1024}MB)"
+
+    # クライアントからのアップロードは容量上限を確認する
+    if user.role == 'client':
+        from storage_quota import check_quota
+        error = check_quota(client_id, size)
+        if error:
+            return None, error
     
     file_uuid = str(uuid.uuid4())
     save_dir = os.path.join(UPLOAD_DIR, file_uuid)
@@ -143,18 +198,118 @@ def save_uploaded_file(upload, user, site=None, request_obj=None, title=None, de
     
     save_path = os.path.join(save_dir, upload.filename)
     upload.save(save_path)
-    
-    shared_file = SharedFile.create(
-        site=site,
-        request=request_obj,
-        uploaded_by=user,
-        title=title or upload.filename,
-        description=description,
-        category=category,
-        original_filename=upload.filename,
-        stored_path=os.path.relpath(save_path, UPLOAD_DIR),
-        size_bytes=size,
-        content_type=upload.content_type,
-        client_visible=client_visible
-    )
-    return shared_file, None
+    import metrics
+    metrics.inc('mv_upload_bytes_total', size)
+    return (save_path, size), None
+
+def create_shared_file_record(save_path, filename, size, user, site=None, request_obj=None, title=None, description=None, category=None, content_type=None, client_visible=True):
+    # 保存済みの実ファイルに対応する SharedFile を作成する（通常アップロード・分割アップロード共通）
+    # 使用量の更新も同一トランザクションで行う
+    import os
+    from models import db, SharedFile
+    from settings import UPLOAD_DIR
+    from storage_quota import adjust_usage, file_client_id
+    with db.atomic():
+        shared_file = SharedFile.create(
+            site=site,
+            request=request_obj,
+            uploaded_by=user,
+            title=title or filename,
+            description=description,
+            category=category,
+            original_filename=filename,
+            stored_path=os.path.relpath(save_path, UPLOAD_DIR),
+            size_bytes=size,
+            content_type=content_type,
+            client_visible=client_visible
+        )
+        adjust_usage(file_client_id(site, request_obj), size, 1)
+    return shared_file
+
+class _ZipStreamSink(object):
+    # zipfile の書き込み先。シーク不可のストリームとして振る舞い、書き込まれたデータを溜めて順次取り出す
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_zip_bundle(files):
+    # 一時ファイルを作らず、ZIPをその場で組み立てながらチャンク単位で返すジェネレータ
+    # メモリ使用量はファイル数・サイズに関わらず ZIP_CHUNK_BYTES 程度に収まる
+    import os
+    import zipfile
+    from settings import UPLOAD_DIR, ZIP_STORED_EXTENSIONS, ZIP_CHUNK_BYTES
+
+    import metrics
+
+    sink = _ZipStreamSink()
+    used_names = set()
+    sent = 0
+    with zipfile.ZipFile(sink, 'w') as zf:
+        for f in files:
+            path = os.path.join(UPLOAD_DIR, f.stored_path)
+            if not os.path.isfile(path):
+                continue
+
+            # 同名ファイルは連番を付けて重複を避ける
+            name, ext = os.path.splitext(f.original_filename)
+            arcname = f.original_filename
+            n = 1
+            while arcname in used_names:
+                n += 1
+                arcname = f"{name} ({n}){ext}"
+            used_names.add(arcname)
+
+            info = zipfile.ZipInfo(arcname, date_time=f.created_at.timetuple()[:6])
+            if ext.lower() in ZIP_STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            info.file_size = os.path.getsize(path)
+
+            with open(path, 'rb') as src, zf.open(info, 'w') as dst:
+                while True:
+                    buf = src.read(ZIP_CHUNK_BYTES)
+                    if not buf:
+                        break
+                    dst.write(buf)
+                    data = sink.pop()
+                    if data:
+                        sent += len(data)
+                        yield data
+            data = sink.pop()
+            if data:
+                sent += len(data)
+                yield data
+    # セントラルディレクトリ
+    data = sink.pop()
+    metrics.inc('mv_download_bytes_total', sent + len(data))
+    yield data
+
+def zip_bundle_response(files, filename):
+    from bottle import response
+    response.content_type = 'application/zip'
+    response.set_header('Content-Disposition', f'attachment; filename="{filename}"')
+    return iter_zip_bundle(files)
+
+def rotate_file(path, backups):
+    # path を path.1 に退避し、既存の path.1〜 を1つずつずらす（backups を超える分は上書きで消える。0 なら削除のみ）
+    import os
+    for i in range(backups - 1, 0, -1):
+        src = f"{path}.{i}"
+        if os.path.exists(src):
+            os.replace(src, f"{path}.{i + 1}")
+    if backups > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.remove(path)
@@ -0,0 +1,125 @@
+import json
+import os
+import re
+import time
+import urllib.parse
+
+import settings
+
+# 実際のアクセスの記録（bench/replay.py で再現して、変更前後の応答時間を比較するため）
+# ProfilingMiddleware がリクエストの終了時に呼び、WORKLOAD_CAPTURE_PATH に1行1件の JSON で追記する。
+# 入力値そのものは記録しない:
+#   - クエリは選択肢・ID の項目（status=new など）のみ値を残し、それ以外（検索語など）は長さだけ
+#   - フォームは項目名と長さ、ファイルは件数とサイズのみ（本文・パスワード・トークンは含まない）
+#   - ユーザーはロールと ID のみ
+
+# 値を残すクエリ（選択肢・ID の項目のみ。値の形が合わないものは長さだけ）
+_KEEP_PARAMS = {'status', 'month', 'client_id', 'show_deleted', 'sort'}
+_KEEP_VALUE = re.compile(r'^(\d{1,12}|\d{4}-\d{2}(-\d{2})?|[a-z_]{1,20})$')
+# 記録しないクエリ（署名付き URL などのトークン）
+_DROP_PARAMS = {'_profile', 'csrf_token'}
+
+def param_shape(key, value):
+    # {'value': 値} または {'len': 文字数}
+    if key in _KEEP_PARAMS and _KEEP_VALUE.match(value):
+        return {'value': value}
+    return {'len': len(value)}
+
+def query_shape(query_string):
+    shape = []
+    for key, value in urllib.parse.parse_qsl(query_string, keep_blank_values=True):
+        if key in _DROP_PARAMS:
+            continue
+        shape.append([key, param_shape(key, value)])
+    return shape
+
+def args_shape(args):
+    # ルートの引数（<id:int> などは値を残す）
+    return {key: value if isinstance(value, int) else {'len': len(str(value))} for key, value in (args or {}).items()}
+
+def form_shape(environ):
+    # 本文は ProfilingMiddleware の終了時点で bottle が解析済みの場合のみ（ここで読み込まない）
+    forms = environ.get('bottle.request.forms')
+    files = environ.get('bottle.request.files')
+    shape = {}
+    if forms is not None:
+        shape['fields'] = {key: len(value) for key, value in forms.allitems() if key not in _DROP_PARAMS}
+    if files is not None:
+        sizes = []
+        for _, upload in files.allitems():
+            try:
+                upload.file.seek(0, os.SEEK_END)
+                sizes.append(upload.file.tell())
+            except (AttributeError, OSError, ValueError):
+                # 保存済みで閉じられている
+                sizes.append(None)
+        shape['files'] = sizes
+    return shape or None
+
+def build_entry(environ, route, status, total_ms, queries):
+    user = environ.get('maintainview.user')
+    entry = {
+        't': round(time.time(), 3),
+        'method': environ.get('REQUEST_METHOD', 'GET'),
+        'route': route,
+        'args': args_shape(environ.get('route.url_args')),
+        'query': query_shape(environ.get('QUERY_STRING', '')),
+        'role': user.role if user else None,
+        'user_id': user.id if user else None,
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'queries': queries
+    }
+    if entry['method'] not in ('GET', 'HEAD'):
+        entry['form'] = form_shape(environ)
+    return entry
+
+def append(entry, path=None):
+    # 追記のみ（O_APPEND の1回の write で、複数プロセスからでも行が混ざらない）
+    path = path or settings.WORKLOAD_CAPTURE_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, (json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8'))
+    finally:
+        os.close(fd)
+
+def read(path):
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # 書き込み途中で止まった行
+                continue
+    entries.sort(key=lambda e: e.get('t', 0))
+    return entries
+
+_RULE_ARG = re.compile(r'<([a-zA-Z_][a-zA-Z_0-9]*)(?::[^>]*)?>')
+
+def replay_url(entry):
+    # 記録から再現する URL（値を残していない引数がある場合は None）
+    if not entry.get('route', '').startswith('/'):
+        # どのルートにも一致しなかったリクエスト
+        return None
+    args = entry.get('args') or {}
+    missing = []
+
+    def _arg(match):
+        value = args.get(match.group(1))
+        if not isinstance(value, int):
+            missing.append(match.group(1))
+            return ''
+        return str(value)
+
+    path = _RULE_ARG.sub(_arg, entry['route'])
+    if missing:
+        return None
+    query = [(key, shape['value'] if 'value' in shape else 'x' * shape.get('len', 0)) for key, shape in entry.get('query') or []]
+    return path + ('?' + urllib.parse.urlencode(query) if query else '')